@@ -1,15 +1,23 @@
 # app.py
 import streamlit as st
-from ingest import ingest_local_documents
-from vectorstore import VectorStore
-from web_search import web_retrieve
-from planner import simple_plan
-from synthesizer import build_report
+from vectorstore import VectorStore, sync_index_aside, RETRIEVAL_MODE
+from pipeline import run_research
+from telemetry import serve_metrics
+from query_cache import CACHE as QUERY_CACHE
+from retrieval_server import RetrievalClient, RETRIEVAL_SERVER
+from reranker import RERANK
+from map_reduce import SYNTH_MODE, SYNTH_MODES
+from filters import SearchFilter
+from datetime import datetime
 import os
-import time
+import threading
 
 st.set_page_config(page_title="OneTuZa RAG Research Agent", layout="wide")
 
+# Prometheus scrape endpoint (shared by all sessions of this server process)
+if os.getenv("METRICS_PORT"):
+    serve_metrics(int(os.getenv("METRICS_PORT")))
+
 # ------------------- Styled Main Header -------------------
 st.markdown(
     """
@@ -27,41 +35,94 @@ st.sidebar.header("Settings")
 docs_folder = st.sidebar.text_input("Local docs folder", "docs/")
 top_k_local = st.sidebar.slider("Top-k local chunks", 1, 10, 5)
 top_k_web = st.sidebar.slider("Top-k web results", 1, 5, 3)
+retrieval_mode = st.sidebar.selectbox(
+    "Local retrieval", ["hybrid", "dense", "lexical"],
+    index=["hybrid", "dense", "lexical"].index(RETRIEVAL_MODE) if RETRIEVAL_MODE in ("hybrid", "dense", "lexical") else 0
+)
+synth_mode = st.sidebar.selectbox(
+    "Synthesis", SYNTH_MODES, index=SYNTH_MODES.index(SYNTH_MODE) if SYNTH_MODE in SYNTH_MODES else 0,
+    help="map_reduce summarizes each plan step concurrently, then merges the partial summaries"
+)
+use_rerank = st.sidebar.checkbox("Re-rank local chunks (cross-encoder)", value=RERANK)
 use_existing_index = st.sidebar.checkbox(
     "Use prebuilt FAISS index (faiss.index)", value=False
 )
 build_index_btn = st.sidebar.button("(Re)build index now")
+use_query_cache = st.sidebar.checkbox("Reuse answers to similar questions", value=True)
+qc = QUERY_CACHE.stats()
+st.sidebar.caption(
+    f"Answer cache: {qc['entries']} entries, {qc['hits']['exact']} exact + "
+    f"{qc['hits']['semantic']} similar hits, {qc['hit_rate']:.0%} hit rate"
+)
 
 # ---------------- Build / Load Vectorstore ----------------
-if "vs" not in st.session_state:
-    st.session_state.vs = None
+class SharedStore:
+    """
+    The store shared by every session of this server process. A sync builds
+    the updated store aside and swaps `store`, so sessions still searching
+    the previous one (they run on other threads) never see it change.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._lock = threading.Lock()  # one sync at a time
+
+    def sync(self, folder: str, path: str = "faiss.index"):
+        with self._lock:
+            if isinstance(self.store, RetrievalClient):
+                return self.store.sync(folder, path)  # the server swaps on its side
+            self.store, stats = sync_index_aside(self.store, folder, path)
+            return stats
+
 
-if build_index_btn or st.session_state.vs is None:
+@st.cache_resource
+def get_store():
+    """
+    One model + index per server process, shared by every session; with
+    RETRIEVAL_SERVER set, a client of the shared retrieval server instead.
+    """
+    if RETRIEVAL_SERVER:
+        return SharedStore(RetrievalClient(RETRIEVAL_SERVER))
+    store = VectorStore()
+    if os.path.exists("faiss.index"):
+        store.load("faiss.index")
+    return SharedStore(store)
+
+
+shared = get_store()
+vs = shared.store  # this run keeps using the store it started with
+if build_index_btn or (not vs.ntotal and not use_existing_index):
     with st.spinner("Ingesting local docs and building vector store..."):
-        chunks = ingest_local_documents(docs_folder)
-        vs = VectorStore()
-        if chunks:
-            vs.build(chunks)
-            vs.save("faiss.index")
-            st.session_state.vs = vs
-            st.success(f"Built index with {len(chunks)} chunks.")
+        stats = shared.sync(docs_folder, "faiss.index")
+        vs = shared.store
+        if stats["total_vectors"]:
+            st.success(
+                f"Index has {stats['total_vectors']} chunks "
+                f"({stats['added']} added, {stats['changed']} changed, {stats['removed']} removed, "
+                f"{stats['unchanged']} unchanged files; {stats['chunks_embedded']} chunks embedded)."
+            )
         else:
             st.warning("No chunks found in docs folder. Please add PDFs/MDs to `docs/`.")
-else:
-    if use_existing_index and os.path.exists("faiss.index"):
-        vs = VectorStore()
-        vs.load("faiss.index")
-        st.session_state.vs = vs
-    elif st.session_state.vs is None:
-        if os.path.exists("faiss.index"):
-            vs = VectorStore()
-            vs.load("faiss.index")
-            st.session_state.vs = vs
-        else:
-            st.info("No vector store found. Click '(Re)build index now' to ingest docs.")
             st.stop()
-    else:
-        vs = st.session_state.vs
+elif not vs.ntotal:
+    st.info("No vector store found. Click '(Re)build index now' to ingest docs.")
+    st.stop()
+
+# ---------------- Metadata Filters ----------------
+filter_opts = vs.filter_options()
+with st.sidebar.expander("Filter local documents"):
+    f_sources = st.multiselect("Sources", filter_opts["sources"])
+    f_exts = st.multiselect("File types", filter_opts["extensions"])
+    f_tags = st.multiselect("Tags", filter_opts["tags"], help="from tags.json in the docs folder")
+    f_page_min = st.number_input("First PDF page (0 = any)", min_value=0, value=0, step=1)
+    f_page_max = st.number_input("Last PDF page (0 = any)", min_value=0, value=0, step=1)
+    f_recent = st.checkbox("Only recently ingested documents")
+    f_since = st.date_input("Ingested since", disabled=not f_recent)
+search_filter = SearchFilter(
+    sources=f_sources, extensions=f_exts, tags=f_tags,
+    page_min=int(f_page_min) or None, page_max=int(f_page_max) or None,
+    ingested_after=datetime.combine(f_since, datetime.min.time()).timestamp() if f_recent else None
+)
 
 # ------------------- Main Workflow -------------------
 st.markdown("## 🔹 Enter Research Question")
@@ -71,72 +132,89 @@ question = st.text_area(
     value=""
 )
 
+def render_local_hits(hits):
+    for h in hits:
+        st.markdown(
+            f"""
+            <div style="box-shadow:0 2px 6px rgba(0,0,0,0.1); padding:10px; border-radius:8px; margin-bottom:8px;">
+                <strong>{h['source']}</strong> — Score: {h['score']:.3f}{f" · Re-rank: {h['rerank_score']:.3f}" if 'rerank_score' in h else ""}<br>
+                <details><summary>Snippet</summary>{h['text']}</details>
+            </div>
+            """,
+            unsafe_allow_html=True
+        )
+
+
+def render_web_hits(hits):
+    for w in hits:
+        title = w.get("title") or w.get("source")
+        st.markdown(
+            f"""
+            <div style="box-shadow:0 2px 6px rgba(0,0,0,0.1); padding:10px; border-radius:8px; margin-bottom:8px;">
+                <strong>{title}</strong><br>
+                <details><summary>Snippet</summary>{w['text']}</details>
+            </div>
+            """,
+            unsafe_allow_html=True
+        )
+
+
 if st.button("Run Research Agent"):
     if not question.strip():
         st.error("Please enter a research question.")
     else:
-        # --- Planning ---
-        with st.spinner("Planning research steps..."):
-            plan = simple_plan(question)
-            time.sleep(0.3)
+        # --- Layout: placeholders are filled as each stage completes ---
+        progress = st.progress(0, text="Planning research steps...")
         st.markdown("### 📝 Research Plan")
-        for i, p in enumerate(plan):
-            st.markdown(f"{i+1}. {p}")
-
-        # --- Retrieval Results Layout ---
+        plan_box = st.empty()
         col1, col2 = st.columns(2)
-
-        # Local Retrieval
         with col1:
             st.markdown("### 📄 Local Document Results")
-            with st.spinner("Retrieving local documents..."):
-                progress_local = st.progress(0)
-                local_hits = vs.query(question, top_k=top_k_local)
-                for i in range(101):
-                    progress_local.progress(i)
-                    time.sleep(0.01)
-
-            for h in local_hits:
-                st.markdown(
-                    f"""
-                    <div style="box-shadow:0 2px 6px rgba(0,0,0,0.1); padding:10px; border-radius:8px; margin-bottom:8px;">
-                        <strong>{h['source']}</strong> — Score: {h['score']:.3f}<br>
-                        <details><summary>Snippet</summary>{h['text']}</details>
-                    </div>
-                    """,
-                    unsafe_allow_html=True
-                )
-
-        # Web Retrieval
+            local_box = st.empty()
+            local_box.info("Retrieving local documents...")
         with col2:
             st.markdown("### 🌐 Web Search Results")
-            with st.spinner("Searching web sources..."):
-                progress_web = st.progress(0)
-                web_hits = web_retrieve(question, max_results=top_k_web)
-                for i in range(101):
-                    progress_web.progress(i)
-                    time.sleep(0.01)
-
-            for w in web_hits:
-                title = w.get("title") or w.get("source")
-                st.markdown(
-                    f"""
-                    <div style="box-shadow:0 2px 6px rgba(0,0,0,0.1); padding:10px; border-radius:8px; margin-bottom:8px;">
-                        <strong>{title}</strong><br>
-                        <details><summary>Snippet</summary>{w['text']}</details>
-                    </div>
-                    """,
-                    unsafe_allow_html=True
-                )
-
-        # --- Synthesis ---
+            web_box = st.empty()
+            web_box.info("Searching web sources...")
         st.markdown("## 🖋️ Synthesizing Final Report")
-        with st.spinner("Building structured report..."):
-            report = build_report(question, plan, local_hits, web_hits)
-            time.sleep(0.3)
+        summary_box = st.empty()
+
+        # progress follows real stage completion: plan, local, web, report
+        done, summary, report = 0, "", None
+        for ev in run_research(question, vs, top_k_local=top_k_local, top_k_web=top_k_web,
+                                 mode=retrieval_mode, use_cache=use_query_cache,
+                                 rerank=use_rerank, synth_mode=synth_mode,
+                                 filters=None if search_filter.is_empty() else search_filter):
+            if ev.stage == "plan":
+                plan_box.markdown("\n".join(f"{i+1}. {p}" for i, p in enumerate(ev.data)))
+            elif ev.stage == "local":
+                with local_box.container():
+                    render_local_hits(ev.data)
+                    st.caption(f"ready after {ev.elapsed * 1000:.0f} ms")
+            elif ev.stage == "web":
+                with web_box.container():
+                    render_web_hits(ev.data)
+                    st.caption(f"ready after {ev.elapsed * 1000:.0f} ms")
+            elif ev.stage == "token":
+                summary += ev.data
+                summary_box.markdown(summary + "▌")
+                continue
+            elif ev.stage == "error":
+                st.warning(ev.data)
+                continue
+            elif ev.stage == "report":
+                report = ev.data
+                summary_box.empty()
+                if report.get("cache", {}).get("tier") == "semantic":
+                    st.info(f"Reused the answer to a similar question: “{report['cache']['matched_question']}” "
+                            f"(similarity {report['cache']['similarity']:.2f})")
+                elif report.get("cache"):
+                    st.info("Reused a cached answer to this question.")
+            done += 1
+            progress.progress(done / 4, text=f"{ev.stage} done ({ev.elapsed:.2f}s)")
 
         # Tabs for Report
-        tab1, tab2, tab3 = st.tabs(["Summary", "Traceability", "Export"])
+        tab1, tab2, tab3, tab4 = st.tabs(["Summary", "Traceability", "Export", "Timings"])
         with tab1:
             st.markdown(report["summary_markdown"])
         with tab2:
@@ -149,3 +227,19 @@ if st.button("Run Research Agent"):
                 file_name="report.md",
                 mime="text/markdown"
             )
+        with tab4:
+            trace = report["trace"]
+            st.markdown(f"**Total:** {trace['total_ms']:.0f} ms")
+            ctx = report.get("context") or {}
+            if ctx:
+                st.markdown(
+                    f"**Prompt:** {ctx['prompt_tokens']} tokens from {ctx['sources_out']}/{ctx['sources_in']} sources "
+                    f"({ctx['tokens_saved']} saved by deduplication and the {ctx['budget']}-token budget"
+                    f"{', per plan step' if ctx.get('mode') == 'map_reduce' else ''})"
+                )
+            st.table([
+                {"stage": "\u2003" * row["depth"] + row["span"], "ms": row["ms"]}
+                for row in trace["spans"]
+            ])
+            if trace["counters"]:
+                st.table([{"counter": k, "value": v} for k, v in sorted(trace["counters"].items())])
@@ -0,0 +1,236 @@
+# batch.py
+"""
+Headless batch research: run planner -> retriever -> synthesizer over a JSONL
+file of questions and stream one report per line.
+
+    python batch.py questions.jsonl -o reports.jsonl --index faiss.index
+
+Input lines are {"id": ..., "question": ...} (id defaults to the line number).
+Re-running with the same output file resumes: questions whose id is already in
+the output are skipped.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Set
+from planner import simple_plan
+from vectorstore import VectorStore, RETRIEVAL_MODE
+from filters import SearchFilter
+from web_search import web_retrieve
+from synthesizer import build_report
+from reranker import RERANK
+from pipeline import retrieve_local_batch
+from map_reduce import map_reduce_summarize, llm_configured, SYNTH_MODE, SYNTH_MODES
+
+STAGES = ("plan", "local", "web", "synth", "total")
+
+
+def read_questions(path: str) -> Iterator[Dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        for n, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            q = json.loads(line)
+            if isinstance(q, str):
+                q = {"question": q}
+            q.setdefault("id", str(n))
+            yield q
+
+
+def completed_ids(out_path: str) -> Set[str]:
+    """
+    Ids already written to `out_path`. Malformed lines (e.g. torn by a crash)
+    are skipped, and the file is rewritten without them so appends start on
+    a fresh line; the reports after them still count as done.
+    """
+    done: Set[str] = set()
+    if not os.path.exists(out_path):
+        return done
+    good, bad = [], 0
+    with open(out_path, "rb") as f:
+        for line in f:
+            try:
+                done.add(str(json.loads(line)["id"]))
+            except (ValueError, KeyError, TypeError):
+                bad += 1
+                continue
+            good.append(line if line.endswith(b"\n") else line + b"\n")
+    if bad:
+        print(f"[batch] dropping {bad} malformed line(s) from {out_path}", file=sys.stderr)
+        tmp = out_path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.writelines(good)
+        os.replace(tmp, out_path)
+    return done
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    s = sorted(values)
+    k = (len(s) - 1) * p / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(s) - 1)
+    return s[lo] + (s[hi] - s[lo]) * (k - lo)
+
+
+def run_batch(questions: Iterator[Dict], vs, out_path: str, batch_size: int = 64,
+              top_k_local: int = 5, top_k_web: int = 3, web_concurrency: int = 8,
+              llm_concurrency: int = 4, use_web: bool = True, mode: str = RETRIEVAL_MODE,
+              rerank: bool = RERANK, synth_mode: str = SYNTH_MODE,
+              filters: Optional[SearchFilter] = None) -> Dict:
+    """
+    Process `questions` in batches: local retrieval for a whole batch (every
+    question and plan step) is one encode + one FAISS search; web retrieval
+    and synthesis run per question with bounded concurrency. Reports are
+    appended to `out_path` as they finish. With `rerank`, each question's
+    fused candidates are re-scored by the cross-encoder (counted as "local").
+    With synth_mode "map_reduce", each question is summarized per plan step
+    (see map_reduce.py); llm_concurrency then bounds questions, not calls.
+    `filters` restricts local retrieval for every question.
+    """
+    done = completed_ids(out_path)
+    web_sem = threading.Semaphore(web_concurrency)
+    llm_sem = threading.Semaphore(llm_concurrency)
+    lat: Dict[str, List[float]] = {s: [] for s in STAGES}
+    write_lock = threading.Lock()
+    n_done, n_skipped = 0, 0
+    t_start = time.perf_counter()
+
+    def finish(q: Dict, plan: List[str], local_hits: List[Dict], step_hits: List[List[Dict]],
+               timings: Dict, out) -> Dict:
+        t = time.perf_counter()
+        web_hits = []
+        if use_web:
+            with web_sem:
+                web_hits = web_retrieve(q["question"], max_results=top_k_web)
+        timings["web"] = time.perf_counter() - t
+        t = time.perf_counter()
+        with llm_sem:
+            report = None
+            if synth_mode == "map_reduce" and llm_configured():
+                try:
+                    summary, context = map_reduce_summarize(q["question"], [q["question"]] + plan, step_hits, web_hits)
+                    report = build_report(q["question"], plan, local_hits, web_hits, summary_markdown=summary,
+                                          context=context)
+                except Exception as e:
+                    print(f"[batch] map-reduce synthesis failed, using a single prompt: {e}", file=sys.stderr)
+            if report is None:
+                report = build_report(q["question"], plan, local_hits, web_hits)
+        timings["synth"] = time.perf_counter() - t
+        timings["total"] = sum(timings[s] for s in ("plan", "local", "web", "synth"))
+        line = json.dumps(dict(report, id=q["id"], timings=timings), ensure_ascii=False)
+        with write_lock:
+            out.write(line + "\n")
+            out.flush()
+        return timings
+
+    def batches() -> Iterator[List[Dict]]:
+        nonlocal n_skipped
+        batch = []
+        for q in questions:
+            if str(q["id"]) in done:
+                n_skipped += 1
+                continue
+            batch.append(q)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    workers = max(web_concurrency, llm_concurrency)
+    with open(out_path, "a", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=workers) as pool:
+        for batch in batches():
+            t = time.perf_counter()
+            plans = [simple_plan(q["question"]) for q in batch]
+            t_plan = (time.perf_counter() - t) / len(batch)
+
+            t = time.perf_counter()
+            local = retrieve_local_batch(vs, [q["question"] for q in batch], plans, top_k_local, mode,
+                                         rerank, filters)
+            # amortized: the whole batch shares one encode + search
+            t_local = (time.perf_counter() - t) / len(batch)
+
+            futures = []
+            for q, plan, (local_hits, step_hits) in zip(batch, plans, local):
+                timings = {"plan": t_plan, "local": t_local}
+                futures.append(pool.submit(finish, q, plan, local_hits, step_hits, timings, out))
+            for fut in as_completed(futures):
+                try:
+                    timings = fut.result()
+                except Exception as e:
+                    print(f"[batch] question failed: {e}", file=sys.stderr)
+                    continue
+                n_done += 1
+                for s in STAGES:
+                    lat[s].append(timings[s])
+            elapsed = time.perf_counter() - t_start
+            print(f"[batch] {n_done} done, {n_skipped} skipped, {n_done / elapsed:.2f} q/s", file=sys.stderr)
+
+    elapsed = time.perf_counter() - t_start
+    return {
+        "completed": n_done,
+        "skipped": n_skipped,
+        "seconds": elapsed,
+        "questions_per_sec": n_done / elapsed if elapsed > 0 else 0.0,
+        "latency_ms": {
+            s: {f"p{p}": percentile(v, p) * 1000 for p in (50, 95, 99)} for s, v in lat.items()
+        },
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("questions", help="JSONL file of questions")
+    ap.add_argument("-o", "--out", default="reports.jsonl")
+    ap.add_argument("--index", default="faiss.index")
+    ap.add_argument("--batch-size", type=int, default=64)
+    ap.add_argument("--top-k-local", type=int, default=5)
+    ap.add_argument("--top-k-web", type=int, default=3)
+    ap.add_argument("--web-concurrency", type=int, default=8)
+    ap.add_argument("--llm-concurrency", type=int, default=4)
+    ap.add_argument("--no-web", action="store_true", help="local retrieval only")
+    ap.add_argument("--mode", choices=("dense", "lexical", "hybrid"), default=RETRIEVAL_MODE)
+    ap.add_argument("--rerank", action="store_true", default=RERANK,
+                    help="re-rank local candidates with the cross-encoder (see reranker.py)")
+    ap.add_argument("--synth", choices=SYNTH_MODES, default=SYNTH_MODE,
+                    help="map_reduce: summarize each plan step concurrently, then merge (needs an LLM)")
+    ap.add_argument("--source", action="append", default=[], help="only search this source file (repeatable)")
+    ap.add_argument("--ext", action="append", default=[], help="only search this file type, e.g. pdf (repeatable)")
+    ap.add_argument("--tag", action="append", default=[], help="only search sources with this tag (repeatable)")
+    ap.add_argument("--page-min", type=int, default=None)
+    ap.add_argument("--page-max", type=int, default=None)
+    ap.add_argument("--since", default="", help="only search chunks ingested on or after YYYY-MM-DD")
+    ap.add_argument("--shard-dir", default="", help="search a sharded store (see sharded.py) instead of --index")
+    ap.add_argument("--shard-servers", default="", help="comma-separated host:port of running shard servers")
+    args = ap.parse_args()
+
+    if args.shard_dir or args.shard_servers:
+        from sharded import ShardedVectorStore, SHARD_DIR
+        addresses = [a for a in args.shard_servers.split(",") if a]
+        vs = ShardedVectorStore(args.shard_dir or SHARD_DIR, addresses=addresses or None)
+        if not addresses:
+            vs.load()
+    else:
+        vs = VectorStore()
+        vs.load(args.index)
+    filters = SearchFilter(sources=args.source, extensions=args.ext, tags=args.tag,
+                           page_min=args.page_min, page_max=args.page_max,
+                           ingested_after=datetime.strptime(args.since, "%Y-%m-%d").timestamp() if args.since else None)
+    stats = run_batch(read_questions(args.questions), vs, args.out, batch_size=args.batch_size,
+                      top_k_local=args.top_k_local, top_k_web=args.top_k_web,
+                      web_concurrency=args.web_concurrency, llm_concurrency=args.llm_concurrency,
+                      use_web=not args.no_web, mode=args.mode, rerank=args.rerank,
+                      synth_mode=args.synth, filters=None if filters.is_empty() else filters)
+    print(json.dumps(stats, indent=1))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+# bench.py
+"""
+Offline benchmark for the ingest / embed / index / query / report hot paths.
+
+    python bench.py --sizes 1000,10000,100000          # stub encoder, flat index
+    python bench.py --sizes 1000 --encoder model        # real EMB_MODEL_NAME
+    python bench.py --compare bench_results/a.json bench_results/b.json
+
+Synthetic corpora are generated from the vocabulary of docs/, so runs are
+reproducible for a given --seed. Results are written as JSON to bench_results/.
+"""
+import os
+import re
+import sys
+import json
+import time
+import glob
+import zlib
+import platform
+import argparse
+import resource
+import subprocess
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Callable, Dict, List
+import numpy as np
+import faiss
+from ingest import DocumentChunk, clean_text, chunk_text, read_document, list_documents
+from pdf_extract import iter_pdf_pages, backend_name
+import synthesizer
+from synthesizer import build_report
+
+
+class HashingEncoder:
+    """
+    Deterministic stand-in for SentenceTransformer: signed feature hashing of
+    lower-cased words. Needs no model download, so benchmarks run offline.
+    """
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def encode(self, texts: List[str], convert_to_numpy: bool = True, show_progress_bar: bool = False,
+               batch_size: int = 32) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, t in enumerate(texts):
+            h = np.fromiter((zlib.crc32(w.encode("utf-8")) for w in t.lower().split()), dtype=np.int64)
+            if len(h):
+                np.add.at(out[i], h % self.dim, np.where((h >> 16) & 1, 1.0, -1.0))
+        return out
+
+
+# ------------------------
+# Synthetic corpora
+# ------------------------
+def docs_vocabulary(folder: str = "docs/") -> List[str]:
+    words = []
+    for fn in list_documents(folder):
+        try:
+            words.extend((read_document(os.path.join(folder, fn)) or "").lower().split())
+        except Exception:
+            continue
+    return sorted(set(w for w in words if w.isalpha())) or ["lorem", "ipsum", "dolor", "sit", "amet"]
+
+
+def synthetic_words(vocab: List[str], n: int, rng: np.random.Generator) -> List[str]:
+    # Zipf-like word frequencies, as in natural text
+    ranks = np.minimum(rng.zipf(1.2, size=n), len(vocab)) - 1
+    return [vocab[r] for r in ranks]
+
+
+def synthetic_chunks(vocab: List[str], n_chunks: int, words_per_chunk: int = 120, seed: int = 0) -> List[DocumentChunk]:
+    rng = np.random.default_rng(seed)
+    words = synthetic_words(vocab, n_chunks * words_per_chunk, rng)
+    return [
+        DocumentChunk(id=f"synthetic_{i // 50}.md__chunk_{i % 50 + 1}", source=f"synthetic_{i // 50}.md",
+                      text=" ".join(words[i * words_per_chunk:(i + 1) * words_per_chunk]))
+        for i in range(n_chunks)
+    ]
+
+
+def synthetic_markdown(vocab: List[str], n_words: int, seed: int = 0) -> str:
+    """Raw markdown/HTML-ish text for clean_text: headings, emphasis, tags, lists."""
+    rng = np.random.default_rng(seed)
+    words = synthetic_words(vocab, n_words, rng)
+    out = []
+    for i, w in enumerate(words):
+        if i % 97 == 0:
+            out.append("\n## ")
+        elif i % 13 == 0:
+            out.append(f"**{w}**")
+            continue
+        elif i % 41 == 0:
+            out.append(f"<b>{w}</b>")
+            continue
+        elif i % 29 == 0:
+            out.append("\n- ")
+        out.append(w)
+    return " ".join(out)
+
+
+# ------------------------
+# Measurement
+# ------------------------
+def measure(fn: Callable, *args, **kwargs) -> Dict:
+    """Wall time and peak Python-heap allocation (tracemalloc) of one call."""
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    t0 = time.perf_counter()
+    result = fn(*args, **kwargs)
+    seconds = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": seconds, "peak_mb": peak / 1e6, "result": result}
+
+
+def latency_stats(samples_s: List[float]) -> Dict:
+    a = np.array(samples_s) * 1000
+    return {"qps": len(a) / (a.sum() / 1000) if a.sum() else 0.0,
+            "p50_ms": float(np.percentile(a, 50)), "p95_ms": float(np.percentile(a, 95)),
+            "p99_ms": float(np.percentile(a, 99)), "mean_ms": float(a.mean())}
+
+
+def bench_text_stages(vocab: List[str], n_words: int, seed: int) -> Dict:
+    raw = synthetic_markdown(vocab, n_words, seed)
+    m_clean = measure(clean_text, raw)
+    m_chunk = measure(chunk_text, m_clean["result"])
+    return {
+        "clean_text": {"words": n_words, "seconds": m_clean["seconds"], "peak_mb": m_clean["peak_mb"],
+                       "mb_per_s": len(raw.encode("utf-8")) / 1e6 / m_clean["seconds"]},
+        "chunk_text": {"words": n_words, "seconds": m_chunk["seconds"], "peak_mb": m_chunk["peak_mb"],
+                       "chunks": len(m_chunk["result"]), "words_per_s": n_words / m_chunk["seconds"]},
+    }
+
+
+def bench_read_pdf(folder: str) -> Dict:
+    pdfs = sorted(glob.glob(os.path.join(folder, "*.pdf")))
+    if not pdfs:
+        return {}
+    # extraction itself: bypass the page cache
+    m = measure(lambda: [clean_text("\n".join(t for _, t in iter_pdf_pages(p, cache=None))) for p in pdfs])
+    return {"files": len(pdfs), "backend": backend_name(), "seconds": m["seconds"], "peak_mb": m["peak_mb"],
+            "files_per_s": len(pdfs) / m["seconds"]}
+
+
+def bench_corpus(vocab: List[str], n_chunks: int, encoder, index_type: str, n_queries: int,
+                 top_k: int, seed: int) -> Dict:
+    from vectorstore import VectorStore
+    chunks = synthetic_chunks(vocab, n_chunks, seed=seed)
+    # no embedding cache: build must measure real encoding work
+    vs = VectorStore(cache_dir="", index_type=index_type, model=encoder)
+    m_build = measure(vs.build, chunks)
+
+    rng = np.random.default_rng(seed + 1)
+    queries = [" ".join(synthetic_words(vocab, 8, rng)) for _ in range(n_queries)]
+    lat = []
+    for q in queries:
+        t0 = time.perf_counter()
+        hits = vs.query(q, top_k=top_k)
+        lat.append(time.perf_counter() - t0)
+    m_batch = measure(vs.query_batch, queries, top_k)
+
+    m_report = measure(build_report, queries[0], [queries[0]], hits, [])
+    return {
+        "chunks": n_chunks,
+        "index_type": vs.effective_index_type,
+        "build": {"seconds": m_build["seconds"], "peak_mb": m_build["peak_mb"],
+                  "vectors_per_s": n_chunks / m_build["seconds"]},
+        "query": latency_stats(lat),
+        "query_batch": {"queries": n_queries, "seconds": m_batch["seconds"],
+                        "qps": n_queries / m_batch["seconds"]},
+        "build_report": {"seconds": m_report["seconds"], "peak_mb": m_report["peak_mb"]},
+    }
+
+
+def environment(encoder_name: str, index_type: str) -> Dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except Exception:
+        commit = "unknown"
+    return {
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "faiss": getattr(faiss, "__version__", "unknown"),
+        "cpus": os.cpu_count(),
+        "platform": platform.platform(),
+        "encoder": encoder_name,
+        "index_type": index_type,
+    }
+
+
+# ------------------------
+# Comparison
+# ------------------------
+# metrics where larger is better; everything else (seconds, *_ms, peak_mb) is lower-is-better
+HIGHER_IS_BETTER = re.compile(r"(_per_s|qps)$")
+
+
+def flatten(d: Dict, prefix: str = "") -> Dict[str, float]:
+    out = {}
+    for k, v in d.items():
+        key = f"{prefix}{k}"
+        if isinstance(v, dict):
+            out.update(flatten(v, key + "."))
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            out[key] = float(v)
+    return out
+
+
+def compare(old_path: str, new_path: str, threshold: float = 0.10) -> int:
+    """Print per-metric change; returns the number of regressions beyond `threshold`."""
+    with open(old_path, "r", encoding="utf-8") as f:
+        old = flatten(json.load(f)["results"])
+    with open(new_path, "r", encoding="utf-8") as f:
+        new = flatten(json.load(f)["results"])
+    regressions = 0
+    for key in sorted(set(old) & set(new)):
+        a, b = old[key], new[key]
+        if a == 0 or key.endswith((".chunks", ".words", ".files", ".queries")):
+            continue
+        change = (b - a) / a
+        worse = -change if HIGHER_IS_BETTER.search(key) else change
+        flag = ""
+        if worse > threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(f"{key:<48}{a:>14.4f}{b:>14.4f}{change * 100:>+9.1f}%{flag}")
+    return regressions
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--docs", default="docs/")
+    ap.add_argument("--sizes", default="1000,10000", help="comma-separated corpus sizes in chunks")
+    ap.add_argument("--encoder", choices=("stub", "model"), default="stub")
+    ap.add_argument("--index-type", default="flat")
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--top-k", type=int, default=5)
+    ap.add_argument("--text-words", type=int, default=1_000_000, help="size of the clean/chunk text sample")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out-dir", default="bench_results")
+    ap.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    args = ap.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare) else 0)
+
+    # stay offline: never call the LLM from the benchmark
+    synthesizer.OPENAI_KEY = None
+    if args.encoder == "stub":
+        encoder, encoder_name = HashingEncoder(), "hashing-stub-384"
+    else:
+        from sentence_transformers import SentenceTransformer
+        from vectorstore import EMB_MODEL_NAME
+        encoder, encoder_name = SentenceTransformer(EMB_MODEL_NAME), EMB_MODEL_NAME
+
+    vocab = docs_vocabulary(args.docs)
+    results = {"text": bench_text_stages(vocab, args.text_words, args.seed),
+               "read_pdf": bench_read_pdf(args.docs),
+               "corpus": {}}
+    for n in [int(x) for x in args.sizes.split(",") if x.strip()]:
+        print(f"[bench] corpus of {n} chunks...", file=sys.stderr)
+        results["corpus"][str(n)] = bench_corpus(vocab, n, encoder, args.index_type, args.queries,
+                                                 args.top_k, args.seed)
+    results["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    env = environment(encoder_name, args.index_type)
+    os.makedirs(args.out_dir, exist_ok=True)
+    stamp = datetime.fromisoformat(env["timestamp"]).strftime("%Y%m%dT%H%M%SZ")
+    out_path = os.path.join(args.out_dir, f"{stamp}-{env['commit']}.json")
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump({"environment": env, "results": results}, f, indent=1)
+    print(json.dumps(results, indent=1))
+    print(f"[bench] wrote {out_path}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
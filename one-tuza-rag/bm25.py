@@ -0,0 +1,232 @@
+# bm25.py
+"""
+Compact BM25 inverted index over DocumentChunk texts.
+
+Postings are stored per term as doc-id-sorted uint32 arrays with uint8
+quantized BM25 impacts (score-at-index-time, one float scale per term), and
+split into fixed-size blocks that record their last doc id and max impact.
+Queries use MaxScore with block-max pruning: once the top-k threshold exceeds
+what the remaining terms could add, those terms only score candidate docs,
+and only the blocks whose max impact can still lift a candidate into the
+top-k are decoded.
+"""
+import os
+import re
+import json
+import shutil
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+BLOCK_SIZE = 128
+
+# identifiers such as java.sql.DriverManager or getConnection_v2 stay whole
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[._][a-z0-9]+)*")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were will with".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased terms; compound identifiers also contribute their parts."""
+    out = []
+    for tok in TOKEN_RE.findall(text.lower()):
+        if tok in STOPWORDS:
+            continue
+        out.append(tok)
+        if "." in tok or "_" in tok:
+            out.extend(p for p in re.split(r"[._]", tok) if p and p not in STOPWORDS)
+    return out
+
+
+class BM25Index:
+    def __init__(self, vocab: Dict[str, int], arrays: Dict[str, np.ndarray], n_docs: int):
+        self.vocab = vocab
+        self.n_docs = n_docs
+        self.term_offsets = arrays["term_offsets"]    # (T+1,) int64 into postings
+        self.post_docs = arrays["post_docs"]          # (P,) uint32
+        self.post_impacts = arrays["post_impacts"]    # (P,) uint8
+        self.term_scale = arrays["term_scale"]        # (T,) float32
+        self.block_offsets = arrays["block_offsets"]  # (T+1,) int64 into blocks
+        self.block_last = arrays["block_last"]        # (B,) uint32, last doc id of each block
+        self.block_max = arrays["block_max"]          # (B,) float32, max impact of each block
+        self._local = threading.local()
+
+    # ------------------------
+    # Build
+    # ------------------------
+    @classmethod
+    def build(cls, texts: Sequence[str], k1: float = BM25_K1, b: float = BM25_B) -> "BM25Index":
+        vocab: Dict[str, int] = {}
+        term_ids, doc_ids, tfs = [], [], []
+        doc_len = np.zeros(len(texts), dtype=np.float32)
+        for d, text in enumerate(texts):
+            counts: Dict[int, int] = {}
+            toks = tokenize(text)
+            doc_len[d] = len(toks)
+            for t in toks:
+                tid = vocab.setdefault(t, len(vocab))
+                counts[tid] = counts.get(tid, 0) + 1
+            term_ids.extend(counts.keys())
+            doc_ids.extend([d] * len(counts))
+            tfs.extend(counts.values())
+
+        T, N = len(vocab), len(texts)
+        term_ids = np.array(term_ids, dtype=np.int64)
+        doc_ids = np.array(doc_ids, dtype=np.uint32)
+        tfs = np.array(tfs, dtype=np.float32)
+        # stable sort keeps doc ids ascending within each term
+        order = np.argsort(term_ids, kind="stable")
+        term_ids, doc_ids, tfs = term_ids[order], doc_ids[order], tfs[order]
+
+        df = np.bincount(term_ids, minlength=T).astype(np.float32)
+        idf = np.log1p((N - df + 0.5) / (df + 0.5))
+        avgdl = float(doc_len.mean()) if N else 0.0
+        norm = k1 * (1 - b + b * doc_len[doc_ids] / max(avgdl, 1e-9))
+        impacts = idf[term_ids] * tfs * (k1 + 1) / (tfs + norm)
+
+        term_offsets = np.zeros(T + 1, dtype=np.int64)
+        np.cumsum(df.astype(np.int64), out=term_offsets[1:])
+        term_max = np.zeros(T, dtype=np.float32)
+        if len(impacts):
+            np.maximum.at(term_max, term_ids, impacts)
+        term_scale = np.where(term_max > 0, term_max / 255.0, 1.0).astype(np.float32)
+        quant = np.minimum(np.ceil(impacts / term_scale[term_ids]), 255).astype(np.uint8)
+
+        # blocks of BLOCK_SIZE postings per term
+        n_blocks = (df.astype(np.int64) + BLOCK_SIZE - 1) // BLOCK_SIZE
+        block_offsets = np.zeros(T + 1, dtype=np.int64)
+        np.cumsum(n_blocks, out=block_offsets[1:])
+        pos_in_term = np.arange(len(term_ids)) - term_offsets[term_ids]
+        block_of = block_offsets[term_ids] + pos_in_term // BLOCK_SIZE
+        B = int(block_offsets[-1])
+        block_last = np.zeros(B, dtype=np.uint32)
+        block_last[block_of] = doc_ids  # ascending within a block: last write wins
+        block_max = np.zeros(B, dtype=np.float32)
+        if B:
+            np.maximum.at(block_max, block_of, quant.astype(np.float32) * term_scale[term_ids])
+
+        arrays = {"term_offsets": term_offsets, "post_docs": doc_ids, "post_impacts": quant,
+                  "term_scale": term_scale, "block_offsets": block_offsets,
+                  "block_last": block_last, "block_max": block_max}
+        return cls(vocab, arrays, N)
+
+    # ------------------------
+    # Persistence
+    # ------------------------
+    def save(self, dirpath: str):
+        tmp = dirpath + ".tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for name in ("term_offsets", "post_docs", "post_impacts", "term_scale",
+                     "block_offsets", "block_last", "block_max"):
+            np.save(os.path.join(tmp, name + ".npy"), getattr(self, name))
+        terms = [None] * len(self.vocab)
+        for t, i in self.vocab.items():
+            terms[i] = t
+        with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"n_docs": self.n_docs, "terms": terms}, f)
+        shutil.rmtree(dirpath, ignore_errors=True)
+        os.replace(tmp, dirpath)
+
+    @classmethod
+    def load(cls, dirpath: str, mmap: bool = True) -> "BM25Index":
+        with open(os.path.join(dirpath, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(dirpath, name + ".npy"), mmap_mode="r" if mmap else None)
+            for name in ("term_offsets", "post_docs", "post_impacts", "term_scale",
+                         "block_offsets", "block_last", "block_max")
+        }
+        return cls({t: i for i, t in enumerate(meta["terms"])}, arrays, meta["n_docs"])
+
+    # ------------------------
+    # Query
+    # ------------------------
+    def _postings(self, tid: int) -> Tuple[np.ndarray, np.ndarray]:
+        a, b = int(self.term_offsets[tid]), int(self.term_offsets[tid + 1])
+        return np.asarray(self.post_docs[a:b]), np.asarray(self.post_impacts[a:b], dtype=np.float32) * self.term_scale[tid]
+
+    def _block_postings(self, tid: int, blocks: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Decode only `blocks` (sorted, term-relative) of a term's posting list."""
+        a, b = int(self.term_offsets[tid]), int(self.term_offsets[tid + 1])
+        starts = a + blocks * BLOCK_SIZE
+        lens = np.minimum(starts + BLOCK_SIZE, b) - starts
+        # concatenated ranges [starts[j], starts[j] + lens[j])
+        idx = np.repeat(starts - np.concatenate([[0], np.cumsum(lens)[:-1]]), lens) + np.arange(int(lens.sum()))
+        return np.asarray(self.post_docs[idx]), np.asarray(self.post_impacts[idx], dtype=np.float32) * self.term_scale[tid]
+
+    def _buffers(self) -> Tuple[np.ndarray, np.ndarray]:
+        # per-thread score accumulator and seen flags, reused across queries and
+        # reset only at the touched docs, so a query costs O(postings read), not O(n_docs)
+        bufs = getattr(self._local, "bufs", None)
+        if bufs is None:
+            bufs = self._local.bufs = (np.zeros(self.n_docs, dtype=np.float32), np.zeros(self.n_docs, dtype=bool))
+        return bufs
+
+    def search(self, query: str, top_k: int = 5, mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return (doc ids, scores) of the top_k docs, best first. `mask` is an
+        optional boolean array over doc ids restricting the result set.
+        """
+        tids = sorted({self.vocab[t] for t in tokenize(query) if t in self.vocab})
+        if not tids or self.n_docs == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        ub = np.array([float(self.term_scale[t]) * 255.0 for t in tids], dtype=np.float32)
+        order = np.argsort(-ub)
+        tids = [tids[i] for i in order]
+        ub = ub[order]
+        # remaining[i]: the most terms i.. can still add to any doc
+        remaining = np.concatenate([np.cumsum(ub[::-1])[::-1], [0.0]]).astype(np.float32)
+
+        acc, seen = self._buffers()
+        touched = np.zeros(0, dtype=np.int64)
+        try:
+            theta = 0.0
+            for i, tid in enumerate(tids):
+                if len(touched) >= top_k:
+                    theta = float(np.partition(acc[touched], len(touched) - top_k)[len(touched) - top_k])
+                if theta > 0 and remaining[i] <= theta:
+                    # MaxScore: a doc not seen yet cannot reach the top-k any more;
+                    # only candidates that still could are scored for this term.
+                    cand = touched[acc[touched] + remaining[i] > theta]
+                    if len(cand) == 0:
+                        break
+                    b0, b1 = int(self.block_offsets[tid]), int(self.block_offsets[tid + 1])
+                    blk = np.searchsorted(np.asarray(self.block_last[b0:b1]), cand)
+                    inside = blk < (b1 - b0)
+                    cand, blk = cand[inside], blk[inside]
+                    # block-max: skip candidates whose block cannot lift them over theta
+                    bmax = np.asarray(self.block_max[b0:b1])[blk]
+                    keep = acc[cand] + bmax + remaining[i + 1] > theta
+                    cand, blk = cand[keep], blk[keep]
+                    if len(cand) == 0:
+                        continue
+                    # decode only the blocks that still hold a candidate
+                    docs, imp = self._block_postings(tid, np.unique(blk))
+                    pos = np.minimum(np.searchsorted(docs, cand), len(docs) - 1)
+                    hit = docs[pos] == cand
+                    acc[cand[hit]] += imp[pos[hit]]
+                    continue
+                docs, imp = self._postings(tid)
+                if mask is not None:
+                    sel = mask[docs]
+                    docs, imp = docs[sel], imp[sel]
+                acc[docs] += imp
+                # docs seen for the first time; touched stays unsorted, no per-term merge
+                new = docs[~seen[docs]].astype(np.int64)
+                seen[new] = True
+                touched = np.concatenate([touched, new])
+
+            if len(touched) == 0:
+                return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+            k = min(top_k, len(touched))
+            scores = acc[touched]
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return touched[top], scores[top]
+        finally:
+            acc[touched] = 0.0
+            seen[touched] = False
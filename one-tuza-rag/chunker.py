@@ -0,0 +1,224 @@
+# chunker.py
+"""
+Token-aware, structure-preserving chunking.
+
+Readers turn a document into Blocks (a Markdown paragraph under its heading,
+or one PDF page). The chunker splits blocks into units (sentences,
+paragraphs or words), counts their tokens with the embedding model's
+tokenizer in one batched call, and packs consecutive units of the same
+section (heading / page) into chunks of at most CHUNK_MAX_TOKENS tokens, so
+nothing is silently truncated by the encoder. Each chunk keeps its page and
+character span. Every unit is tokenized once and overlap is bounded, so
+chunking is linear in the document length.
+
+Strategies (CHUNK_STRATEGY):
+    sentences   pack whole sentences (default)
+    paragraphs  pack whole paragraphs, splitting only oversized ones
+    tokens      fixed token windows, ignoring sentence boundaries
+    words       the original 800-word windows with 100-word overlap (ingest.chunk_text)
+"""
+import os
+import re
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+CHUNK_STRATEGY = os.getenv("CHUNK_STRATEGY", "sentences")
+# the encoder's sequence limit, including its [CLS]/[SEP] tokens (256 for all-MiniLM-L6-v2)
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "256"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))
+_model = os.getenv("EMB_MODEL_NAME", "all-MiniLM-L6-v2")
+CHUNK_TOKENIZER = os.getenv("CHUNK_TOKENIZER", _model if "/" in _model else "sentence-transformers/" + _model)
+SPECIAL_TOKENS = 2
+STRATEGIES = ("sentences", "paragraphs", "tokens", "words")
+
+HEADING_RE = re.compile(r"^ {0,3}(#{1,6})\s+(.*?)\s*#*\s*$")
+SENTENCE_RE = re.compile(r"[^.!?]+(?:[.!?]+(?=\s|$)|$)|[.!?]+")
+WORD_RE = re.compile(r"\S+")
+
+
+@dataclass
+class Block:
+    text: str              # raw text
+    offset: int            # char offset of `text` in the file (Markdown) or in its page's text (PDF)
+    page: Optional[int] = None
+    heading: str = ""
+
+
+@dataclass
+class Chunk:
+    text: str
+    page: Optional[int]
+    char_start: int
+    char_end: int
+    heading: str
+
+
+@dataclass
+class _Unit:
+    text: str      # cleaned
+    raw: str
+    start: int
+    end: int
+    section: int
+
+
+# ------------------------
+# Tokenizer
+# ------------------------
+def approx_token_counts(texts: List[str]) -> List[int]:
+    """WordPiece-like estimate: one token per punctuation mark, about one per 6 word characters."""
+    return [sum(1 + (len(w) - 1) // 6 if w[0].isalnum() or w[0] == "_" else 1
+                for w in re.findall(r"\w+|[^\w\s]", t)) for t in texts]
+
+
+_counter = None
+
+
+def token_counter() -> Callable[[List[str]], List[int]]:
+    """Batched token counter for CHUNK_TOKENIZER, or the estimate when transformers is unavailable."""
+    global _counter
+    if _counter is None:
+        try:
+            from transformers import AutoTokenizer
+            tok = AutoTokenizer.from_pretrained(CHUNK_TOKENIZER)
+
+            def count(texts: List[str]) -> List[int]:
+                if not texts:
+                    return []
+                ids = tok(texts, add_special_tokens=False, verbose=False)["input_ids"]
+                return [len(x) for x in ids]
+            count.name = CHUNK_TOKENIZER
+        except Exception as e:
+            print(f"[chunker] tokenizer {CHUNK_TOKENIZER} unavailable ({type(e).__name__}); estimating token counts")
+            count = approx_token_counts
+            count.name = "approx"
+        _counter = count
+    return _counter
+
+
+def chunker_config(strategy: str = CHUNK_STRATEGY) -> Dict:
+    """Recorded in the ingest manifest; a change re-chunks every document."""
+    cfg = {"strategy": strategy}
+    if strategy != "words":
+        cfg.update(max_tokens=CHUNK_MAX_TOKENS, overlap=CHUNK_OVERLAP_TOKENS, tokenizer=token_counter().name)
+    return cfg
+
+
+# ------------------------
+# Structure
+# ------------------------
+def markdown_blocks(raw: str) -> List[Block]:
+    """Paragraphs (runs of non-blank lines) with the heading path they sit under."""
+    blocks: List[Block] = []
+    path: List[str] = []
+    para_start, para_end = -1, -1
+    pos = 0
+
+    def flush():
+        if para_start >= 0:
+            blocks.append(Block(raw[para_start:para_end], para_start, None, " / ".join(path)))
+
+    for line in raw.splitlines(keepends=True):
+        stripped = line.strip()
+        m = HEADING_RE.match(line.rstrip("\r\n"))
+        if m or not stripped:
+            flush()
+            para_start = -1
+            if m:
+                level = len(m.group(1))
+                path = path[:level - 1] + [m.group(2)]
+        else:
+            if para_start < 0:
+                para_start = pos
+            para_end = pos + len(line.rstrip("\r\n"))
+        pos += len(line)
+    flush()
+    return blocks
+
+
+def _units(blocks: List[Block], strategy: str, clean: Callable[[str], str]) -> List[_Unit]:
+    units: List[_Unit] = []
+    section, key = -1, None
+    pattern = WORD_RE if strategy == "tokens" else SENTENCE_RE
+    for b in blocks:
+        if (b.page, b.heading) != key:
+            section += 1
+            key = (b.page, b.heading)
+        if strategy == "paragraphs":
+            spans = [(0, len(b.text))]
+        else:
+            spans = [m.span() for m in pattern.finditer(b.text)]
+        for s, e in spans:
+            text = clean(b.text[s:e])
+            if text:
+                units.append(_Unit(text, b.text[s:e], b.offset + s, b.offset + e, section))
+    return units
+
+
+def _words(u: _Unit, clean: Callable[[str], str]) -> List[_Unit]:
+    """Split an oversized unit into word units."""
+    out = []
+    for m in WORD_RE.finditer(u.raw):
+        text = clean(m.group())
+        if text:
+            out.append(_Unit(text, m.group(), u.start + m.start(), u.start + m.end(), u.section))
+    return out
+
+
+# ------------------------
+# Packing
+# ------------------------
+def chunk_blocks(blocks: List[Block], clean: Callable[[str], str], strategy: str = CHUNK_STRATEGY,
+                 max_tokens: int = CHUNK_MAX_TOKENS, overlap: int = CHUNK_OVERLAP_TOKENS) -> List[Chunk]:
+    """`clean` normalizes the raw text of each unit (ingest.clean_text)."""
+    if strategy not in ("sentences", "paragraphs", "tokens"):
+        raise ValueError(f"chunk_blocks does not handle strategy {strategy!r}")
+    count = token_counter()
+    units = _units(blocks, strategy, clean)
+    keys = []
+    for b in blocks:
+        if not keys or keys[-1] != (b.page, b.heading):
+            keys.append((b.page, b.heading))
+    sections = [(page, clean(heading)) for page, heading in keys]
+    heading_tokens = count([h + ":" if h else "" for _, h in sections])
+    budget = max_tokens - SPECIAL_TOKENS
+
+    # units that cannot fit even alone are split into words, counted in a second batch
+    tokens = count([u.text for u in units])
+    if any(t > budget - heading_tokens[u.section] for u, t in zip(units, tokens)):
+        split, split_tokens = [], []
+        for u, t in zip(units, tokens):
+            if t > budget - heading_tokens[u.section]:
+                words = _words(u, clean)
+                split.extend(words)
+                split_tokens.extend(count([w.text for w in words]))
+            else:
+                split.append(u)
+                split_tokens.append(t)
+        units, tokens = split, split_tokens
+
+    chunks: List[Chunk] = []
+    i, n = 0, len(units)
+    while i < n:
+        sec = units[i].section
+        limit = max(budget - heading_tokens[sec], 1)
+        j, used = i, 0
+        while j < n and units[j].section == sec and (j == i or used + tokens[j] <= limit):
+            used += tokens[j]
+            j += 1
+        page, heading = sections[sec]
+        body = " ".join(u.text for u in units[i:j])
+        chunks.append(Chunk(f"{heading}: {body}" if heading else body, page,
+                            units[i].start, units[j - 1].end, heading))
+        if j >= n or units[j].section != sec:
+            i = j
+            continue
+        # carry trailing units (at most `overlap` tokens) into the next chunk, but only
+        # as many as still leave room for unit j: a chunk of only overlap adds nothing
+        k, carried = j, 0
+        while k - 1 > i and carried + tokens[k - 1] <= min(overlap, limit - tokens[j]):
+            k -= 1
+            carried += tokens[k]
+        i = k
+    return chunks
+
@@ -0,0 +1,167 @@
+# chunkstore.py
+import os
+import json
+import mmap
+import shutil
+from typing import Dict, Iterator, List, Sequence
+import numpy as np
+
+STORE_VERSION = 1
+
+
+class BlobColumn(Sequence):
+    """Strings packed into one UTF-8 blob plus an (n+1) offsets array; decoded on access."""
+
+    def __init__(self, blob, offsets: np.ndarray):
+        self._blob = blob
+        self._offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        start, end = int(self._offsets[i]), int(self._offsets[i + 1])
+        return bytes(self._blob[start:end]).decode("utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(len(self)):
+            yield self[i]
+
+
+class CodedColumn(Sequence):
+    """Dictionary-encoded strings: int32 codes into a small vocabulary."""
+
+    def __init__(self, codes: np.ndarray, vocab: List[str]):
+        self._codes = codes
+        self.vocab = vocab
+
+    def __len__(self) -> int:
+        return len(self._codes)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.vocab[c] for c in self._codes[i].tolist()]
+        return self.vocab[int(self._codes[i])]
+
+    def __iter__(self) -> Iterator[str]:
+        for c in self._codes.tolist():
+            yield self.vocab[c]
+
+    def codes(self) -> np.ndarray:
+        return self._codes
+
+
+# ------------------------
+# Writer
+# ------------------------
+def _write_blob(dirpath: str, name: str, values: Sequence[str]):
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    with open(os.path.join(dirpath, name + ".bin"), "wb") as f:
+        pos = 0
+        for i, v in enumerate(values):
+            b = v.encode("utf-8")
+            f.write(b)
+            pos += len(b)
+            offsets[i + 1] = pos
+    np.save(os.path.join(dirpath, name + "_offsets.npy"), offsets)
+
+
+def _encode(values: Sequence[str]):
+    vocab: Dict[str, int] = {}
+    codes = np.fromiter((vocab.setdefault(s, len(vocab)) for s in values), dtype=np.int32, count=len(values))
+    return codes, list(vocab)
+
+
+def write_chunk_store(dirpath: str, ids: Sequence[str], sources: Sequence[str], texts: Sequence[str],
+                      meta: Dict = None, locs: np.ndarray = None, headings: Sequence[str] = None,
+                      ingested: np.ndarray = None):
+    """
+    Write the chunk columns to `dirpath` atomically (build in a temp dir, then
+    swap), so readers holding mmaps of the previous version are unaffected.
+    `locs` is an optional (n, 3) int64 array of (page, char_start, char_end),
+    `ingested` an optional int64 array of ingest times (epoch seconds).
+    """
+    tmp = dirpath + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    _write_blob(tmp, "texts", texts)
+    _write_blob(tmp, "ids", ids)
+    codes, source_vocab = _encode(sources)
+    np.save(os.path.join(tmp, "source_codes.npy"), codes)
+    extra = {}
+    if locs is not None:
+        np.save(os.path.join(tmp, "locs.npy"), np.asarray(locs, dtype=np.int64).reshape(-1, 3))
+    if ingested is not None:
+        np.save(os.path.join(tmp, "ingested.npy"), np.asarray(ingested, dtype=np.int64))
+    if headings is not None:
+        codes, extra["headings"] = _encode(headings)
+        np.save(os.path.join(tmp, "heading_codes.npy"), codes)
+    with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(dict(meta or {}, version=STORE_VERSION, n=len(ids), sources=source_vocab, **extra), f)
+
+    old = dirpath + ".old"
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(dirpath):
+        os.replace(dirpath, old)
+    os.replace(tmp, dirpath)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+# ------------------------
+# Reader
+# ------------------------
+class ChunkStore:
+    """
+    Read-only, memory-mapped view of a chunk store. Opening is O(1) in corpus
+    size: texts and ids are only decoded for the rows that are accessed.
+    """
+
+    def __init__(self, dirpath: str):
+        self.dir = dirpath
+        with open(os.path.join(dirpath, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != STORE_VERSION:
+            raise ValueError(f"unsupported chunk store version in {dirpath}")
+        self._maps = []
+        self.texts = BlobColumn(self._map("texts.bin"), self._load("texts_offsets.npy"))
+        self.ids = BlobColumn(self._map("ids.bin"), self._load("ids_offsets.npy"))
+        self.sources = CodedColumn(self._load("source_codes.npy"), self.meta["sources"])
+        # location columns are absent from stores written before chunk offsets existed
+        self.locs = self._load("locs.npy") if os.path.exists(os.path.join(dirpath, "locs.npy")) else None
+        self.ingested = (self._load("ingested.npy")
+                         if os.path.exists(os.path.join(dirpath, "ingested.npy")) else None)
+        self.headings = (CodedColumn(self._load("heading_codes.npy"), self.meta["headings"])
+                         if "headings" in self.meta else None)
+
+    def _load(self, name: str) -> np.ndarray:
+        return np.load(os.path.join(self.dir, name), mmap_mode="r")
+
+    def _map(self, name: str):
+        path = os.path.join(self.dir, name)
+        if os.path.getsize(path) == 0:
+            return b""
+        with open(path, "rb") as f:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)  # the map holds its own handle
+        self._maps.append(m)
+        return m
+
+    def __len__(self) -> int:
+        return int(self.meta["n"])
+
+    def close(self):
+        """
+        Unmap the text and id blobs; their columns are unusable afterwards.
+        The .npy columns are released with their last reference.
+        """
+        for m in getattr(self, "_maps", ()):
+            m.close()
+        self._maps = []
+
+    def __del__(self):
+        self.close()
@@ -0,0 +1,195 @@
+# context_packer.py
+"""
+Context packing for the summary prompt.
+
+Sources (local hits, then web hits, each in rank order) are taken
+round-robin by rank, so the best local and best web result come first.
+Each source is checked against the ones already packed:
+    - local chunks from the same document whose spans overlap (the chunkers'
+      overlap windows) have the repeated words trimmed, or are dropped when
+      fully contained
+    - near-duplicates (SimHash of word shingles within SIMHASH_MAX_DISTANCE
+      bits, e.g. the same snippet from two web pages) are dropped
+and the rest fill PROMPT_TOKEN_BUDGET greedily. Tokens are counted with the
+LLM's tokenizer (tiktoken, o200k_base for gpt-4o-mini) when available.
+"""
+import os
+import re
+import hashlib
+from typing import Callable, Dict, List, Tuple
+from telemetry import span, incr
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "3000"))        # whole prompt, instructions included
+PACK_SOURCE_MAX_TOKENS = int(os.getenv("PACK_SOURCE_MAX_TOKENS", "500"))   # per source (was 2000 chars)
+PACK_SOURCE_MIN_TOKENS = int(os.getenv("PACK_SOURCE_MIN_TOKENS", "48"))    # smaller leftovers are not worth a slot
+PACK_MIN_OVERLAP_WORDS = int(os.getenv("PACK_MIN_OVERLAP_WORDS", "8"))
+SIMHASH_MAX_DISTANCE = int(os.getenv("SIMHASH_MAX_DISTANCE", "3"))
+PROMPT_ENCODING = os.getenv("PROMPT_ENCODING", "o200k_base")
+LEGACY_SNIPPET_CHARS = 2000   # what the unpacked prompt sent per source; the baseline for tokens_saved
+
+WORD_RE = re.compile(r"\S+")
+
+
+# ------------------------
+# Token counting
+# ------------------------
+_encoding = None
+
+
+def _tiktoken():
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(PROMPT_ENCODING)
+        except Exception as e:
+            print(f"[context_packer] tiktoken {PROMPT_ENCODING} unavailable ({type(e).__name__}); estimating tokens")
+            _encoding = False
+    return _encoding or None
+
+
+def count_tokens(text: str) -> int:
+    enc = _tiktoken()
+    if enc is not None:
+        return len(enc.encode(text, disallowed_special=()))
+    return max(1, len(text) // 4)   # ~4 characters per token for English text
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    enc = _tiktoken()
+    if enc is not None:
+        ids = enc.encode(text, disallowed_special=())
+        return text if len(ids) <= max_tokens else enc.decode(ids[:max_tokens]) + "…"
+    return text if len(text) <= max_tokens * 4 else text[:max_tokens * 4] + "…"
+
+
+def tokenizer_name() -> str:
+    return PROMPT_ENCODING if _tiktoken() is not None else "approx"
+
+
+# ------------------------
+# Duplicates
+# ------------------------
+def simhash(words: List[str], shingle: int = 3) -> int:
+    """64-bit SimHash over word shingles, ignoring case and punctuation."""
+    words = [w for w in (re.sub(r"\W+", "", w.lower()) for w in words) if w]
+    grams = [" ".join(words[i:i + shingle]) for i in range(max(len(words) - shingle + 1, 1))]
+    weights = [0] * 64
+    for g in grams:
+        h = int.from_bytes(hashlib.blake2b(g.encode("utf-8"), digest_size=8).digest(), "little")
+        for bit in range(64):
+            weights[bit] += 1 if h >> bit & 1 else -1
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def _overlap(a: List[str], b: List[str]) -> int:
+    """Words of `b` already in `a`: len(b) if b is inside a, else the longest suffix/prefix overlap."""
+    if not a or not b:
+        return 0
+    best = 0
+    first, last = b[0], b[-1]
+    for i, w in enumerate(a):
+        # b contained in a, or b starts with a's tail
+        if w == first:
+            k = min(len(a) - i, len(b))
+            if a[i:i + k] == b[:k]:
+                if k == len(b):
+                    return k
+                best = max(best, k)
+    for i in range(len(a)):
+        # b ends with a's head
+        if a[i] == last and i + 1 <= len(b) and a[:i + 1] == b[len(b) - i - 1:]:
+            best = max(best, i + 1)
+    return best
+
+
+def _same_doc(x: Dict, y: Dict) -> bool:
+    mx, my = x.get("meta") or {}, y.get("meta") or {}
+    if not mx.get("source") or mx.get("source") != my.get("source") or "id" not in mx:
+        return False
+    if mx.get("page") != my.get("page"):
+        return False
+    sx, ex, sy, ey = mx.get("char_start", -1), mx.get("char_end", -1), my.get("char_start", -1), my.get("char_end", -1)
+    # known spans that do not touch cannot share text
+    return min(sx, ex, sy, ey) < 0 or (sx < ey and sy < ex)
+
+
+def _by_rank(sources: List[Dict]) -> List[int]:
+    """Indices interleaved by rank within each origin (Local:/Web:)."""
+    groups: Dict[str, List[int]] = {}
+    for i, s in enumerate(sources):
+        groups.setdefault(s.get("label", "").split(":", 1)[0], []).append(i)
+    order = []
+    for r in range(max((len(g) for g in groups.values()), default=0)):
+        order.extend(g[r] for g in groups.values() if r < len(g))
+    return order
+
+
+# ------------------------
+# Packing
+# ------------------------
+def pack_sources(sources: List[Dict], render: Callable[[List[Dict]], str],
+                 budget: int = PROMPT_TOKEN_BUDGET, max_source_tokens: int = PACK_SOURCE_MAX_TOKENS
+                 ) -> Tuple[List[Dict], Dict]:
+    """
+    Return (packed sources in their original order, stats). `render` builds
+    the prompt from a source list; it is used for the fixed overhead and for
+    the tokens_saved baseline (the unpacked prompt with LEGACY_SNIPPET_CHARS
+    per source).
+    """
+    with span("context.pack", sources=len(sources)) as s:
+        overhead = count_tokens(render([]))
+        per_source = count_tokens(render([{"label": "", "text": ""}])) - overhead
+        baseline = count_tokens(render([dict(x, text=x["text"][:LEGACY_SNIPPET_CHARS]) for x in sources]))
+        remaining = budget - overhead
+        kept: Dict[int, Dict] = {}
+        kept_words: Dict[int, List[str]] = {}
+        hashes: List[int] = []
+        stats = {"overlaps_trimmed": 0, "duplicates_dropped": 0, "over_budget_dropped": 0}
+        for i in _by_rank(sources):
+            src = sources[i]
+            # chunks of one section share their "heading: " prefix; compare the bodies
+            heading = (src.get("meta") or {}).get("heading", "")
+            prefix = heading + ": " if heading and src["text"].startswith(heading + ": ") else ""
+            words = WORD_RE.findall(src["text"][len(prefix):])
+            trimmed, dup = False, False
+            for j, other in kept_words.items():
+                if not _same_doc(sources[j], src):
+                    continue
+                k = _overlap(other, words)
+                if k == len(words):
+                    dup = True
+                    break
+                if k >= PACK_MIN_OVERLAP_WORDS:
+                    words = words[k:] if other[len(other) - k:] == words[:k] else words[:len(words) - k]
+                    trimmed = True
+                    stats["overlaps_trimmed"] += 1
+            if dup or not words:
+                stats["duplicates_dropped"] += 1
+                continue
+            h = simhash(words)
+            if any(hamming(h, x) <= SIMHASH_MAX_DISTANCE for x in hashes):
+                stats["duplicates_dropped"] += 1
+                continue
+            text = prefix + " ".join(words) if trimmed else src["text"].strip()
+            cap = min(max_source_tokens, remaining - per_source - count_tokens(src.get("label", "")))
+            if cap < PACK_SOURCE_MIN_TOKENS:
+                stats["over_budget_dropped"] += 1
+                continue
+            text = truncate_tokens(text, cap)
+            remaining -= per_source + count_tokens(src.get("label", "")) + count_tokens(text)
+            kept[i] = dict(src, text=text)
+            kept_words[i] = words
+            hashes.append(h)
+        packed = [kept[i] for i in sorted(kept)]
+        tokens = count_tokens(render(packed))
+        stats.update(tokenizer=tokenizer_name(), budget=budget, sources_in=len(sources), sources_out=len(packed),
+                     baseline_tokens=baseline, prompt_tokens=tokens, tokens_saved=max(baseline - tokens, 0))
+        s.attributes.update(sources_out=len(packed), prompt_tokens=tokens, tokens_saved=stats["tokens_saved"])
+    incr("rag_context_tokens_saved_total", stats["tokens_saved"])
+    incr("rag_context_sources_dropped_total", len(sources) - len(packed))
+    return packed, stats
@@ -0,0 +1,213 @@
+# embedding_cache.py
+import os
+import re
+import json
+import hashlib
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: no inter-process lock, keep one writer per cache dir
+    fcntl = None
+
+KEY_BYTES = 16
+
+
+class EmbeddingCache:
+    """
+    Persistent embedding cache keyed by (model name, chunk-text hash).
+
+    Layout of `<cache_dir>/<model>/`:
+    - vectors.npy : float32 matrix (capacity x dim), opened as a memory map
+    - keys.npy    : fixed-size text digests, one per slot
+    - ticks.npy   : last-use clock per slot (0 = free slot), used for LRU eviction
+    - meta.json   : model name, dim, capacity, the current clock and a
+                    generation counter bumped by every write
+
+    Several processes (the app, batch jobs, the retrieval server) may share
+    one directory. Every operation holds a thread lock plus an exclusive
+    flock on `lock`, and first re-reads keys/ticks if another process wrote a
+    newer generation, so slots are never handed out twice. Inserts are
+    written through (vectors, then keys); lookups only bump LRU ticks in
+    memory, which flush() merges into the files.
+    """
+
+    def __init__(self, cache_dir: str, model_name: str, dim: int, max_entries: int = 200_000):
+        self.model_name = model_name
+        self.dim = dim
+        self.capacity = max_entries
+        self.dir = os.path.join(cache_dir, re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name))
+        os.makedirs(self.dir, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self._dirty = False
+        self._lock = threading.RLock()
+        self._lock_file = open(self._path("lock"), "a+b")
+        self._touched: Dict[bytes, None] = {}   # keys read since the last flush
+        self.generation = -1
+        with self._locked():
+            self._open()
+
+    # ------------------------
+    # Storage
+    # ------------------------
+    def _path(self, name: str) -> str:
+        return os.path.join(self.dir, name)
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _read_meta(self) -> Dict:
+        try:
+            with open(self._path("meta.json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _refresh(self):
+        """Pick up another process's writes. Caller holds _locked()."""
+        if self._read_meta().get("generation", 0) != self.generation:
+            self._open()
+
+    def _open(self):
+        meta = self._read_meta()
+        compatible = (
+            meta.get("model") == self.model_name
+            and meta.get("dim") == self.dim
+            and meta.get("capacity") == self.capacity
+            and all(os.path.exists(self._path(n)) for n in ("vectors.npy", "keys.npy", "ticks.npy"))
+        )
+        if compatible:
+            if getattr(self, "vectors", None) is None:
+                # the file is never replaced while compatible; one mapping is enough
+                self.vectors = np.load(self._path("vectors.npy"), mmap_mode="r+")
+            self.keys = np.load(self._path("keys.npy"))
+            self.ticks = np.load(self._path("ticks.npy"))
+            self.clock = int(meta.get("clock", 0))
+            self.generation = int(meta.get("generation", 0))
+        else:
+            # (re)initialise: a different model, dim or capacity invalidates the cache
+            self.vectors = np.lib.format.open_memmap(
+                self._path("vectors.npy"), mode="w+", dtype=np.float32, shape=(self.capacity, self.dim)
+            )
+            self.keys = np.zeros((self.capacity, KEY_BYTES), dtype=np.uint8)
+            self.ticks = np.zeros(self.capacity, dtype=np.int64)
+            self.clock = 0
+            self.generation = int(meta.get("generation", 0))
+            self._save()
+        used = np.flatnonzero(self.ticks > 0)
+        self.slot_of = {self.keys[i].tobytes(): int(i) for i in used}
+        self._free = np.flatnonzero(self.ticks == 0)[::-1].tolist()
+
+    def _save(self):
+        """Write keys, ticks and meta as a new generation. Caller holds _locked()."""
+        self.vectors.flush()  # vectors land before the keys that point at them
+        self.generation += 1
+        suffix = f".{os.getpid()}.tmp"
+        for name, arr in (("keys.npy", self.keys), ("ticks.npy", self.ticks)):
+            tmp = self._path(name + suffix + ".npy")
+            np.save(tmp, arr)
+            os.replace(tmp, self._path(name))
+        tmp = self._path("meta.json" + suffix)
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"model": self.model_name, "dim": self.dim, "capacity": self.capacity,
+                       "clock": self.clock, "generation": self.generation}, f)
+        os.replace(tmp, self._path("meta.json"))
+        self._dirty = False
+
+    def flush(self):
+        """Persist the LRU ticks of lookups since the last flush."""
+        with self._locked():
+            if not self._dirty and not self._touched:
+                return
+            touched, self._touched = self._touched, {}
+            self._refresh()
+            slots = [self.slot_of[k] for k in touched if k in self.slot_of]
+            if slots:
+                self.clock += 1
+                self.ticks[slots] = self.clock
+            self._save()
+
+    # ------------------------
+    # Lookup / insert
+    # ------------------------
+    def key(self, text: str) -> bytes:
+        h = hashlib.blake2b(digest_size=KEY_BYTES)
+        h.update(self.model_name.encode("utf-8"))
+        h.update(b"\0")
+        h.update(text.encode("utf-8"))
+        return h.digest()
+
+    def get_many(self, texts: List[str]) -> Tuple[np.ndarray, List[int]]:
+        """Return (embeddings, missing positions); rows at missing positions are zero."""
+        with self._locked():
+            self._refresh()
+            out = np.zeros((len(texts), self.dim), dtype=np.float32)
+            missing, found_rows, found_slots = [], [], []
+            for i, t in enumerate(texts):
+                k = self.key(t)
+                slot = self.slot_of.get(k)
+                if slot is None:
+                    missing.append(i)
+                else:
+                    found_rows.append(i)
+                    found_slots.append(slot)
+                    self._touched[k] = None
+            if found_slots:
+                slots = np.array(found_slots, dtype=np.int64)
+                out[found_rows] = self.vectors[slots]
+                self.clock += 1
+                self.ticks[slots] = self.clock
+                self._dirty = True
+            self.hits += len(found_slots)
+            self.misses += len(missing)
+            return out, missing
+
+    def put_many(self, texts: List[str], emb: np.ndarray):
+        """Insert and persist at once, so no other process can reuse the slots."""
+        with self._locked():
+            self._refresh()
+            if len(texts) > self.capacity:
+                texts, emb = texts[-self.capacity:], emb[-self.capacity:]
+            keys = [self.key(t) for t in texts]
+            new = [k for k in dict.fromkeys(keys) if k not in self.slot_of]
+            if len(new) > len(self._free):
+                self._evict(max(len(new) - len(self._free), self.capacity // 10), protect=set(keys))
+            self.clock += 1
+            for k, row in zip(keys, emb):
+                slot = self.slot_of.get(k)
+                if slot is None:
+                    slot = self._free.pop()
+                    self.slot_of[k] = slot
+                    self.keys[slot] = np.frombuffer(k, dtype=np.uint8)
+                self.vectors[slot] = row
+                self.ticks[slot] = self.clock
+            self._save()
+
+    def _evict(self, n: int, protect: set):
+        """Free the `n` least recently used slots."""
+        used = np.array([s for k, s in self.slot_of.items() if k not in protect], dtype=np.int64)
+        if len(used) == 0:
+            return
+        n = min(n, len(used))
+        victims = used[np.argpartition(self.ticks[used], n - 1)[:n]]
+        for slot in victims.tolist():
+            del self.slot_of[self.keys[slot].tobytes()]
+            self.ticks[slot] = 0
+            self._free.append(slot)
+        print(f"[embedding_cache] evicted {len(victims)} entries from {self.dir}")
+
+    def __len__(self):
+        return len(self.slot_of)
@@ -0,0 +1,175 @@
+# filters.py
+"""
+Metadata filters pushed down into retrieval.
+
+Each index row has filterable columns stored next to the index: source (the
+chunk store's dictionary-coded sources), extension (derived from the
+source), page, ingest time (epoch seconds, from the ingest manifest) and
+tags (per source, from <docs>/tags.json). A FilterIndex pre-builds one
+bitmap per extension and per tag when it is created. A SearchFilter is
+turned into a single packed bitmap (bit i = row i, little bit order) by
+AND-ing per-field bitmaps, and the result is cached per filter. FAISS
+searches only the selected rows through an IDSelectorBitmap; BM25 gets the
+same rows as a boolean mask.
+
+tags.json maps file names or glob patterns to tags:
+    {"java_jdbc.md": ["java", "databases"], "*.pdf": ["reports"]}
+"""
+import os
+import json
+import fnmatch
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import cached_property
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+
+TAGS_FILE = os.getenv("TAGS_FILE", "tags.json")   # looked up inside the docs folder
+FILTER_CACHE_SIZE = int(os.getenv("FILTER_CACHE_SIZE", "64"))
+
+
+@dataclass(frozen=True)
+class SearchFilter:
+    """All set fields must match (AND); a list field matches any of its values (OR). Hashable."""
+    sources: Tuple[str, ...] = ()
+    extensions: Tuple[str, ...] = ()            # without the dot: "pdf", "md"
+    tags: Tuple[str, ...] = ()
+    page_min: Optional[int] = None              # PDF pages, 1-based; chunks without a page never match
+    page_max: Optional[int] = None
+    ingested_after: Optional[float] = None      # epoch seconds; chunks with an unknown ingest time never match
+    ingested_before: Optional[float] = None
+
+    def __post_init__(self):
+        # accept lists from callers; keep the dataclass hashable
+        for name in ("sources", "extensions", "tags"):
+            object.__setattr__(self, name, tuple(getattr(self, name) or ()))
+        object.__setattr__(self, "extensions", tuple(e.lower().lstrip(".") for e in self.extensions))
+
+    def is_empty(self) -> bool:
+        return self == SearchFilter()
+
+
+def extension(source: str) -> str:
+    return os.path.splitext(source)[1].lower().lstrip(".")
+
+
+def load_tags(folder: str, sources: Sequence[str]) -> Dict[str, List[str]]:
+    """Tags per source from `folder`/TAGS_FILE (empty when the file is missing)."""
+    path = os.path.join(folder, TAGS_FILE)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            spec = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"[filters] could not read {path}: {e}")
+        return {}
+    tags: Dict[str, List[str]] = {}
+    for src in sorted(set(sources)):
+        found = [t for pattern, ts in spec.items() if fnmatch.fnmatch(src, pattern) for t in ts]
+        if found:
+            tags[src] = sorted(set(found))
+    return tags
+
+
+@dataclass
+class Selection:
+    bitmap: np.ndarray     # packed uint8, little bit order, ceil(n / 8) bytes
+    count: int             # selected rows
+    n: int                 # rows in the index
+
+    @cached_property
+    def mask(self) -> np.ndarray:
+        """Boolean row mask (for BM25)."""
+        return np.unpackbits(self.bitmap, count=self.n, bitorder="little").astype(bool)
+
+
+class FilterIndex:
+    """Filter columns of one index revision, with prebuilt extension and tag bitmaps."""
+
+    def __init__(self, sources: Sequence[str], pages: np.ndarray, ingested: np.ndarray,
+                 tags: Dict[str, List[str]]):
+        self.n = len(sources)
+        if hasattr(sources, "codes"):
+            # CodedColumn: reuse the stored codes instead of decoding every row
+            self.codes, self.vocab = np.asarray(sources.codes()), list(sources.vocab)
+        else:
+            vocab: Dict[str, int] = {}
+            self.codes = np.fromiter((vocab.setdefault(s, len(vocab)) for s in sources), dtype=np.int32,
+                                     count=self.n)
+            self.vocab = list(vocab)
+        self.pages = np.asarray(pages, dtype=np.int64)
+        self.ingested = np.asarray(ingested, dtype=np.int64)
+        self.tags = tags
+        present = np.bincount(self.codes, minlength=len(self.vocab)) > 0
+        self.sources = sorted(v for v, p in zip(self.vocab, present) if p)
+
+        exts = [extension(v) for v in self.vocab]
+        self._ext_bitmaps = {}
+        for e in sorted({x for x, p in zip(exts, present) if p}):
+            self._ext_bitmaps[e] = self._pack(np.isin(self.codes, [i for i, x in enumerate(exts) if x == e]))
+        self._tag_bitmaps = {}
+        for tag in sorted({t for ts in tags.values() for t in ts}):
+            codes = [i for i, v in enumerate(self.vocab) if tag in tags.get(v, ())]
+            self._tag_bitmaps[tag] = self._pack(np.isin(self.codes, codes))
+        self._cache: "OrderedDict[SearchFilter, Selection]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _pack(self, mask: np.ndarray) -> np.ndarray:
+        return np.packbits(mask, bitorder="little")
+
+    def _any(self, bitmaps: Dict[str, np.ndarray], keys: Sequence[str]) -> np.ndarray:
+        out = np.zeros((self.n + 7) // 8, dtype=np.uint8)
+        for k in keys:
+            if k in bitmaps:
+                out |= bitmaps[k]
+        return out
+
+    @property
+    def extensions(self) -> List[str]:
+        return list(self._ext_bitmaps)
+
+    @property
+    def tag_names(self) -> List[str]:
+        return list(self._tag_bitmaps)
+
+    def select(self, f: SearchFilter) -> Selection:
+        with self._lock:
+            sel = self._cache.get(f)
+            if sel is not None:
+                self._cache.move_to_end(f)
+                return sel
+        parts = []
+        if f.sources:
+            wanted = set(f.sources)
+            parts.append(self._pack(np.isin(self.codes, [i for i, v in enumerate(self.vocab) if v in wanted])))
+        if f.extensions:
+            parts.append(self._any(self._ext_bitmaps, f.extensions))
+        if f.tags:
+            parts.append(self._any(self._tag_bitmaps, f.tags))
+        if f.page_min is not None or f.page_max is not None:
+            lo = f.page_min if f.page_min is not None else 1
+            hi = f.page_max if f.page_max is not None else np.iinfo(np.int64).max
+            parts.append(self._pack((self.pages >= lo) & (self.pages <= hi)))
+        if f.ingested_after is not None or f.ingested_before is not None:
+            m = self.ingested >= 0
+            if f.ingested_after is not None:
+                m &= self.ingested >= f.ingested_after
+            if f.ingested_before is not None:
+                m &= self.ingested < f.ingested_before
+            parts.append(self._pack(m))
+        bitmap = np.full((self.n + 7) // 8, 0xFF, dtype=np.uint8)
+        for p in parts:
+            bitmap &= p
+        if self.n % 8:
+            bitmap[-1] &= (1 << (self.n % 8)) - 1   # padding bits past the last row
+        sel = Selection(bitmap, int(np.unpackbits(bitmap).sum()), self.n)
+        with self._lock:
+            self._cache[f] = sel
+            if len(self._cache) > FILTER_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return sel
+
+    def options(self) -> Dict[str, List[str]]:
+        return {"sources": self.sources, "extensions": self.extensions, "tags": self.tag_names}
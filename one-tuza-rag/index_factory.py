@@ -0,0 +1,219 @@
+# index_factory.py
+import os
+import math
+from typing import Optional
+import numpy as np
+import faiss
+
+# flat | hnsw | ivf | ivfpq | opq | sq8 | sq4 | binary, or any raw faiss index_factory string
+INDEX_TYPE = os.getenv("INDEX_TYPE", "flat")
+INDEX_NPROBE = int(os.getenv("INDEX_NPROBE", "16"))
+INDEX_EF_SEARCH = int(os.getenv("INDEX_EF_SEARCH", "64"))
+HNSW_M = int(os.getenv("HNSW_M", "32"))
+# compact storage: "binary" pre-searches sign-bit codes by Hamming distance and
+# re-scores BINARY_K_FACTOR * k candidates with BINARY_RESCORE-quantized vectors
+BINARY_RESCORE = os.getenv("BINARY_RESCORE", "sq8")
+BINARY_K_FACTOR = int(os.getenv("BINARY_K_FACTOR", "10"))
+# optional dimension reduction before indexing (0 = off): "pca" or "truncate"
+# (keep the leading dims, for Matryoshka-trained models); vectors are re-normalized
+INDEX_DIM = int(os.getenv("INDEX_DIM", "0"))
+INDEX_DIM_METHOD = os.getenv("INDEX_DIM_METHOD", "pca")
+
+INDEX_TYPES = ("flat", "hnsw", "ivf", "ivfpq", "opq")
+COMPACT_TYPES = ("sq8", "sq4", "binary")
+
+_SQ_TYPES = {"sq8": faiss.ScalarQuantizer.QT_8bit, "sq4": faiss.ScalarQuantizer.QT_4bit,
+             "fp16": faiss.ScalarQuantizer.QT_fp16}
+
+
+def _nlist(n: int) -> int:
+    # ~4*sqrt(n) centroids, but keep >= 39 training points per centroid
+    return max(1, min(int(4 * math.sqrt(n)), n // 39))
+
+
+def _pq_m(dim: int) -> int:
+    # ~8 dims per sub-quantizer; m must divide dim
+    for m in range(max(1, dim // 8), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+def factory_string(index_type: str, dim: int, n: int) -> str:
+    """Translate a named backend into a faiss index_factory description."""
+    t = index_type.lower()
+    if t == "flat":
+        return "Flat"
+    if t == "hnsw":
+        return f"HNSW{HNSW_M}"
+    if t == "ivf":
+        return f"IVF{_nlist(n)},Flat"
+    if t == "ivfpq":
+        return f"IVF{_nlist(n)},PQ{_pq_m(dim)}x8"
+    if t == "opq":
+        m = _pq_m(dim)
+        return f"OPQ{m},IVF{_nlist(n)},PQ{m}x8"
+    if t in ("sq8", "sq4"):
+        return t.upper()
+    if t == "binary":
+        return f"LSH{dim},Refine({BINARY_RESCORE.upper()})"
+    return index_type
+
+
+def _binary_index(dim: int, rescore: str = BINARY_RESCORE, k_factor: int = BINARY_K_FACTOR) -> faiss.Index:
+    # IndexLSH without rotation/thresholds stores the sign bit of each dimension
+    # (dim / 8 bytes per vector) and ranks by Hamming distance; IndexRefine then
+    # re-scores the shortlist by inner product on the quantized vectors.
+    base = faiss.IndexLSH(dim, dim, False, False)
+    base.metric_type = faiss.METRIC_INNER_PRODUCT  # Hamming search ignores it; IndexRefine requires a match
+    if rescore.lower() == "flat":
+        refine = faiss.IndexFlatIP(dim)
+    else:
+        refine = faiss.IndexScalarQuantizer(dim, _SQ_TYPES[rescore.lower()], faiss.METRIC_INNER_PRODUCT)
+    index = faiss.IndexRefine(base, refine)
+    index.k_factor = k_factor
+    # the sub-indexes are owned by their Python wrappers; keep them alive with `index`
+    index.referenced_objects = [base, refine]
+    return index
+
+
+def _reduction(dim: int, out_dim: int, method: str) -> faiss.VectorTransform:
+    if method == "truncate":
+        return faiss.RemapDimensionsTransform(dim, out_dim, False)
+    if method == "pca":
+        return faiss.PCAMatrix(dim, out_dim)
+    raise ValueError(f"unknown dimension reduction {method!r}; expected 'pca' or 'truncate'")
+
+
+def make_index(index_type: str, vectors: np.ndarray, reduce_dim: int = INDEX_DIM,
+               reduce_method: str = INDEX_DIM_METHOD) -> faiss.Index:
+    """
+    Build (and train, if needed) an inner-product index over normalized `vectors`.
+    Corpora too small to train the requested quantizers fall back to a flat index.
+    With `reduce_dim`, vectors are projected to that many dimensions (and
+    re-normalized) inside the index, so callers keep passing full-size vectors.
+    """
+    n, dim = vectors.shape
+    out_dim = reduce_dim if 0 < reduce_dim < dim else dim
+    if out_dim != dim and reduce_method == "pca" and n < out_dim:
+        print(f"[index_factory] {n} vectors too few to fit PCA{out_dim}, keeping {dim} dims")
+        out_dim = dim
+    spec = factory_string(index_type, out_dim, n)
+    # k-means wants >= 39 points per centroid (256 per PQ codebook)
+    min_train = 256 * 39 if "PQ" in spec else (39 if "IVF" in spec else 0)
+    if n < min_train:
+        print(f"[index_factory] {n} vectors too few to train '{spec}', using Flat")
+        spec = "Flat"
+    if index_type.lower() == "binary":
+        index = _binary_index(out_dim)
+    else:
+        index = faiss.index_factory(out_dim, spec, faiss.METRIC_INNER_PRODUCT)
+    if out_dim != dim:
+        inner = index
+        chain = [_reduction(dim, out_dim, reduce_method), faiss.NormalizationTransform(out_dim, 2.0)]
+        index = faiss.IndexPreTransform(inner)
+        for vt in reversed(chain):
+            index.prepend_transform(vt)
+        index.referenced_objects = [inner] + chain
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    return index
+
+
+def _base_index(index: faiss.Index) -> faiss.Index:
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexPreTransform):
+        return _base_index(index.index)
+    return index
+
+
+def effective_type(index: faiss.Index) -> str:
+    """
+    Named type of a built index ("flat", "hnsw", "ivf", "ivfpq", "opq", "sq8",
+    "sq4", "binary"): make_index may have fallen back to flat, so this is
+    what gets recorded, not the requested type.
+    """
+    outer = faiss.downcast_index(index)
+    transforms = []
+    while isinstance(outer, faiss.IndexPreTransform):
+        transforms += [faiss.downcast_VectorTransform(outer.chain.at(i)) for i in range(outer.chain.size())]
+        outer = faiss.downcast_index(outer.index)
+    base = outer
+    if isinstance(base, faiss.IndexRefine):
+        return "binary"
+    if isinstance(base, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(base, faiss.IndexIVFPQ):
+        # OPQMatrix is read back from disk as a plain LinearTransform; PCA keeps its class
+        opq = any(isinstance(vt, faiss.LinearTransform) and not isinstance(vt, faiss.PCAMatrix) for vt in transforms)
+        return "opq" if opq else "ivfpq"
+    if isinstance(base, faiss.IndexIVF):
+        return "ivf"
+    if isinstance(base, faiss.IndexScalarQuantizer):
+        return {faiss.ScalarQuantizer.QT_8bit: "sq8", faiss.ScalarQuantizer.QT_4bit: "sq4"}.get(base.sq.qtype, "sq")
+    if isinstance(base, faiss.IndexFlat):
+        return "flat"
+    return type(base).__name__
+
+
+def supports_positional_remove(index: faiss.Index) -> bool:
+    """True if remove_ids() compacts the index so positions stay sequential."""
+    # flat float and scalar-quantized codes (IndexFlatCodes) compact on removal
+    return isinstance(_base_index(index), faiss.IndexFlatCodes)
+
+
+def set_search_params(index: faiss.Index, nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                      k_factor: Optional[int] = None):
+    """Apply query-time knobs; parameters that do not apply to the index are ignored."""
+    ps = faiss.ParameterSpace()
+    for name, value in (("nprobe", nprobe), ("efSearch", ef_search), ("k_factor_rf", k_factor)):
+        if value is None:
+            continue
+        try:
+            ps.set_index_parameter(index, name, value)
+        except RuntimeError:
+            pass
+
+
+def pushes_down_filters(index: faiss.Index) -> bool:
+    """False for "binary": IndexLSH takes no IDSelector, so filtered searches post-filter."""
+    return not isinstance(_base_index(index), (faiss.IndexRefine, faiss.IndexLSH))
+
+
+def refine_parameters(index: faiss.Index, k: int) -> Optional[faiss.SearchParameters]:
+    """
+    For IndexRefine ("binary"), cap the shortlist k * k_factor at ntotal: a
+    longer one comes back padded with -1 labels, which IndexRefine ranks
+    ahead of real hits. None for other indexes or when no cap is needed.
+    """
+    base = _base_index(index)
+    if not isinstance(base, faiss.IndexRefine) or k * base.k_factor <= base.ntotal:
+        return None
+    params = faiss.IndexRefineSearchParameters()
+    params.k_factor = max(1.0, base.ntotal / max(k, 1))
+    return params
+
+
+def search_parameters(index: faiss.Index, sel: Optional[faiss.IDSelector] = None, nprobe: int = INDEX_NPROBE,
+                      ef_search: int = INDEX_EF_SEARCH, k: int = 0) -> Optional[faiss.SearchParameters]:
+    """
+    Per-call parameters restricting a search to `sel`, carrying the IVF/HNSW
+    knobs (per-call parameters override the index's own); None when the
+    index defaults apply. IndexRefine takes no selector and only gets the
+    k_factor cap of refine_parameters.
+    """
+    base = _base_index(index)
+    if isinstance(base, faiss.IndexRefine):
+        return refine_parameters(index, k)
+    if sel is None:
+        return None
+    if isinstance(base, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=sel, nprobe=nprobe)
+    if isinstance(base, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=sel, efSearch=ef_search)
+    return faiss.SearchParameters(sel=sel)
+
+
+def index_nbytes(index: faiss.Index) -> int:
+    return int(faiss.serialize_index(index).size)
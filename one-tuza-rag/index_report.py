@@ -0,0 +1,135 @@
+# index_report.py
+"""
+Recall-vs-latency report for the ANN backends in index_factory, measured
+against the exact flat index on the same vectors, with each index's size
+relative to the flat float32 index.
+
+    python index_report.py --docs docs/ --k 10 --queries 200 --out index_report.json
+    python index_report.py --index faiss.index --types hnsw,ivf
+    python index_report.py --index faiss.index --types flat,sq8,binary --dims 0,192,128
+"""
+import argparse
+import json
+import time
+from typing import Dict, List
+import numpy as np
+import faiss
+from index_factory import (INDEX_TYPES, COMPACT_TYPES, INDEX_DIM_METHOD, factory_string, make_index,
+                           effective_type, set_search_params, refine_parameters, index_nbytes)
+
+SWEEPS = {
+    "flat": [{}],
+    "hnsw": [{"ef_search": e} for e in (16, 32, 64, 128, 256)],
+    "ivf": [{"nprobe": p} for p in (1, 4, 8, 16, 32, 64)],
+    "ivfpq": [{"nprobe": p} for p in (1, 4, 8, 16, 32, 64)],
+    "opq": [{"nprobe": p} for p in (1, 4, 8, 16, 32, 64)],
+    "sq8": [{}],
+    "sq4": [{}],
+    "binary": [{"k_factor": f} for f in (1, 2, 5, 10, 20, 50)],
+}
+PARAMS = ("nprobe", "ef_search", "k_factor")
+
+
+def load_vectors(docs: str = "docs/", index_path: str = None) -> np.ndarray:
+    from vectorstore import VectorStore
+    vs = VectorStore()
+    if index_path:
+        vs.load(index_path)
+        texts = list(vs._texts)
+    else:
+        from ingest import ingest_local_documents
+        texts = [c.text for c in ingest_local_documents(docs)]
+    emb = vs.encode(texts, show_progress_bar=True, use_cache=True)
+    vs.flush_cache()
+    return emb
+
+
+def sample_queries(vectors: np.ndarray, n: int, noise: float = 0.05, seed: int = 0) -> np.ndarray:
+    """Perturbed corpus vectors: close to real data without being exact duplicates."""
+    rng = np.random.default_rng(seed)
+    q = vectors[rng.integers(0, len(vectors), size=n)].copy()
+    q += rng.normal(scale=noise, size=q.shape).astype(np.float32)
+    faiss.normalize_L2(q)
+    return q
+
+
+def evaluate(index: faiss.Index, queries: np.ndarray, truth: np.ndarray, k: int) -> Dict:
+    # searched like VectorStore does: the binary shortlist is capped at ntotal
+    params = refine_parameters(index, k)
+    hits, lat = 0, []
+    for i in range(len(queries)):
+        t0 = time.perf_counter()
+        _, I = index.search(queries[i : i + 1], k, params=params)
+        lat.append((time.perf_counter() - t0) * 1000)
+        hits += len(set(I[0].tolist()) & set(truth[i].tolist()))
+    lat = np.array(lat)
+    return {
+        f"recall@{k}": hits / float(truth.size),
+        "mean_ms": float(lat.mean()),
+        "p50_ms": float(np.percentile(lat, 50)),
+        "p95_ms": float(np.percentile(lat, 95)),
+    }
+
+
+def run_report(vectors: np.ndarray, types: List[str], k: int = 10, n_queries: int = 200,
+               dims: List[int] = (0,), dim_method: str = INDEX_DIM_METHOD) -> List[Dict]:
+    k = min(k, len(vectors))
+    queries = sample_queries(vectors, n_queries)
+    flat = faiss.IndexFlatIP(vectors.shape[1])
+    flat.add(vectors)
+    _, truth = flat.search(queries, k)
+    flat_bytes = index_nbytes(flat)
+
+    rows = []
+    for dim in dims:
+        for t in types:
+            t0 = time.perf_counter()
+            index = make_index(t, vectors, reduce_dim=dim, reduce_method=dim_method)
+            build_s = time.perf_counter() - t0
+            nbytes = index_nbytes(index)
+            # rows describe the index actually built: small corpora fall back to flat
+            built = effective_type(index)
+            for params in SWEEPS.get(built, [{}]):
+                set_search_params(index, **params)
+                row = {"type": built, "dim": dim or vectors.shape[1],
+                       "factory": factory_string(built, dim or vectors.shape[1], len(vectors)),
+                       "n": len(vectors), "build_s": build_s, "index_bytes": nbytes,
+                       "compression": flat_bytes / nbytes, "saved_pct": 100.0 * (1 - nbytes / flat_bytes)}
+                if built != t:
+                    row["requested"] = t
+                if dim:
+                    row["dim_method"] = dim_method
+                row.update(params)
+                row.update(evaluate(index, queries, truth, k))
+                rows.append(row)
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--docs", default="docs/")
+    ap.add_argument("--index", default=None, help="use the texts of a saved index instead of --docs")
+    ap.add_argument("--types", default=",".join(INDEX_TYPES + COMPACT_TYPES))
+    ap.add_argument("--dims", default="0", help="comma-separated reduced dimensions to try (0 = full)")
+    ap.add_argument("--dim-method", choices=("pca", "truncate"), default=INDEX_DIM_METHOD)
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--out", default=None, help="write rows as JSON")
+    args = ap.parse_args()
+
+    vectors = load_vectors(args.docs, args.index)
+    rows = run_report(vectors, [t.strip() for t in args.types.split(",") if t.strip()], args.k, args.queries,
+                      [int(d) for d in args.dims.split(",") if d.strip()], args.dim_method)
+    recall_key = f"recall@{min(args.k, len(vectors))}"
+    print(f"{'type':<8}{'dim':>5}  {'params':<16}{recall_key:>12}{'mean ms':>10}{'p95 ms':>10}{'MB':>10}{'x smaller':>11}")
+    for r in rows:
+        params = ",".join(f"{p}={r[p]}" for p in PARAMS if p in r)
+        print(f"{r['type']:<8}{r['dim']:>5}  {params:<16}{r[recall_key]:>12.3f}{r['mean_ms']:>10.3f}"
+              f"{r['p95_ms']:>10.3f}{r['index_bytes'] / 1e6:>10.2f}{r['compression']:>11.1f}")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,37 @@
 # ingest.py
 import os
 import re
-from typing import List
-from pypdf import PdfReader
-from dataclasses import dataclass
+import json
+import time
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Optional, Iterator, Tuple
+from pdf_extract import iter_pdf_pages, pdf_page_count, file_sha256
+from telemetry import traced, incr
+from dataclasses import dataclass, field
+from chunker import Block, CHUNK_STRATEGY, chunk_blocks, chunker_config, markdown_blocks
+
+# size of the process pool used to parse documents (1 = parse in-process)
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(os.cpu_count() or 1)))
+# PDFs with more pages than this are split into page ranges across workers
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "32"))
+# below this many input bytes, process start-up costs more than it saves
+INGEST_PARALLEL_MIN_BYTES = int(os.getenv("INGEST_PARALLEL_MIN_BYTES", str(8 << 20)))
 
 @dataclass
 class DocumentChunk:
     id: str
     source: str
     text: str
+    # location in the source: 1-based PDF page, char span in the Markdown file
+    # or in the page's extracted text (-1 when unknown), enclosing heading path
+    page: Optional[int] = None
+    char_start: int = -1
+    char_end: int = -1
+    heading: str = ""
+    # when its file was (re)parsed, epoch seconds (-1 when unknown)
+    ingested: int = -1
 
 # ------------------------
 # Cleaning utility
@@ -27,23 +49,49 @@ def clean_text(raw: str) -> str:
 # ------------------------
 # Readers
 # ------------------------
+def read_pdf_pages(path: str, start: int = 0, end: Optional[int] = None) -> str:
+    """Extract and clean the text of pages [start, end) of a PDF."""
+    return clean_text("\n".join(t for _, t in iter_pdf_pages(path, start, end)))
+
 def read_pdf(path: str) -> str:
-    text = []
-    reader = PdfReader(path)
-    for p in range(len(reader.pages)):
-        page = reader.pages[p]
-        try:
-            t = page.extract_text() or ""
-        except Exception:
-            t = ""
-        text.append(t)
-    return clean_text("\n".join(text))
+    return read_pdf_pages(path)
 
 def read_md(path: str) -> str:
     with open(path, "r", encoding="utf-8") as f:
         raw = f.read()
     return clean_text(raw)
 
+def read_document(path: str) -> Optional[str]:
+    """Dispatch on file extension. Returns None for unsupported file types."""
+    ext = path.lower().split(".")[-1]
+    if ext == "pdf":
+        return read_pdf(path)
+    if ext in ("md", "markdown", "txt"):
+        return read_md(path)
+    return None
+
+def read_pdf_blocks(path: str, start: int = 0, end: Optional[int] = None) -> List[Block]:
+    """One raw-text block per page of [start, end), so chunks never straddle pages."""
+    return [Block(t, 0, p + 1) for p, t in iter_pdf_pages(path, start, end) if t.strip()]
+
+def read_md_blocks(path: str, strategy: str = CHUNK_STRATEGY) -> List[Block]:
+    # newline="" keeps char offsets aligned with the file on disk
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        raw = f.read()
+    if strategy == "words":
+        # word windows cover the whole file, heading lines included, as before the chunker
+        return [Block(raw, 0)] if raw.strip() else []
+    return markdown_blocks(raw)
+
+def read_document_blocks(path: str) -> Optional[List[Block]]:
+    """Structured counterpart of read_document for the chunker."""
+    ext = path.lower().split(".")[-1]
+    if ext == "pdf":
+        return read_pdf_blocks(path)
+    if ext in ("md", "markdown", "txt"):
+        return read_md_blocks(path)
+    return None
+
 # ------------------------
 # Chunker
 # ------------------------
@@ -58,37 +106,238 @@ def chunk_text(text: str, chunk_size: int = 800, overlap: int = 100) -> List[str
         i += chunk_size - overlap
     return chunks
 
+def chunk_document(fn: str, blocks: List[Block], strategy: str = CHUNK_STRATEGY) -> List[DocumentChunk]:
+    if strategy == "words":
+        text = clean_text("\n".join(b.text for b in blocks))
+        return [DocumentChunk(id=f"{fn}__chunk_{i+1}", source=fn, text=t)
+                for i, t in enumerate(chunk_text(text))]
+    return [DocumentChunk(id=f"{fn}__chunk_{i+1}", source=fn, text=c.text, page=c.page,
+                          char_start=c.char_start, char_end=c.char_end, heading=c.heading)
+            for i, c in enumerate(chunk_blocks(blocks, clean_text, strategy))]
+
 # ------------------------
-# Ingest function
+# Manifest (incremental re-ingestion)
 # ------------------------
-def ingest_local_documents(folder: str = "docs/"):
-    chunks = []
-    idx = 0
+MANIFEST_VERSION = 1
+
+def load_manifest(path: str) -> Dict:
+    """Load the per-document manifest; returns an empty manifest if missing or stale."""
+    if not os.path.exists(path):
+        return {"version": MANIFEST_VERSION, "files": {}}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"[ingest] could not read manifest {path}: {e}")
+        return {"version": MANIFEST_VERSION, "files": {}}
+    if manifest.get("version") != MANIFEST_VERSION:
+        return {"version": MANIFEST_VERSION, "files": {}}
+    return manifest
+
+def save_manifest(manifest: Dict, path: str):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+@dataclass
+class IngestDelta:
+    chunks: List[DocumentChunk]            # chunks of new or changed files
+    stale_sources: List[str]               # sources whose old vectors must be dropped
+    manifest: Dict                         # manifest describing the folder after this run
+    added: List[str] = field(default_factory=list)
+    changed: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    unchanged: List[str] = field(default_factory=list)
+
+# ------------------------
+# Parallel parsing
+# ------------------------
+# A task is (file name, path, first page, end page); page bounds are None for
+# whole-file tasks. Tasks of one file are consecutive, so results can be
+# re-assembled in order while later tasks are still running.
+ParseTask = Tuple[str, str, Optional[int], Optional[int]]
+
+def _plan_tasks(folder: str, fns: List[str], pages_per_task: int) -> List[ParseTask]:
+    tasks: List[ParseTask] = []
+    for fn in fns:
+        path = os.path.join(folder, fn)
+        n_pages = 0
+        if fn.lower().endswith(".pdf"):
+            try:
+                n_pages = pdf_page_count(path)
+            except Exception:
+                n_pages = 0  # let the worker surface the error
+        if n_pages > pages_per_task:
+            for start in range(0, n_pages, pages_per_task):
+                tasks.append((fn, path, start, start + pages_per_task))
+        else:
+            tasks.append((fn, path, None, None))
+    return tasks
+
+def _run_task(task: ParseTask) -> List[Block]:
+    _, path, start, end = task
+    if start is not None:
+        return read_pdf_blocks(path, start, end)
+    return read_document_blocks(path) or []
+
+def iter_document_blocks(folder: str, fns: List[str], workers: int = INGEST_WORKERS,
+                         pages_per_task: int = PDF_PAGES_PER_TASK) -> Iterator[Tuple[str, Optional[List[Block]], Optional[Exception]]]:
+    """
+    Parse `fns` and yield (file name, blocks, error) in the order of `fns`.
+    With workers > 1, files and page ranges of large PDFs are spread over a
+    process pool; results are streamed back in order as soon as they are ready.
+    """
+    if workers > 1 and sum(os.path.getsize(os.path.join(folder, fn)) for fn in fns) < INGEST_PARALLEL_MIN_BYTES:
+        workers = 1
+    tasks = _plan_tasks(folder, fns, pages_per_task) if workers > 1 else [
+        (fn, os.path.join(folder, fn), None, None) for fn in fns]
+    workers = min(workers, len(tasks))
+
+    def assemble(results):
+        # results: iterator of (task, blocks, error) in task order
+        current, parts, error = None, [], None
+        for task, blocks, err in results:
+            if task[0] != current:
+                if current is not None:
+                    yield current, None if error else parts, error
+                current, parts, error = task[0], [], None
+            if err is not None:
+                error = error or err
+            elif blocks:
+                parts.extend(blocks)
+        if current is not None:
+            yield current, None if error else parts, error
+
+    if workers <= 1:
+        def serial():
+            for task in tasks:
+                try:
+                    yield task, _run_task(task), None
+                except Exception as e:
+                    yield task, None, e
+        yield from assemble(serial())
+        return
+
+    # spawn, not fork: the Streamlit server process is multi-threaded
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        def ordered():
+            # keep a bounded window of in-flight tasks so memory stays flat
+            pending = deque()
+            it = iter(tasks)
+            for task in it:
+                pending.append((task, pool.submit(_run_task, task)))
+                if len(pending) >= workers * 4:
+                    break
+            while pending:
+                task, fut = pending.popleft()
+                nxt = next(it, None)
+                if nxt is not None:
+                    pending.append((nxt, pool.submit(_run_task, nxt)))
+                try:
+                    yield task, fut.result(), None
+                except Exception as e:
+                    yield task, None, e
+        yield from assemble(ordered())
+
+def iter_document_chunks(folder: str, fns: List[str], workers: int = INGEST_WORKERS) -> Iterator[DocumentChunk]:
+    """Stream DocumentChunks for `fns` in a deterministic order (stable chunk IDs)."""
+    for fn, blocks, err in iter_document_blocks(folder, fns, workers):
+        if err is not None:
+            print(f"Error reading {os.path.join(folder, fn)}: {err}")
+            continue
+        if blocks:
+            yield from chunk_document(fn, blocks)
+
+def list_documents(folder: str) -> List[str]:
+    out = []
     for fn in sorted(os.listdir(folder)):
         path = os.path.join(folder, fn)
         if os.path.isdir(path):
             continue
-        ext = fn.lower().split(".")[-1]
-        try:
-            if ext == "pdf":
-                text = read_pdf(path)
-            elif ext in ("md", "markdown", "txt"):
-                text = read_md(path)
-            else:
-                # skip unknown file types
-                continue
-        except Exception as e:
-            print(f"Error reading {path}: {e}")
-            continue
-        text = text.strip()
-        if not text:
-            continue
-        for i, t in enumerate(chunk_text(text)):
-            idx += 1
-            chunks.append(DocumentChunk(id=f"{fn}__chunk_{i+1}", source=fn, text=t))
+        if fn.lower().split(".")[-1] in ("pdf", "md", "markdown", "txt"):
+            out.append(fn)
+    return out
+
+# ------------------------
+# Ingest function
+# ------------------------
+@traced("ingest_local_documents")
+def ingest_local_documents(folder: str = "docs/", workers: int = INGEST_WORKERS):
+    chunks = list(iter_document_chunks(folder, list_documents(folder), workers))
+    incr("rag_chunks_ingested_total", len(chunks))
     print(f"[ingest] produced {len(chunks)} chunks from {folder}")
     return chunks
 
+@traced("ingest_changed_documents")
+def ingest_changed_documents(folder: str, manifest: Dict, workers: int = INGEST_WORKERS) -> IngestDelta:
+    """
+    Parse and chunk only the files that are new or changed relative to `manifest`.
+    A file is unchanged if its mtime and size match; otherwise its content hash
+    decides, so a touched-but-identical file is not re-embedded. A change of
+    chunker configuration re-chunks every file; one that cannot be read then
+    keeps its old chunks and is marked "rechunk" until a later run succeeds.
+    """
+    old_files = manifest.get("files", {})
+    new_files: Dict[str, Dict] = {}
+    chunker = chunker_config()
+    rechunk = manifest.get("chunker", {"strategy": "words"}) != chunker
+    delta = IngestDelta(chunks=[], stale_sources=[],
+                        manifest={"version": MANIFEST_VERSION, "chunker": chunker, "files": new_files})
+
+    to_parse: Dict[str, Dict] = {}
+    for fn in list_documents(folder):
+        path = os.path.join(folder, fn)
+        st = os.stat(path)
+        prev = old_files.get(fn)
+        if prev and (rechunk or prev.get("rechunk")):
+            # same content, new chunking: the document keeps its ingest time
+            to_parse[fn] = {"mtime": st.st_mtime, "size": st.st_size, "sha256": file_sha256(path),
+                            "ingested": prev.get("ingested", int(prev["mtime"]))}
+            continue
+        if prev and prev["mtime"] == st.st_mtime and prev["size"] == st.st_size:
+            new_files[fn] = prev
+            delta.unchanged.append(fn)
+            continue
+        sha = file_sha256(path)
+        if prev and prev["sha256"] == sha:
+            new_files[fn] = dict(prev, mtime=st.st_mtime, size=st.st_size)
+            delta.unchanged.append(fn)
+            continue
+        to_parse[fn] = {"mtime": st.st_mtime, "size": st.st_size, "sha256": sha, "ingested": int(time.time())}
+
+    for fn, blocks, err in iter_document_blocks(folder, list(to_parse), workers):
+        prev = old_files.get(fn)
+        if err is not None:
+            print(f"Error reading {os.path.join(folder, fn)}: {err}")
+            # keep the previous vectors (if any) and retry on the next run; the
+            # manifest records the new chunker, so flag chunks made with the old one
+            if prev:
+                new_files[fn] = dict(prev, rechunk=True) if rechunk or prev.get("rechunk") else prev
+            continue
+        file_chunks = chunk_document(fn, blocks) if blocks else []
+        for c in file_chunks:
+            c.ingested = to_parse[fn]["ingested"]
+        delta.chunks.extend(file_chunks)
+        new_files[fn] = dict(to_parse[fn], chunk_ids=[c.id for c in file_chunks])
+        if prev:
+            delta.changed.append(fn)
+            delta.stale_sources.append(fn)
+        else:
+            delta.added.append(fn)
+
+    for fn in old_files:
+        if fn not in new_files:
+            delta.removed.append(fn)
+            delta.stale_sources.append(fn)
+
+    incr("rag_chunks_ingested_total", len(delta.chunks))
+    print(f"[ingest] {len(delta.added)} added, {len(delta.changed)} changed, "
+          f"{len(delta.removed)} removed, {len(delta.unchanged)} unchanged; "
+          f"produced {len(delta.chunks)} chunks from {folder}")
+    return delta
+
 # ------------------------
 # Debug run
 # ------------------------
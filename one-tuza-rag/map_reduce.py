@@ -0,0 +1,188 @@
+# map_reduce.py
+"""
+Map-reduce synthesis for wide questions.
+
+Map: every plan step (the question itself first, with the web hits) is
+summarized from its own retrieved chunks, concurrently, with async
+ChatCompletion calls. At most SYNTH_CONCURRENCY are in flight, a
+process-wide token bucket holds the request rate to LLM_RATE_PER_MIN, and
+rate-limit / server / connection errors are retried with jittered
+exponential backoff.
+Reduce: one more call merges the partial summaries into the report, keeping
+their [Local:...] / [Web:...] citations.
+
+OPENAI_API_BASE points the calls at any OpenAI-compatible endpoint, e.g. the
+local mock:
+    python mock_llm.py --port 8400
+    OPENAI_API_KEY=x OPENAI_API_BASE=http://localhost:8400/v1 SYNTH_MODE=map_reduce python batch.py q.jsonl
+"""
+import os
+import time
+import random
+import asyncio
+import threading
+from typing import Dict, List, Optional, Tuple
+import openai
+from telemetry import span, incr
+from context_packer import pack_sources, count_tokens
+import synthesizer
+from synthesizer import report_sources
+
+SYNTH_MODE = os.getenv("SYNTH_MODE", "single")                  # single | map_reduce
+SYNTH_MODES = ("single", "map_reduce")
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o-mini")
+SYNTH_CONCURRENCY = int(os.getenv("SYNTH_CONCURRENCY", "4"))     # map calls in flight per report
+SYNTH_MAX_RETRIES = int(os.getenv("SYNTH_MAX_RETRIES", "4"))
+SYNTH_BACKOFF_S = float(os.getenv("SYNTH_BACKOFF_S", "1.0"))     # first retry delay, doubled per attempt
+SYNTH_TIMEOUT_S = float(os.getenv("SYNTH_TIMEOUT_S", "60"))
+LLM_RATE_PER_MIN = float(os.getenv("LLM_RATE_PER_MIN", "300"))   # requests, shared by every report in the process
+LLM_RATE_BURST = int(os.getenv("LLM_RATE_BURST", "10"))
+MAP_TOKEN_BUDGET = int(os.getenv("MAP_TOKEN_BUDGET", "1500"))    # per map prompt
+
+RETRYABLE = (openai.error.RateLimitError, openai.error.APIError, openai.error.Timeout,
+             openai.error.APIConnectionError, openai.error.ServiceUnavailableError, openai.error.TryAgain)
+
+
+class TokenBucket:
+    """
+    Request-rate limiter usable from any thread or event loop: acquire()
+    reserves a token (possibly going into debt) and sleeps until it is due.
+    """
+
+    def __init__(self, rate_per_min: float = LLM_RATE_PER_MIN, burst: int = LLM_RATE_BURST):
+        self.rate = rate_per_min / 60.0
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self.rate)
+
+    async def acquire(self):
+        wait = self._reserve()
+        if wait > 0:
+            incr("rag_llm_rate_limited_total")
+            await asyncio.sleep(wait)
+
+
+RATE_LIMIT = TokenBucket()
+
+
+def llm_configured() -> bool:
+    return bool(synthesizer.OPENAI_KEY)
+
+
+# ------------------------
+# Prompts
+# ------------------------
+def _map_prompt(step: str, sources: List[Dict]) -> str:
+    prompt = (
+        "You are an expert research assistant. Summarize what the sources below say about:\n"
+        f"{step}\n\n"
+        "Write 3-6 short bullet points. End every bullet with the citation labels it is drawn from, "
+        "exactly as given, e.g. [Local:file.pdf p.3] or [Web:example.com]. "
+        "Skip sources that are not relevant; do not invent labels.\n\nSources:\n"
+    )
+    for i, s in enumerate(sources):
+        prompt += f"---\nSource {i+1} ({s.get('label', '')}):\n{s['text']}\n"
+    return prompt
+
+
+def _reduce_prompt(question: str, partials: List[Tuple[str, str]]) -> str:
+    prompt = (
+        "You are an expert research summarizer. Merge the partial summaries below into one "
+        f"structured report answering: {question}\n"
+        "Include:\n- A title\n- Key findings in bullet points\n- A short conclusion\n\n"
+        "Keep the inline citations like [Local:...] or [Web:...] exactly as they appear in the partial "
+        "summaries, attached to the claims they support; merge duplicate findings and combine their "
+        "citations. Keep report <= 600 words.\n\nPartial summaries:\n"
+    )
+    for step, text in partials:
+        prompt += f"---\nSub-question: {step}\n{text}\n"
+    return prompt
+
+
+# ------------------------
+# Calls
+# ------------------------
+async def _chat(prompt: str, sem: asyncio.Semaphore, name: str, max_tokens: int) -> Tuple[str, Dict]:
+    async with sem:
+        with span(name, model=LLM_MODEL) as s:
+            for attempt in range(SYNTH_MAX_RETRIES + 1):
+                await RATE_LIMIT.acquire()
+                try:
+                    resp = await openai.ChatCompletion.acreate(
+                        model=LLM_MODEL,
+                        messages=[{"role": "user", "content": prompt}],
+                        temperature=0.0,
+                        max_tokens=max_tokens,
+                        request_timeout=SYNTH_TIMEOUT_S
+                    )
+                    break
+                except RETRYABLE as e:
+                    if attempt == SYNTH_MAX_RETRIES:
+                        raise
+                    delay = SYNTH_BACKOFF_S * 2 ** attempt * (0.5 + random.random())
+                    print(f"[map_reduce] {name} attempt {attempt + 1} failed ({type(e).__name__}); retrying in {delay:.1f}s")
+                    incr("rag_llm_retries_total")
+                    await asyncio.sleep(delay)
+            usage = resp.get("usage") or {}
+            s.attributes.update(attempts=attempt + 1,
+                                prompt_tokens=usage.get("prompt_tokens", count_tokens(prompt)),
+                                completion_tokens=usage.get("completion_tokens", 0))
+        incr("rag_llm_prompt_tokens_total", s.attributes["prompt_tokens"])
+        incr("rag_llm_completion_tokens_total", s.attributes["completion_tokens"])
+        return resp["choices"][0]["message"]["content"].strip(), s.attributes
+
+
+async def amap_reduce_summarize(question: str, steps: List[str], step_hits: List[List[Dict]],
+                                web_hits: Optional[List[Dict]] = None,
+                                concurrency: int = SYNTH_CONCURRENCY) -> Tuple[str, Dict]:
+    """
+    `steps[i]` was answered by `step_hits[i]`; web hits join the first step.
+    Returns (markdown, context stats). Steps whose call fails after retries
+    are left out; raises when none succeed or the reduce call fails.
+    """
+    sem = asyncio.Semaphore(concurrency)
+    jobs, stats = [], {"mode": "map_reduce", "steps": 0, "steps_failed": 0, "prompt_tokens": 0,
+                       "baseline_tokens": 0, "tokens_saved": 0, "sources_in": 0, "sources_out": 0,
+                       "budget": MAP_TOKEN_BUDGET}
+    for i, (step, hits) in enumerate(zip(steps, step_hits)):
+        sources = report_sources(hits, (web_hits or []) if i == 0 else [])
+        if not sources:
+            continue
+        packed, ctx = pack_sources(sources, lambda xs, step=step: _map_prompt(step, xs), budget=MAP_TOKEN_BUDGET)
+        for k in ("prompt_tokens", "baseline_tokens", "tokens_saved", "sources_in", "sources_out"):
+            stats[k] += ctx[k]
+        jobs.append((step, _chat(_map_prompt(step, packed), sem, "synth.map", max_tokens=400)))
+    stats["steps"] = len(jobs)
+
+    with span("synth.map_reduce", steps=len(jobs)):
+        results = await asyncio.gather(*(job for _, job in jobs), return_exceptions=True)
+        partials = []
+        for (step, _), r in zip(jobs, results):
+            if isinstance(r, BaseException):
+                stats["steps_failed"] += 1
+                incr("rag_synth_map_failures_total")
+                print(f"[map_reduce] map for {step!r} failed: {r}")
+            else:
+                partials.append((step, r[0]))
+        if not partials:
+            raise RuntimeError(f"all {len(jobs)} map calls failed" if jobs else "no sources to summarize")
+        prompt = _reduce_prompt(question, partials)
+        stats["prompt_tokens"] += count_tokens(prompt)
+        summary, _ = await _chat(prompt, sem, "synth.reduce", max_tokens=900)
+    return summary, stats
+
+
+def map_reduce_summarize(question: str, steps: List[str], step_hits: List[List[Dict]],
+                         web_hits: Optional[List[Dict]] = None,
+                         concurrency: int = SYNTH_CONCURRENCY) -> Tuple[str, Dict]:
+    """Blocking wrapper for callers outside an event loop (pipeline and batch worker threads)."""
+    return asyncio.run(amap_reduce_summarize(question, steps, step_hits, web_hits, concurrency))
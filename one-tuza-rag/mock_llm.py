@@ -0,0 +1,88 @@
+# mock_llm.py
+"""
+Minimal OpenAI-compatible /v1/chat/completions endpoint for local runs and
+load tests without an API key.
+
+    python mock_llm.py --port 8400 --latency-ms 300 --fail-rate 0.2
+    OPENAI_API_KEY=x OPENAI_API_BASE=http://localhost:8400/v1 streamlit run app.py
+
+Answers echo one bullet per cited source (or per partial-summary line for
+reduce prompts), so citation handling can be checked end to end. With
+--fail-rate, that share of requests gets a 429 to exercise retries.
+"""
+import re
+import json
+import time
+import random
+import argparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+LABEL_RE = re.compile(r"^Source \d+ \((.*)\):$", re.M)
+CITED_RE = re.compile(r"^\s*[-*] .*\[(?:Local|Web):[^\]]*\]\s*$", re.M)
+
+
+def mock_answer(prompt: str) -> str:
+    cited = CITED_RE.findall(prompt)
+    if cited:
+        lines = list(dict.fromkeys(c.strip() for c in cited))
+        return "# Research Report\n\n## Key Findings\n" + "\n".join(lines) + "\n\n## Conclusion\nMerged by mock_llm."
+    labels = LABEL_RE.findall(prompt)
+    return "\n".join(f"- Finding {i + 1} [{label}]" for i, label in enumerate(labels)) or "- No sources."
+
+
+class Handler(BaseHTTPRequestHandler):
+    latency = 0.0
+    fail_rate = 0.0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        time.sleep(self.latency)
+        if random.random() < self.fail_rate:
+            self._json(429, {"error": {"message": "mock rate limit", "type": "rate_limit_error"}})
+            return
+        prompt = "\n".join(m.get("content", "") for m in body.get("messages", []))
+        answer = mock_answer(prompt)
+        usage = {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(answer) // 4}
+        if body.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            for word in re.findall(r"\S+\s*", answer):
+                chunk = {"object": "chat.completion.chunk", "model": body.get("model"),
+                         "choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}]}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.write(b"data: [DONE]\n\n")
+            return
+        self._json(200, {
+            "id": f"mock-{random.getrandbits(32):x}", "object": "chat.completion", "created": int(time.time()),
+            "model": body.get("model"), "usage": dict(usage, total_tokens=sum(usage.values())),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+        })
+
+    def _json(self, status: int, payload: dict):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="localhost")
+    ap.add_argument("--port", type=int, default=8400)
+    ap.add_argument("--latency-ms", type=float, default=0)
+    ap.add_argument("--fail-rate", type=float, default=0)
+    args = ap.parse_args()
+    Handler.latency = args.latency_ms / 1000.0
+    Handler.fail_rate = args.fail_rate
+    print(f"[mock_llm] serving on http://{args.host}:{args.port}/v1")
+    ThreadingHTTPServer((args.host, args.port), Handler).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
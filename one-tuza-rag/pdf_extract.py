@@ -0,0 +1,225 @@
+# pdf_extract.py
+"""
+PDF text extraction for ingest, one page at a time.
+
+Backends: PyMuPDF (native, several times faster than pypdf) when it is
+installed, pypdf otherwise; PDF_BACKEND=pymupdf|pypdf forces one. Backends
+may segment text differently, so chunk IDs can change when the backend does.
+
+iter_pdf_pages streams (page, text) pairs: a huge PDF is never held in
+memory, neither as text nor (with pypdf) as file bytes. Extracted pages are
+cached in SQLite under PDF_CACHE_DIR, keyed by (file SHA-256, backend, page),
+so a rebuild, a re-chunk or a renamed copy of a file skips extraction. The
+cache runs in WAL mode, so ingest worker processes read and write it
+concurrently. It is never pruned; delete PDF_CACHE_DIR to reclaim space.
+"""
+import os
+import hashlib
+import sqlite3
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+from pypdf import PdfReader
+from telemetry import incr
+
+try:
+    import fitz  # PyMuPDF
+except ImportError:
+    fitz = None
+
+PDF_BACKEND = os.getenv("PDF_BACKEND", "auto")              # auto | pymupdf | pypdf
+PDF_CACHE_DIR = os.getenv("PDF_CACHE_DIR", ".pdf_cache")     # "" disables the page cache
+PDF_CACHE_WRITE_BATCH = 16                                   # pages per cache transaction
+
+
+def backend_name(backend: str = PDF_BACKEND) -> str:
+    """Resolve "auto" to the fastest installed backend."""
+    if backend == "auto":
+        return "pymupdf" if fitz is not None else "pypdf"
+    if backend not in ("pymupdf", "pypdf"):
+        raise ValueError(f"unknown PDF backend {backend!r}")
+    if backend == "pymupdf" and fitz is None:
+        raise ImportError("PDF_BACKEND=pymupdf needs PyMuPDF (pip install pymupdf)")
+    return backend
+
+
+def file_sha256(path: str, block_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+# (path, mtime_ns, size) -> sha256; page-range tasks of one file share a hash per process
+_hashes: Dict[Tuple[str, int, int], str] = {}
+
+
+def _cached_sha256(path: str) -> str:
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+    if key not in _hashes:
+        if len(_hashes) > 1024:
+            _hashes.clear()
+        _hashes[key] = file_sha256(path)
+    return _hashes[key]
+
+
+# ------------------------
+# Backends
+# ------------------------
+class _PyMuPDFDocument:
+    def __init__(self, path: str):
+        self._doc = fitz.open(path)
+
+    def __len__(self) -> int:
+        return self._doc.page_count
+
+    def page_text(self, i: int) -> str:
+        return self._doc.load_page(i).get_text("text")
+
+    def close(self):
+        self._doc.close()
+
+
+class _PypdfDocument:
+    def __init__(self, path: str):
+        # a file object, not a path: pypdf reads a path fully into memory
+        self._f = open(path, "rb")
+        self._reader = PdfReader(self._f)
+
+    def __len__(self) -> int:
+        return len(self._reader.pages)
+
+    def page_text(self, i: int) -> str:
+        return self._reader.pages[i].extract_text() or ""
+
+    def close(self):
+        self._f.close()
+
+
+def open_pdf(path: str, backend: str = PDF_BACKEND):
+    return _PyMuPDFDocument(path) if backend_name(backend) == "pymupdf" else _PypdfDocument(path)
+
+
+# ------------------------
+# Page cache
+# ------------------------
+class PageCache:
+    """Extracted text per (file sha256, backend, page), plus page counts per file."""
+
+    def __init__(self, cache_dir: str = PDF_CACHE_DIR):
+        self.path = os.path.join(cache_dir, "pages.sqlite")
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _db(self) -> sqlite3.Connection:
+        # one connection per process; connections must not cross a fork
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS pages (sha256 TEXT, backend TEXT, page INTEGER, text TEXT, "
+                         "PRIMARY KEY (sha256, backend, page)) WITHOUT ROWID")
+            conn.execute("CREATE TABLE IF NOT EXISTS docs (sha256 TEXT, backend TEXT, pages INTEGER, "
+                         "PRIMARY KEY (sha256, backend)) WITHOUT ROWID")
+            conn.commit()
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def page_count(self, sha: str, backend: str) -> Optional[int]:
+        with self._lock:
+            row = self._db().execute("SELECT pages FROM docs WHERE sha256=? AND backend=?", (sha, backend)).fetchone()
+        return row[0] if row else None
+
+    def cached_pages(self, sha: str, backend: str, start: int, end: int) -> set:
+        """Page numbers of [start, end) present in the cache (numbers only, not texts)."""
+        with self._lock:
+            rows = self._db().execute("SELECT page FROM pages WHERE sha256=? AND backend=? AND page>=? AND page<?",
+                                      (sha, backend, start, end)).fetchall()
+        return {r[0] for r in rows}
+
+    def get(self, sha: str, backend: str, page: int) -> Optional[str]:
+        with self._lock:
+            row = self._db().execute("SELECT text FROM pages WHERE sha256=? AND backend=? AND page=?",
+                                     (sha, backend, page)).fetchone()
+        return row[0] if row else None
+
+    def put_many(self, sha: str, backend: str, pages: List[Tuple[int, str]], n_pages: Optional[int] = None):
+        with self._lock:
+            db = self._db()
+            with db:
+                db.executemany("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?)",
+                               [(sha, backend, p, t) for p, t in pages])
+                if n_pages is not None:
+                    db.execute("INSERT OR REPLACE INTO docs VALUES (?, ?, ?)", (sha, backend, n_pages))
+
+
+PAGE_CACHE = PageCache() if PDF_CACHE_DIR else None
+
+
+# ------------------------
+# Page iterator
+# ------------------------
+def pdf_page_count(path: str, backend: str = PDF_BACKEND, cache: Optional[PageCache] = PAGE_CACHE) -> int:
+    """Page count from the cache when the file was seen before; the PDF is only opened on a miss."""
+    backend = backend_name(backend)
+    sha = _cached_sha256(path) if cache is not None else None
+    n_pages = cache.page_count(sha, backend) if cache is not None else None
+    if n_pages is not None:
+        return n_pages
+    doc = open_pdf(path, backend)
+    try:
+        n_pages = len(doc)
+    finally:
+        doc.close()
+    if cache is not None:
+        cache.put_many(sha, backend, [], n_pages)
+    return n_pages
+
+
+def iter_pdf_pages(path: str, start: int = 0, end: Optional[int] = None, backend: str = PDF_BACKEND,
+                   cache: Optional[PageCache] = PAGE_CACHE) -> Iterator[Tuple[int, str]]:
+    """
+    Yield (0-based page, raw text) for pages [start, end) of a PDF, in order.
+    The PDF is only opened when some page is not cached. A page whose
+    extraction fails yields "" (and is not cached, so it is retried).
+    """
+    backend = backend_name(backend)
+    sha = _cached_sha256(path) if cache is not None else None
+    n_pages = cache.page_count(sha, backend) if cache is not None else None
+    doc = None
+    if n_pages is None:
+        doc = open_pdf(path, backend)
+        n_pages = len(doc)
+    end = n_pages if end is None else min(end, n_pages)
+    cached = cache.cached_pages(sha, backend, start, end) if cache is not None else set()
+    pending: List[Tuple[int, str]] = []
+    try:
+        for p in range(start, end):
+            text = cache.get(sha, backend, p) if p in cached else None
+            if text is not None:
+                incr("rag_pdf_pages_cached_total")
+                yield p, text
+                continue
+            if doc is None:
+                doc = open_pdf(path, backend)
+            try:
+                text = doc.page_text(p)
+            except Exception:
+                yield p, ""
+                continue
+            incr("rag_pdf_pages_extracted_total", backend=backend)
+            if cache is not None:
+                pending.append((p, text))
+                if len(pending) >= PDF_CACHE_WRITE_BATCH:
+                    cache.put_many(sha, backend, pending, n_pages)
+                    pending = []
+            yield p, text
+    finally:
+        # also runs when the consumer stops early: pages extracted so far are kept
+        if cache is not None and pending:
+            cache.put_many(sha, backend, pending, n_pages)
+        if doc is not None:
+            doc.close()
@@ -0,0 +1,156 @@
+# pipeline.py
+import time
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import numpy as np
+from planner import simple_plan
+from vectorstore import fuse_hits, RETRIEVAL_MODE
+from filters import SearchFilter
+from web_search import web_retrieve
+from synthesizer import build_report, report_sources, pack_prompt_sources, stream_summarize_texts
+from reranker import RERANKER, RERANK, RERANK_CANDIDATES
+from map_reduce import map_reduce_summarize, llm_configured, SYNTH_MODE
+from telemetry import span, trace_run, in_context
+import query_cache
+
+
+@dataclass
+class StageEvent:
+    stage: str       # "plan" | "local" | "web" | "token" | "report" | "error"
+    data: Any
+    elapsed: float   # seconds since the run started
+
+
+def retrieve_local_batch(vs, questions: List[str], plans: List[List[str]], top_k: int = 5,
+                         mode: str = RETRIEVAL_MODE, rerank: bool = False,
+                         filters: Optional[SearchFilter] = None,
+                         question_embs: Optional[np.ndarray] = None) -> List[Tuple[List[Dict], List[List[Dict]]]]:
+    """
+    One search over every question and plan step (a single encode + index
+    search for the whole batch). Per question, returns the hits fused by
+    rank and each query's own top `top_k` (for map-reduce synthesis). With
+    `rerank`, RERANK_CANDIDATES are fused and the cross-encoder keeps the
+    best `top_k` for the question. `filters` restricts every search to
+    matching chunks. `question_embs` (one row per question, e.g. from the
+    query cache lookup) are reused instead of encoding the questions again.
+    """
+    n = max(top_k, RERANK_CANDIDATES) if rerank else top_k
+    # questions first, so their vectors are the leading rows of the batch
+    queries, spans = list(questions), []
+    for plan in plans:
+        spans.append((len(queries), len(queries) + len(plan)))
+        queries.extend(plan)
+    hit_lists = vs.retrieve(queries, top_k=n, mode=mode, filters=filters, emb_q=question_embs)
+    out = []
+    for qi, (question, (a, b)) in enumerate(zip(questions, spans)):
+        own = [hit_lists[qi]] + hit_lists[a:b]
+        fused = fuse_hits(own, top_k=n)
+        if rerank:
+            fused = RERANKER.rerank(question, fused, top_k)
+        out.append((fused, [hits[:top_k] for hits in own]))
+    return out
+
+
+def retrieve_local_steps(vs, question: str, plan: List[str], top_k: int = 5, mode: str = RETRIEVAL_MODE,
+                         rerank: bool = False, filters: Optional[SearchFilter] = None,
+                         emb_q: Optional[np.ndarray] = None) -> Tuple[List[Dict], List[List[Dict]]]:
+    """retrieve_local_batch for one question: (fused hits, per-query hits)."""
+    question_embs = None if emb_q is None else emb_q[None]
+    return retrieve_local_batch(vs, [question], [plan], top_k, mode, rerank, filters, question_embs)[0]
+
+
+def retrieve_local(vs, question: str, plan: List[str], top_k: int = 5, mode: str = RETRIEVAL_MODE,
+                   rerank: bool = False, filters: Optional[SearchFilter] = None) -> List[Dict]:
+    """One batched search for the question and every plan step, fused by rank."""
+    return retrieve_local_steps(vs, question, plan, top_k, mode, rerank, filters)[0]
+
+
+def run_research(question: str, vs, top_k_local: int = 5, top_k_web: int = 3,
+                 mode: str = RETRIEVAL_MODE, use_cache: bool = True,
+                 rerank: bool = RERANK, synth_mode: str = SYNTH_MODE,
+                 filters: Optional[SearchFilter] = None) -> Iterator[StageEvent]:
+    """
+    Planner -> retriever -> synthesizer, yielding each stage's result as soon
+    as it is ready. Local and web retrieval run concurrently; the summary is
+    streamed token by token when an LLM is configured. With synth_mode
+    "map_reduce" the summary is produced by map_reduce.py and arrives in one
+    piece. `filters` applies to local retrieval only. With `use_cache`, a cached report for the same (or a
+    near-identical) question is replayed through the same events instead.
+    """
+    t0 = time.perf_counter()
+
+    def event(stage: str, data: Any) -> StageEvent:
+        return StageEvent(stage, data, time.perf_counter() - t0)
+
+    def finish(report: Dict) -> StageEvent:
+        report["trace"] = {"trace_id": trace.trace_id, "total_ms": round((time.perf_counter() - t0) * 1000, 2),
+                           "spans": trace.breakdown(), "counters": dict(trace.counters)}
+        return event("report", report)
+
+    params = (top_k_local, top_k_web, mode, rerank, synth_mode, filters)
+    with trace_run("research") as trace:
+        emb_q, cached = None, None
+        if use_cache:
+            with span("query_cache.lookup"):
+                # lexical mode never loads the embedding model, so it only gets the exact tier
+                if mode != "lexical" and query_cache.QUERY_CACHE_THRESHOLD < 1:
+                    emb_q = vs.encode([question])[0]
+                cached = query_cache.CACHE.get(question, params, vs.revision, emb_q)
+        if cached is not None:
+            yield event("plan", cached["plan"])
+            yield event("local", cached["local_hits"])
+            yield event("web", cached["web_hits"])
+            yield event("token", cached["summary_markdown"])
+            yield finish(cached)
+            return
+
+        with span("plan"):
+            plan = simple_plan(question)
+        yield event("plan", plan)
+
+        results: Dict[str, List[Dict]] = {"local": [], "web": []}
+        step_hits: List[List[Dict]] = []
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix="research") as pool:
+            # in_context: spans recorded in the workers belong to this run's trace
+            futures = {
+                # emb_q from the cache lookup: the question is not encoded twice
+                pool.submit(in_context(retrieve_local_steps), vs, question, plan, top_k_local, mode, rerank,
+                            filters, emb_q): "local",
+                pool.submit(in_context(web_retrieve), question, top_k_web): "web",
+            }
+            failed = False
+            for fut in as_completed(futures):
+                stage = futures[fut]
+                try:
+                    if stage == "local":
+                        results["local"], step_hits = fut.result()
+                    else:
+                        results[stage] = fut.result()
+                except Exception as e:
+                    failed = True
+                    print(f"[pipeline] {stage} retrieval failed: {e}")
+                    yield event("error", f"{stage} retrieval failed: {e}")
+                yield event(stage, results[stage])
+
+        parts, context = [], None
+        if synth_mode == "map_reduce" and llm_configured() and step_hits:
+            try:
+                summary, context = map_reduce_summarize(question, [question] + plan, step_hits, results["web"])
+                parts.append(summary)
+                yield event("token", summary)
+            except Exception as e:
+                print(f"[pipeline] map-reduce synthesis failed, using a single prompt: {e}")
+        if not parts:
+            sources = report_sources(results["local"], results["web"])
+            packed, context = pack_prompt_sources(sources)
+            for token in stream_summarize_texts(packed, fallback_texts=sources):
+                parts.append(token)
+                yield event("token", token)
+
+        report = build_report(question, plan, results["local"], results["web"], summary_markdown="".join(parts),
+                              context=context)
+        if use_cache and not failed:
+            # partial results (a failed retriever) are not worth replaying
+            query_cache.CACHE.put(question, params, dict(report), vs.revision, emb_q)
+        yield finish(report)
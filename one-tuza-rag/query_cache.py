@@ -0,0 +1,138 @@
+# query_cache.py
+"""
+Two-tier cache of finished research reports.
+
+- exact tier: LRU keyed on the normalized question and retrieval parameters.
+- semantic tier: reuses a report whose question embedding is within
+  QUERY_CACHE_THRESHOLD cosine similarity of the new one (same parameters).
+
+Entries expire after QUERY_CACHE_TTL seconds and are bound to the index
+revision they were produced from, so rebuilding or updating the index makes
+them stale.
+"""
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+import numpy as np
+from telemetry import incr
+
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "512"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "3600"))
+# cosine similarity above which two questions share a report; >= 1 disables the semantic tier
+QUERY_CACHE_THRESHOLD = float(os.getenv("QUERY_CACHE_THRESHOLD", "0.95"))
+
+
+def normalize_question(question: str) -> str:
+    """Case, whitespace and trailing punctuation do not change the answer."""
+    return re.sub(r"\s+", " ", question.lower()).strip().rstrip("?!. ")
+
+
+@dataclass
+class _Entry:
+    report: Dict
+    params: Tuple
+    revision: Optional[str]
+    created: float
+    slot: int
+
+
+class QueryCache:
+    def __init__(self, max_entries: int = QUERY_CACHE_SIZE, ttl: float = QUERY_CACHE_TTL,
+                 threshold: float = QUERY_CACHE_THRESHOLD):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self._entries: "OrderedDict[Tuple, _Entry]" = OrderedDict()
+        # one row per slot; _slot_keys[i] is None for a free slot
+        self._emb: Optional[np.ndarray] = None
+        self._slot_keys = [None] * max_entries
+        self._free = list(range(max_entries - 1, -1, -1))
+        self._lock = threading.Lock()
+        self.hits = {"exact": 0, "semantic": 0}
+        self.misses = 0
+
+    def _drop(self, key: Tuple):
+        entry = self._entries.pop(key)
+        self._slot_keys[entry.slot] = None
+        self._free.append(entry.slot)
+
+    def _fresh(self, entry: _Entry, revision: Optional[str], now: float) -> bool:
+        return entry.revision == revision and now - entry.created <= self.ttl
+
+    def get(self, question: str, params: Tuple, revision: Optional[str] = None,
+            embedding: Optional[np.ndarray] = None) -> Optional[Dict]:
+        """
+        Cached report for `question`, or None. `embedding` (L2-normalized)
+        enables the semantic tier. Semantic hits carry report["cache"] with
+        the matched question and its similarity.
+        """
+        key = (normalize_question(question), params)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if self._fresh(entry, revision, now):
+                    self._entries.move_to_end(key)
+                    return self._hit("exact", entry.report, {"tier": "exact"})
+                self._drop(key)
+
+            if embedding is not None and self._emb is not None and self._entries and self.threshold < 1:
+                sims = self._emb @ embedding
+                for slot in np.argsort(-sims):
+                    if sims[slot] < self.threshold:
+                        break
+                    skey = self._slot_keys[slot]
+                    if skey is None or skey[1] != params:
+                        continue
+                    entry = self._entries[skey]
+                    if not self._fresh(entry, revision, now):
+                        self._drop(skey)
+                        continue
+                    self._entries.move_to_end(skey)
+                    return self._hit("semantic", entry.report,
+                                     {"tier": "semantic", "matched_question": entry.report.get("question"),
+                                      "similarity": round(float(sims[slot]), 4)})
+            self.misses += 1
+        incr("rag_query_cache_misses_total")
+        return None
+
+    def _hit(self, tier: str, report: Dict, info: Dict) -> Dict:
+        self.hits[tier] += 1
+        incr("rag_query_cache_hits_total", tier=tier)
+        return dict(report, cache=info)
+
+    def put(self, question: str, params: Tuple, report: Dict, revision: Optional[str] = None,
+            embedding: Optional[np.ndarray] = None):
+        key = (normalize_question(question), params)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            while not self._free:
+                self._drop(next(iter(self._entries)))  # least recently used
+            slot = self._free.pop()
+            if embedding is not None:
+                if self._emb is None:
+                    self._emb = np.zeros((self.max_entries, len(embedding)), dtype=np.float32)
+                self._emb[slot] = embedding
+            elif self._emb is not None:
+                self._emb[slot] = 0.0  # no embedding: exact tier only
+            self._slot_keys[slot] = key
+            self._entries[key] = _Entry(report, params, revision, time.time(), slot)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._drop(key)
+
+    def stats(self) -> Dict:
+        hits = sum(self.hits.values())
+        total = hits + self.misses
+        return {"entries": len(self._entries), "hits": dict(self.hits), "misses": self.misses,
+                "hit_rate": hits / total if total else 0.0}
+
+
+CACHE = QueryCache()
@@ -0,0 +1,95 @@
+# reranker.py
+"""
+Optional cross-encoder re-ranking of local hits.
+
+Retrieval over-fetches RERANK_CANDIDATES chunks; a local cross-encoder scores
+(question, chunk) pairs in batches, best dense candidates first, and stops
+before a batch would overrun RERANK_BUDGET_MS. Candidates it did not get to
+keep their dense order behind the re-scored ones, so a timeout degrades to
+plain dense ranking rather than failing.
+"""
+import os
+import time
+import threading
+from typing import Dict, List
+from telemetry import span, incr
+
+RERANK = os.getenv("RERANK", "0") == "1"
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "50"))
+RERANK_BATCH = int(os.getenv("RERANK_BATCH", "16"))
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "300"))   # per query, excluding the one-off model load
+RERANK_MAX_LENGTH = int(os.getenv("RERANK_MAX_LENGTH", "256"))
+RERANK_RETRY_S = float(os.getenv("RERANK_RETRY_S", "300"))        # wait after a failed model load before trying again
+
+
+class CrossEncoderReranker:
+    def __init__(self, model_name: str = RERANK_MODEL, batch_size: int = RERANK_BATCH,
+                 budget_ms: float = RERANK_BUDGET_MS, model=None, retry_s: float = RERANK_RETRY_S):
+        """`model` overrides the CrossEncoder (any object with predict(pairs))."""
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.budget_ms = budget_ms
+        self.retry_s = retry_s
+        self._model = model
+        self._lock = threading.Lock()
+        self._error = None       # last load failure, re-raised until _retry_at
+        self._retry_at = 0.0
+
+    @property
+    def model(self):
+        with self._lock:
+            if self._model is None:
+                # a failed load (e.g. a Hub timeout) is not retried for retry_s,
+                # so queries meanwhile fall back to dense order immediately
+                if self._error is not None and time.monotonic() < self._retry_at:
+                    raise self._error
+                try:
+                    from sentence_transformers import CrossEncoder
+                    self._model = CrossEncoder(self.model_name, max_length=RERANK_MAX_LENGTH)
+                except Exception as e:
+                    self._error, self._retry_at = e, time.monotonic() + self.retry_s
+                    print(f"[reranker] {self.model_name} unavailable ({type(e).__name__}: {e}); "
+                          f"keeping dense order for {self.retry_s:g}s")
+                    raise
+                self._error = None
+        return self._model
+
+    def rerank(self, query: str, hits: List[Dict], top_k: int = 5, budget_ms: float = None) -> List[Dict]:
+        """
+        Return the best `top_k` of `hits` (in dense order on input) by
+        cross-encoder score. Each scored hit gets "rerank_score".
+        """
+        if not hits:
+            return []
+        budget = (self.budget_ms if budget_ms is None else budget_ms) / 1000.0
+        try:
+            model = self.model
+        except Exception:
+            incr("rag_rerank_fallbacks_total")
+            return hits[:top_k]
+        scored: List[Dict] = []
+        with span("rerank", candidates=len(hits)) as s:
+            t0 = time.perf_counter()
+            batch_s = 0.0
+            for i in range(0, len(hits), self.batch_size):
+                elapsed = time.perf_counter() - t0
+                # stop before a batch that would likely overrun the budget
+                if i and elapsed + batch_s > budget:
+                    break
+                tb = time.perf_counter()
+                batch = hits[i:i + self.batch_size]
+                scores = model.predict([(query, h["text"]) for h in batch], batch_size=len(batch),
+                                       show_progress_bar=False)
+                batch_s = time.perf_counter() - tb
+                scored.extend(dict(h, rerank_score=float(sc)) for h, sc in zip(batch, scores))
+            timed_out = len(scored) < len(hits)
+            s.attributes.update(scored=len(scored), timed_out=timed_out)
+        incr("rag_rerank_pairs_scored_total", len(scored))
+        if timed_out:
+            incr("rag_rerank_timeouts_total")
+        scored.sort(key=lambda h: h["rerank_score"], reverse=True)
+        return (scored + hits[len(scored):])[:top_k]
+
+
+RERANKER = CrossEncoderReranker()
@@ -0,0 +1,291 @@
+# retrieval_server.py
+"""
+Long-lived retrieval service: loads the SentenceTransformer and the FAISS /
+BM25 index once and serves encode and search requests from any number of UI
+sessions and batch jobs over a local socket.
+
+    python retrieval_server.py --index faiss.index --port 7200
+    RETRIEVAL_SERVER=localhost:7200 streamlit run app.py
+
+The socket unpickles requests, so the authkey is the trust boundary (see
+rpc.py): it comes from RETRIEVAL_AUTHKEY or from the random key file
+RETRIEVAL_AUTHKEY_FILE that the server writes on first start; there is no
+built-in default.
+
+Concurrent requests are coalesced: the first request waits up to
+RETRIEVAL_MAX_WAIT_MS for others, and requests with the same parameters are
+answered by one encode + one search over up to RETRIEVAL_MAX_BATCH queries.
+Syncs and reloads build the new store on the requesting connection's thread
+and only the swap runs on the batcher, so they never stall searches.
+"""
+import os
+import time
+import queue
+import argparse
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from multiprocessing.connection import Listener, Client
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from vectorstore import VectorStore, sync_index, sync_index_aside, RETRIEVAL_MODE
+from filters import SearchFilter
+from telemetry import span, incr, serve_metrics
+from rpc import parse_address, load_authkey
+
+# host:port of a running server; unset means each process holds its own VectorStore
+RETRIEVAL_SERVER = os.getenv("RETRIEVAL_SERVER", "")
+RETRIEVAL_AUTHKEY_FILE = os.getenv("RETRIEVAL_AUTHKEY_FILE", ".retrieval_authkey")
+RETRIEVAL_MAX_BATCH = int(os.getenv("RETRIEVAL_MAX_BATCH", "64"))         # queries per coalesced call
+RETRIEVAL_MAX_WAIT_MS = float(os.getenv("RETRIEVAL_MAX_WAIT_MS", "2"))    # extra latency spent waiting for a batch
+
+# ops answered by one call over the concatenated texts of all requests with the same key
+COALESCED_OPS = ("encode", "retrieve")
+
+
+def retrieval_authkey(create: bool = False) -> bytes:
+    """$RETRIEVAL_AUTHKEY, else RETRIEVAL_AUTHKEY_FILE (created by the server)."""
+    return load_authkey("RETRIEVAL_AUTHKEY", RETRIEVAL_AUTHKEY_FILE, create)
+
+
+@dataclass
+class _Request:
+    op: str
+    args: Tuple
+    done: threading.Event
+    result: Any = None
+    error: Optional[str] = None
+
+    @property
+    def key(self) -> Tuple:
+        # retrieve requests coalesce only with the same (top_k, mode, filters)
+        return (self.op,) + tuple(self.args[1:]) if self.op in COALESCED_OPS else (self.op, id(self))
+
+    @property
+    def size(self) -> int:
+        return len(self.args[0]) if self.op in COALESCED_OPS else 1
+
+
+# ------------------------
+# Server
+# ------------------------
+class RetrievalServer:
+    def __init__(self, vs: VectorStore, index_path: str, max_batch: int = RETRIEVAL_MAX_BATCH,
+                 max_wait_ms: float = RETRIEVAL_MAX_WAIT_MS):
+        self.vs = vs
+        self.index_path = index_path
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: "queue.Queue[_Request]" = queue.Queue()
+        self._sync_lock = threading.Lock()  # one sync / reload at a time
+        # one worker runs every op, so swapping in a synced store never races with searches
+        self._worker = threading.Thread(target=self._batch_loop, daemon=True, name="retrieval-batcher")
+        self._worker.start()
+
+    def submit(self, op: str, *args) -> Any:
+        if op in ("sync", "reload"):
+            return self._rebuild(op, *args)
+        req = _Request(op, args, threading.Event())
+        self._queue.put(req)
+        req.done.wait()
+        if req.error is not None:
+            raise RuntimeError(req.error)
+        return req.result
+
+    def _batch_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            n = batch[0].size
+            deadline = time.perf_counter() + self.max_wait
+            while n < self.max_batch:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    req = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                batch.append(req)
+                n += req.size
+            self._run(batch)
+
+    def _run(self, batch: List[_Request]):
+        groups: "OrderedDict[Tuple, List[_Request]]" = OrderedDict()
+        for req in batch:
+            groups.setdefault(req.key, []).append(req)
+        for key, reqs in groups.items():
+            try:
+                if key[0] in COALESCED_OPS:
+                    texts = [t for r in reqs for t in r.args[0]]
+                    incr("rag_retrieval_requests_total", len(reqs), op=key[0])
+                    incr("rag_retrieval_batches_total", op=key[0])
+                    with span("retrieval_server." + key[0], requests=len(reqs), queries=len(texts)):
+                        if key[0] == "encode":
+                            out = self.vs.encode(texts)
+                        else:
+                            out = self.vs.retrieve(texts, *key[1:])
+                    pos = 0
+                    for r in reqs:
+                        r.result = out[pos:pos + len(r.args[0])]
+                        pos += len(r.args[0])
+                else:
+                    reqs[0].result = self._control(reqs[0])
+            except Exception as e:
+                for r in reqs:
+                    r.error = f"{type(e).__name__}: {e}"
+            for r in reqs:
+                r.done.set()
+
+    def _rebuild(self, op: str, *args) -> Any:
+        """
+        Build the synced / reloaded store aside on the calling thread (the
+        batcher keeps answering searches from the current one meanwhile) and
+        swap it in on the batcher thread.
+        """
+        with self._sync_lock:
+            path = args[-1] or self.index_path
+            if op == "sync":
+                new, out = sync_index_aside(self.vs, args[0], path)
+            else:
+                new = self.vs.fresh()
+                new.load(path)
+                out = new.ntotal
+            self.submit("_swap", new, path)
+            return out
+
+    def _control(self, req: _Request) -> Any:
+        if req.op == "info":
+            return {"revision": self.vs.revision, "ntotal": self.vs.ntotal, "index_path": self.index_path,
+                    "has_bm25": self.vs.bm25 is not None}
+        if req.op == "filter_options":
+            return self.vs.filter_options()
+        if req.op == "_swap":
+            self.vs, self.index_path = req.args
+            return None
+        raise ValueError(f"unknown op {req.op!r}")
+
+    def serve(self, address: Tuple[str, int], authkey: Optional[bytes] = None):
+        authkey = authkey or retrieval_authkey(create=True)
+        with Listener(address, backlog=64, authkey=authkey) as listener:
+            print(f"[retrieval_server] listening on {address[0]}:{address[1]}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except OSError:
+                    continue  # failed handshake
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        with conn:
+            while True:
+                try:
+                    op, *args = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    if op.startswith("_"):
+                        raise ValueError(f"unknown op {op!r}")
+                    conn.send(("ok", self.submit(op, *args)))
+                except Exception as e:
+                    conn.send(("error", str(e)))
+
+
+# ------------------------
+# Client
+# ------------------------
+class RetrievalClient:
+    """
+    Drop-in for the VectorStore query API (encode, query, query_batch,
+    retrieve, filter_options, revision) backed by a RetrievalServer. Each thread gets its own
+    connection, so concurrent sessions are coalesced server-side.
+    """
+
+    def __init__(self, address: str = RETRIEVAL_SERVER, authkey: Optional[bytes] = None):
+        self.address = address
+        self._authkey = authkey
+        self._local = threading.local()
+
+    def _call(self, op: str, *args) -> Any:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if self._authkey is None:
+                self._authkey = retrieval_authkey()
+            conn = self._local.conn = Client(parse_address(self.address), authkey=self._authkey)
+        try:
+            conn.send((op,) + args)
+            status, result = conn.recv()
+        except (EOFError, OSError):
+            self._local.conn = None  # server restarted; reconnect on the next call
+            raise
+        if status != "ok":
+            raise RuntimeError(f"retrieval server: {result}")
+        return result
+
+    def encode(self, texts: List[str], show_progress_bar: bool = False) -> np.ndarray:
+        return self._call("encode", list(texts))
+
+    def retrieve(self, queries: List[str], top_k: int = 5, mode: str = RETRIEVAL_MODE,
+                 filters: Optional[SearchFilter] = None, emb_q: Optional[np.ndarray] = None) -> List[List[Dict]]:
+        # emb_q is not sent: the server re-encodes inside a coalesced batch, which
+        # costs less than shipping vectors and splitting the batch by them
+        if not queries:
+            return []
+        return self._call("retrieve", list(queries), top_k, mode, filters)
+
+    def query_batch(self, queries: List[str], top_k: int = 5,
+                    filters: Optional[SearchFilter] = None) -> List[List[Dict]]:
+        return self.retrieve(queries, top_k, "dense", filters)
+
+    def query(self, q: str, top_k: int = 5, filters: Optional[SearchFilter] = None) -> List[Dict]:
+        return self.query_batch([q], top_k, filters)[0]
+
+    def filter_options(self) -> Dict[str, List[str]]:
+        return self._call("filter_options")
+
+    def info(self) -> Dict:
+        return self._call("info")
+
+    @property
+    def revision(self) -> Optional[str]:
+        return self.info()["revision"]
+
+    @property
+    def ntotal(self) -> int:
+        return self.info()["ntotal"]
+
+    def load(self, path: str = ""):
+        """Make the server re-read its index (e.g. after an offline rebuild)."""
+        return self._call("reload", path)
+
+    def sync(self, folder: str = "docs/", path: str = "") -> Dict:
+        """
+        Run sync_index on the server; returns its stats. The server syncs into
+        a copy of its store and swaps it in once done, so searches from other
+        clients keep being answered (from the old index) during the sync.
+        """
+        return self._call("sync", folder, path)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--index", default="faiss.index")
+    ap.add_argument("--docs", default="", help="sync the index with this folder before serving")
+    ap.add_argument("--host", default="localhost")
+    ap.add_argument("--port", type=int, default=7200)
+    ap.add_argument("--max-batch", type=int, default=RETRIEVAL_MAX_BATCH)
+    ap.add_argument("--max-wait-ms", type=float, default=RETRIEVAL_MAX_WAIT_MS)
+    args = ap.parse_args()
+
+    vs = VectorStore()
+    if args.docs:
+        print(f"[retrieval_server] {sync_index(vs, args.docs, args.index)}")
+    elif os.path.exists(args.index):
+        vs.load(args.index)
+    vs.encode(["warm up"])  # load the model before the first request
+    if os.getenv("METRICS_PORT"):
+        serve_metrics(int(os.getenv("METRICS_PORT")))
+    RetrievalServer(vs, args.index, args.max_batch, args.max_wait_ms).serve((args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
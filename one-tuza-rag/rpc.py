@@ -0,0 +1,50 @@
+# rpc.py
+"""
+Helpers shared by the socket services: the shard servers (sharded.py) and
+the retrieval server (retrieval_server.py).
+
+Trust boundary: both speak multiprocessing.connection, which unpickles every
+message it receives, so the authkey handshake is the only gate and any peer
+holding the key can run arbitrary code as the server's user. Keys are never
+built in: they come from an environment variable or from a random secret
+file (mode 0600) that the server writes on first start and local clients
+read. Keep the key private, and keep the default localhost binding unless
+every host that can reach the port is trusted.
+"""
+import os
+import secrets
+from typing import Tuple
+
+
+def parse_address(addr: str) -> Tuple[str, int]:
+    host, _, port = addr.rpartition(":")
+    return host or "localhost", int(port)
+
+
+def load_authkey(env_var: str, path: str, create: bool = False) -> bytes:
+    """
+    The shared secret from $env_var, else from the file at `path`. With
+    `create` (servers only), a missing file is written with a fresh random
+    key. Raises RuntimeError when there is no key.
+    """
+    key = os.getenv(env_var, "")
+    if key:
+        return key.encode("utf-8")
+    if create and not os.path.exists(path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            pass  # another server created it first
+        else:
+            with os.fdopen(fd, "wb") as f:
+                f.write(secrets.token_hex(32).encode("ascii"))
+            print(f"[rpc] generated a new authkey in {path}")
+    try:
+        with open(path, "rb") as f:
+            key = f.read().strip()
+    except FileNotFoundError:
+        raise RuntimeError(f"no authkey: set {env_var}, or start the server once to generate {path}") from None
+    if not key:
+        raise RuntimeError(f"authkey file {path} is empty")
+    return key
@@ -0,0 +1,490 @@
+# sharded.py
+"""
+Sharded vector store: chunks are partitioned by source file into N FAISS
+shards, each a VectorStore saved as <shard_dir>/shard_<i>.index and loaded,
+rebuilt and served independently.
+
+Queries are encoded once and fanned out to every shard in parallel, either
+in-process (FAISS releases the GIL during search) or to shard-server
+processes over local sockets; per-shard hits are merged with a global top-k heap.
+Shard servers authenticate clients with SHARD_AUTHKEY, or else with the
+random key `serve` writes to <shard_dir>/authkey; see rpc.py for why the
+key must stay private.
+
+    python sharded.py build --docs docs/ --shard-dir shards --shards 4
+    python sharded.py serve --shard-dir shards --port 7100      # one server per shard, ports 7100..
+    python sharded.py query "what is jdbc" --remote localhost:7100,localhost:7101,...
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import shutil
+import heapq
+import argparse
+import threading
+import multiprocessing as mp
+from multiprocessing.connection import Listener, Client
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from ingest import DocumentChunk, ingest_changed_documents, load_manifest, save_manifest
+from vectorstore import VectorStore, blend_scores, EMB_MODEL_NAME, EMB_CACHE_DIR, RETRIEVAL_MODE, HYBRID_ALPHA
+from filters import SearchFilter, load_tags
+from index_factory import INDEX_TYPE, INDEX_NPROBE, INDEX_EF_SEARCH
+from telemetry import span, traced
+from rpc import parse_address, load_authkey
+
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "4"))
+SHARD_DIR = os.getenv("SHARD_DIR", "shards")
+
+
+def shard_of(source: str, n_shards: int) -> int:
+    """Stable shard for a source file: all chunks of a file live in one shard."""
+    return zlib.crc32(source.encode("utf-8")) % n_shards
+
+
+def shard_path(shard_dir: str, i: int) -> str:
+    return os.path.join(shard_dir, f"shard_{i}.index")
+
+
+def shard_authkey(shard_dir: str, create: bool = False) -> bytes:
+    """Shard-server secret: $SHARD_AUTHKEY, else <shard_dir>/authkey (created by `serve`)."""
+    return load_authkey("SHARD_AUTHKEY", os.path.join(shard_dir, "authkey"), create)
+
+
+def read_layout(shard_dir: str) -> Optional[Dict]:
+    path = os.path.join(shard_dir, "shards.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+# ------------------------
+# Shard server
+# ------------------------
+def serve_shard(path: str, address: Tuple[str, int], authkey: Optional[bytes] = None):
+    """
+    Serve one saved shard until a "shutdown" message arrives. Requests are
+    tuples: ("search", emb_q, top_k, nprobe, ef_search, filters), ("lexical",
+    queries, top_k, filters), ("filter_options",), ("reload",), ("info",),
+    ("shutdown",). Search only needs query vectors, so the embedding model is
+    never loaded here. Without `authkey` the shard dir's key is used; the
+    server refuses to start when there is none.
+    """
+    authkey = authkey or shard_authkey(os.path.dirname(path))
+    vs = VectorStore(cache_dir="")
+
+    def load():
+        # a shard left empty by a rebuild has no files; it answers with no hits
+        if os.path.exists(path):
+            vs.load(path)
+        else:
+            vs.index, vs.bm25, vs.revision = None, None, None
+
+    load()
+    lock = threading.RLock()  # reload swaps the index under in-flight searches
+    stop = threading.Event()
+    listener = Listener(address, backlog=64, authkey=authkey)
+    print(f"[sharded] serving {path} on {address[0]}:{address[1]}")
+
+    def handle(conn):
+        with conn:
+            while True:
+                try:
+                    msg = conn.recv()
+                except (EOFError, OSError):
+                    return
+                op = msg[0]
+                try:
+                    if op == "search":
+                        with lock:
+                            result = vs.search_vectors(*msg[1:]) if vs.index is not None else [[] for _ in msg[1]]
+                    elif op == "lexical":
+                        with lock:
+                            result = vs.lexical_query_batch(*msg[1:]) if vs.bm25 is not None else [[] for _ in msg[1]]
+                    elif op == "filter_options":
+                        with lock:
+                            result = vs.filter_options()
+                    elif op == "reload":
+                        with lock:
+                            load()
+                        result = vs.ntotal
+                    elif op == "info":
+                        result = {"path": path, "ntotal": vs.ntotal,
+                                  "revision": vs.revision}
+                    elif op == "shutdown":
+                        stop.set()
+                        conn.send(("ok", None))
+                        Client(address, authkey=authkey).close()  # wake the accept loop
+                        return
+                    else:
+                        raise ValueError(f"unknown op {op!r}")
+                    conn.send(("ok", result))
+                except Exception as e:
+                    conn.send(("error", f"{type(e).__name__}: {e}"))
+
+    with listener:
+        while True:
+            try:
+                conn = listener.accept()
+            except OSError:
+                continue  # failed handshake
+            if stop.is_set():
+                conn.close()
+                break
+            threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+
+def launch_shard_servers(shard_dir: str = SHARD_DIR, host: str = "localhost", port: int = 7100) -> Tuple[List[str], List]:
+    """Start one server process per shard on consecutive ports; returns (addresses, processes)."""
+    layout = read_layout(shard_dir)
+    if layout is None:
+        raise FileNotFoundError(f"no shards.json in {shard_dir}; run `sharded.py build` first")
+    n_shards = layout["n_shards"]
+    authkey = shard_authkey(shard_dir, create=True)
+    ctx = mp.get_context("spawn")
+    addresses, procs = [], []
+    for i in range(n_shards):
+        p = ctx.Process(target=serve_shard, args=(shard_path(shard_dir, i), (host, port + i), authkey),
+                        daemon=True)
+        p.start()
+        addresses.append(f"{host}:{port + i}")
+        procs.append(p)
+    return addresses, procs
+
+
+class ShardClient:
+    """One connection to a shard server; calls are serialized per connection."""
+
+    def __init__(self, address: str, authkey: bytes, retries: int = 50):
+        self.address = address
+        for attempt in range(retries):
+            try:
+                self._conn = Client(parse_address(address), authkey=authkey)
+                break
+            except ConnectionRefusedError:
+                if attempt == retries - 1:
+                    raise
+                time.sleep(0.1)  # server still loading its shard
+        self._lock = threading.Lock()
+
+    def call(self, *msg):
+        with self._lock:
+            self._conn.send(msg)
+            status, result = self._conn.recv()
+        if status != "ok":
+            raise RuntimeError(f"shard {self.address}: {result}")
+        return result
+
+    def close(self):
+        self._conn.close()
+
+
+# ------------------------
+# Sharded store
+# ------------------------
+class ShardedVectorStore:
+    def __init__(self, shard_dir: str = SHARD_DIR, n_shards: Optional[int] = None, model_name: str = EMB_MODEL_NAME,
+                 cache_dir: str = EMB_CACHE_DIR, index_type: str = INDEX_TYPE, model=None,
+                 addresses: Optional[List[str]] = None):
+        """
+        With `addresses` (host:port per shard, in shard order) searches go to
+        shard servers; otherwise shards are loaded in this process.
+        `n_shards` defaults to the shard dir's layout, or SHARD_COUNT for a
+        new shard dir.
+        """
+        self.shard_dir = shard_dir
+        if addresses:
+            n_shards = len(addresses)
+        elif n_shards is None:
+            layout = read_layout(shard_dir)
+            n_shards = layout["n_shards"] if layout else SHARD_COUNT
+        self.n_shards = n_shards
+        self.index_type = index_type
+        # encodes queries and chunks once for all shards; holds the shared model and cache
+        self.encoder = VectorStore(model_name, cache_dir, index_type, model=model)
+        self.shards: List[Optional[VectorStore]] = [None] * self.n_shards
+        self.clients = [ShardClient(a, shard_authkey(shard_dir)) for a in addresses] if addresses else None
+        self._pool = ThreadPoolExecutor(max_workers=self.n_shards, thread_name_prefix="shard")
+
+    def _new_shard(self) -> VectorStore:
+        vs = VectorStore(self.encoder.model_name, "", self.index_type)
+        # share one model and one embedding cache across shards
+        vs._model = self.encoder.model
+        vs._cache = self.encoder.cache
+        return vs
+
+    def _partition(self, chunks: List[DocumentChunk]) -> List[List[DocumentChunk]]:
+        parts = [[] for _ in range(self.n_shards)]
+        for c in chunks:
+            parts[shard_of(c.source, self.n_shards)].append(c)
+        return parts
+
+    # ------------------------
+    # Build / persist
+    # ------------------------
+    @traced("sharded.build")
+    def build(self, chunks: List[DocumentChunk]):
+        for i, part in enumerate(self._partition(chunks)):
+            self.rebuild_shard(i, part, save=False)
+
+    def rebuild_shard(self, i: int, chunks: List[DocumentChunk], save: bool = True):
+        """Rebuild shard `i` alone from its chunks; other shards are untouched."""
+        vs = self._new_shard()
+        if chunks:
+            vs.build(chunks)
+        self.shards[i] = vs
+        if save:
+            self.save_shard(i)
+
+    def save_shard(self, i: int):
+        vs = self.shards[i]
+        path = shard_path(self.shard_dir, i)
+        os.makedirs(self.shard_dir, exist_ok=True)
+        if vs is not None and vs.index is not None:
+            vs.save(path)
+        else:
+            for p in (path, path + ".chunks", path + ".bm25"):
+                if os.path.isdir(p):
+                    shutil.rmtree(p)
+                elif os.path.exists(p):
+                    os.remove(p)
+        self._write_layout()
+        if self.clients:
+            self.clients[i].call("reload")
+
+    def save(self):
+        for i in range(self.n_shards):
+            self.save_shard(i)
+
+    def _write_layout(self):
+        layout = {"n_shards": self.n_shards, "model": self.encoder.model_name, "index_type": self.index_type}
+        with open(os.path.join(self.shard_dir, "shards.json"), "w", encoding="utf-8") as f:
+            json.dump(layout, f)
+
+    def load(self, mmap: bool = True):
+        layout = read_layout(self.shard_dir)
+        if layout is None:
+            raise FileNotFoundError(f"no shards.json in {self.shard_dir}")
+        self.n_shards = layout["n_shards"]
+        self.shards = [None] * self.n_shards
+        for i in range(self.n_shards):
+            if os.path.exists(shard_path(self.shard_dir, i)):
+                vs = VectorStore(self.encoder.model_name, "", self.index_type)
+                vs.load(shard_path(self.shard_dir, i), mmap=mmap)
+                self.shards[i] = vs
+        self._pool = ThreadPoolExecutor(max_workers=self.n_shards, thread_name_prefix="shard")
+
+    @traced("sharded.sync")
+    def sync(self, folder: str = "docs/") -> Dict:
+        """
+        Incremental sync against `folder`: only shards owning new, changed or
+        removed files are updated and saved. Raises ValueError when the
+        shard dir was built with a different shard count.
+        """
+        manifest_path = os.path.join(self.shard_dir, "manifest.json")
+        layout = read_layout(self.shard_dir)
+        incremental = os.path.exists(manifest_path) and layout is not None
+        if incremental and layout["n_shards"] != self.n_shards:
+            # files are placed by crc32(source) % n_shards, so the count cannot change in place
+            raise ValueError(f"{self.shard_dir} holds {layout['n_shards']} shards, not {self.n_shards}; "
+                             f"keep the shard count or delete {self.shard_dir} to re-shard")
+        if incremental and not any(self.shards):
+            # shards are updated here even when searches go to shard servers
+            self.load(mmap=False)
+        delta = ingest_changed_documents(folder, load_manifest(manifest_path) if incremental else {})
+        parts = self._partition(delta.chunks)
+        stale = [[] for _ in range(self.n_shards)]
+        for src in delta.stale_sources:
+            stale[shard_of(src, self.n_shards)].append(src)
+
+        dirty = [i for i in range(self.n_shards) if parts[i] or stale[i] or not incremental]
+        # tags.json is re-read on every sync; shards whose tags changed are re-saved
+        tags = load_tags(folder, list(delta.manifest["files"]))
+        for i in range(self.n_shards):
+            if i in dirty:
+                vs = self.shards[i]
+                if vs is None or vs.index is None:
+                    self.rebuild_shard(i, parts[i], save=False)
+                else:
+                    # shards loaded for search have no model; attach the shared one to update
+                    vs._model = self.encoder.model
+                    vs._cache = self.encoder.cache
+                    vs.update(parts[i], stale[i])
+            vs = self.shards[i]
+            shard_tags = {src: ts for src, ts in tags.items() if shard_of(src, self.n_shards) == i}
+            retagged = vs is not None and vs.index is not None and vs.tags != shard_tags
+            if retagged:
+                vs.set_tags(shard_tags)
+            if i in dirty or retagged:
+                self.save_shard(i)
+        os.makedirs(self.shard_dir, exist_ok=True)
+        save_manifest(delta.manifest, manifest_path)
+        return {
+            "added": len(delta.added),
+            "changed": len(delta.changed),
+            "removed": len(delta.removed),
+            "unchanged": len(delta.unchanged),
+            "chunks_embedded": len(delta.chunks),
+            "shards_rebuilt": dirty,
+            "total_vectors": self.ntotal,
+        }
+
+    @property
+    def ntotal(self) -> int:
+        if self.clients:
+            return sum(c.call("info")["ntotal"] for c in self.clients)
+        return sum(vs.ntotal for vs in self.shards if vs is not None)
+
+    @property
+    def revision(self) -> str:
+        if self.clients:
+            revs = [str(c.call("info")["revision"]) for c in self.clients]
+        else:
+            revs = [str(vs.revision) if vs is not None else "-" for vs in self.shards]
+        return "+".join(revs)
+
+    # ------------------------
+    # Query
+    # ------------------------
+    def encode(self, texts: List[str], show_progress_bar: bool = False) -> np.ndarray:
+        return self.encoder.encode(texts, show_progress_bar)
+
+    def _fan_out(self, local_fn, *msg) -> List[List[List[Dict]]]:
+        """Run one request on every shard in parallel; one list of hit lists per shard."""
+        if self.clients:
+            futures = [self._pool.submit(c.call, *msg) for c in self.clients]
+        else:
+            futures = [self._pool.submit(local_fn, vs) for vs in self.shards if vs is not None and vs.index is not None]
+        return [f.result() for f in futures]
+
+    @staticmethod
+    def _merge(per_shard: List[List[List[Dict]]], n_queries: int, top_k: int) -> List[List[Dict]]:
+        # global top-k over every shard's local top-k
+        return [heapq.nlargest(top_k, (h for shard in per_shard for h in shard[qi]), key=lambda h: h["score"])
+                for qi in range(n_queries)]
+
+    def search_vectors(self, emb_q: np.ndarray, top_k: int = 5, nprobe: int = INDEX_NPROBE,
+                       ef_search: int = INDEX_EF_SEARCH, filters: Optional[SearchFilter] = None) -> List[List[Dict]]:
+        with span("sharded.search", queries=len(emb_q), shards=self.n_shards):
+            per_shard = self._fan_out(lambda vs: vs.search_vectors(emb_q, top_k, nprobe, ef_search, filters),
+                                      "search", emb_q, top_k, nprobe, ef_search, filters)
+        return self._merge(per_shard, len(emb_q), top_k)
+
+    def query_batch(self, queries: List[str], top_k: int = 5, nprobe: int = INDEX_NPROBE,
+                    ef_search: int = INDEX_EF_SEARCH, filters: Optional[SearchFilter] = None,
+                    emb_q: Optional[np.ndarray] = None) -> List[List[Dict]]:
+        if not queries:
+            return []
+        with span("vectorstore.query", queries=len(queries)):
+            return self.search_vectors(self.encoder.encode_queries(queries, emb_q), top_k, nprobe, ef_search,
+                                       filters)
+
+    def query(self, q: str, top_k: int = 5, nprobe: int = INDEX_NPROBE, ef_search: int = INDEX_EF_SEARCH,
+              filters: Optional[SearchFilter] = None):
+        return self.query_batch([q], top_k, nprobe, ef_search, filters)[0]
+
+    def lexical_query_batch(self, queries: List[str], top_k: int = 5,
+                            filters: Optional[SearchFilter] = None) -> List[List[Dict]]:
+        """BM25 per shard (idf is shard-local, so scores are approximately comparable)."""
+        with span("sharded.lexical", queries=len(queries), shards=self.n_shards):
+            per_shard = self._fan_out(
+                lambda vs: (vs.lexical_query_batch(queries, top_k, filters) if vs.bm25 is not None
+                            else [[] for _ in queries]),
+                "lexical", queries, top_k, filters)
+        return self._merge(per_shard, len(queries), top_k)
+
+    def hybrid_query_batch(self, queries: List[str], top_k: int = 5, alpha: float = HYBRID_ALPHA,
+                           filters: Optional[SearchFilter] = None,
+                           emb_q: Optional[np.ndarray] = None) -> List[List[Dict]]:
+        """
+        Same blend as VectorStore.hybrid_query_batch, over the merged dense and
+        lexical candidates of all shards. Raw cosine and BM25 scores are
+        normalized after the merge, so scores from different shards share one
+        scale. Lexical-only candidates score 0 on the dense side.
+        """
+        n_cand = max(top_k * 4, 20)
+        dense = self.query_batch(queries, n_cand, filters=filters, emb_q=emb_q)
+        lexical = self.lexical_query_batch(queries, n_cand, filters)
+        out = []
+        for d_hits, l_hits in zip(dense, lexical):
+            hits = {h["id"]: h for h in l_hits}
+            hits.update((h["id"], h) for h in d_hits)
+            d_scores = {h["id"]: h["score"] for h in d_hits}
+            l_scores = {h["id"]: h["score"] for h in l_hits}
+            out.append([dict(hits[i], score=s, dense_score=d_scores.get(i), lexical_score=l_scores.get(i))
+                        for s, i in blend_scores(d_scores, l_scores, alpha)[:top_k]])
+        return out
+
+    def retrieve(self, queries: List[str], top_k: int = 5, mode: str = RETRIEVAL_MODE,
+                 filters: Optional[SearchFilter] = None, emb_q: Optional[np.ndarray] = None) -> List[List[Dict]]:
+        """Same modes as VectorStore.retrieve. Each shard applies `filters` to its own rows."""
+        if not queries:
+            return []
+        if mode == "lexical":
+            return self.lexical_query_batch(queries, top_k, filters)
+        if mode == "hybrid":
+            return self.hybrid_query_batch(queries, top_k, filters=filters, emb_q=emb_q)
+        return self.query_batch(queries, top_k, filters=filters, emb_q=emb_q)
+
+    def filter_options(self) -> Dict[str, List[str]]:
+        """Union of the shards' filterable values."""
+        if self.clients:
+            per_shard = [c.call("filter_options") for c in self.clients]
+        else:
+            per_shard = [vs.filter_options() for vs in self.shards if vs is not None]
+        return {k: sorted({v for opts in per_shard for v in opts[k]}) for k in ("sources", "extensions", "tags")}
+
+    def close(self):
+        if self.clients:
+            for c in self.clients:
+                c.close()
+        self._pool.shutdown(wait=False)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="incrementally (re)build the shards from a docs folder")
+    b.add_argument("--docs", default="docs/")
+    b.add_argument("--shards", type=int, default=None,
+                   help=f"shard count of a new shard dir (default {SHARD_COUNT}); must match an existing one")
+    s = sub.add_parser("serve", help="run one shard server process per shard")
+    s.add_argument("--host", default="localhost")
+    s.add_argument("--port", type=int, default=7100, help="port of shard 0; shard i listens on port + i")
+    q = sub.add_parser("query")
+    q.add_argument("question")
+    q.add_argument("--top-k", type=int, default=5)
+    q.add_argument("--mode", choices=("dense", "lexical", "hybrid"), default=RETRIEVAL_MODE)
+    q.add_argument("--remote", default="", help="comma-separated host:port of shard servers")
+    for p in (b, s, q):
+        p.add_argument("--shard-dir", default=SHARD_DIR)
+    args = ap.parse_args()
+
+    if args.cmd == "build":
+        svs = ShardedVectorStore(args.shard_dir, n_shards=args.shards)
+        try:
+            stats = svs.sync(args.docs)
+        except ValueError as e:
+            ap.error(str(e))
+        print(json.dumps(stats, indent=1))
+    elif args.cmd == "serve":
+        addresses, procs = launch_shard_servers(args.shard_dir, args.host, args.port)
+        print(f"[sharded] shard servers: {','.join(addresses)}", file=sys.stderr)
+        for p in procs:
+            p.join()
+    else:
+        addresses = [a for a in args.remote.split(",") if a]
+        svs = ShardedVectorStore(args.shard_dir, addresses=addresses or None)
+        if not addresses:
+            svs.load()
+        for h in svs.retrieve([args.question], top_k=args.top_k, mode=args.mode)[0]:
+            print(f"{h['score']:.4f}  {h['id']}")
+        svs.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,19 @@
 # synthesizer.py
 import os
-from typing import List, Dict
+from typing import List, Dict, Iterator, Optional, Tuple
 import openai
 from rich import print
 import re
+from telemetry import span, traced, incr
+from context_packer import pack_sources, count_tokens
 
 # Setup key
 OPENAI_KEY = os.getenv("OPENAI_API_KEY")
 if OPENAI_KEY:
     openai.api_key = "Your_Key"
+# any OpenAI-compatible endpoint (a proxy, a local model server, mock_llm.py)
+if os.getenv("OPENAI_API_BASE"):
+    openai.api_base = os.getenv("OPENAI_API_BASE")
 
 
 def safe_snippet(text: str, max_len: int = 180) -> str:
@@ -34,39 +39,23 @@ def safe_snippet(text: str, max_len: int = 180) -> str:
     return out.strip() + "…"
 
 
-def short_summarize_texts(texts: List[Dict], max_chars: int = 1500) -> str:
-    """
-    Summarizer: Prefer OpenAI LLM. If unavailable, fallback to structured bullets.
-    """
-    if OPENAI_KEY:
-        prompt = (
-            "You are an expert research summarizer. "
-            "Synthesize the following sources into a concise structured report with:\n"
-            "- A title\n"
-            "- Key findings in bullet points\n"
-            "- A short conclusion\n\n"
-            "Use inline citations like [Local:filename_chunk] or [Web:source] from the labels.\n"
-            "Keep report <= 600 words.\n\nSources:\n"
-        )
-        for i, s in enumerate(texts):
-            label = s.get("label", "")
-            snippet = s["text"][:2000]
-            prompt += f"---\nSource {i+1} ({label}):\n{snippet}\n"
+def _summary_prompt(texts: List[Dict]) -> str:
+    prompt = (
+        "You are an expert research summarizer. "
+        "Synthesize the following sources into a concise structured report with:\n"
+        "- A title\n"
+        "- Key findings in bullet points\n"
+        "- A short conclusion\n\n"
+        "Use inline citations like [Local:filename_chunk] or [Web:source] from the labels.\n"
+        "Keep report <= 600 words.\n\nSources:\n"
+    )
+    for i, s in enumerate(texts):
+        label = s.get("label", "")
+        prompt += f"---\nSource {i+1} ({label}):\n{s['text']}\n"
+    return prompt
 
-        try:
-            resp = openai.ChatCompletion.create(
-                model="gpt-4o-mini",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.0,
-                max_tokens=900
-            )
-            return resp["choices"][0]["message"]["content"].strip()
-        except Exception as e:
-            print("[synthesizer] OpenAI call failed, using fallback:", e)
 
-    # -------------------
-    # Fallback summarizer
-    # -------------------
+def _fallback_summary(texts: List[Dict], max_chars: int = 1500) -> str:
     summary = "# Research Report\n\n## Key Findings\n"
     for s in texts:
         label = s.get("label", "")
@@ -86,15 +75,109 @@ def short_summarize_texts(texts: List[Dict], max_chars: int = 1500) -> str:
     return summary
 
 
-def build_report(question: str, plan: List[str], local_hits: List[Dict], web_hits: List[Dict]) -> Dict:
-    # Create labelled combined list for summarizer
+def estimate_tokens(text: str) -> int:
+    # tiktoken count for the LLM's encoding, ~4 characters per token without it
+    return count_tokens(text)
+
+
+def pack_prompt_sources(sources: List[Dict]) -> Tuple[List[Dict], Dict]:
+    """Dedupe and trim `sources` to the prompt token budget (see context_packer)."""
+    return pack_sources(sources, _summary_prompt)
+
+
+@traced("synth.short_summarize_texts")
+def short_summarize_texts(texts: List[Dict], max_chars: int = 1500,
+                          fallback_texts: Optional[List[Dict]] = None) -> str:
+    """
+    Summarizer: Prefer OpenAI LLM. If unavailable, fallback to structured bullets.
+    `texts` are sent as given; pack them with pack_prompt_sources first. The
+    fallback bullets list `fallback_texts` (default `texts`): pass the unpacked
+    sources there, since packing only serves the prompt budget.
+    """
+    if OPENAI_KEY:
+        prompt = _summary_prompt(texts)
+        try:
+            with span("synth.llm_call", model="gpt-4o-mini", sources=len(texts)) as s:
+                resp = openai.ChatCompletion.create(
+                    model="gpt-4o-mini",
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=0.0,
+                    max_tokens=900
+                )
+                usage = resp.get("usage") or {}
+                s.attributes["prompt_tokens"] = usage.get("prompt_tokens", estimate_tokens(prompt))
+                s.attributes["completion_tokens"] = usage.get("completion_tokens", 0)
+            incr("rag_llm_prompt_tokens_total", s.attributes["prompt_tokens"])
+            incr("rag_llm_completion_tokens_total", s.attributes["completion_tokens"])
+            return resp["choices"][0]["message"]["content"].strip()
+        except Exception as e:
+            print("[synthesizer] OpenAI call failed, using fallback:", e)
+
+    # -------------------
+    # Fallback summarizer
+    # -------------------
+    return _fallback_summary(texts if fallback_texts is None else fallback_texts, max_chars)
+
+
+def stream_summarize_texts(texts: List[Dict], max_chars: int = 1500,
+                           fallback_texts: Optional[List[Dict]] = None) -> Iterator[str]:
+    """
+    Streaming variant of short_summarize_texts: yields the LLM output token by
+    token as it arrives. The fallback summary is yielded in one piece.
+    """
+    if OPENAI_KEY:
+        started = False
+        prompt = _summary_prompt(texts)
+        try:
+            with span("synth.llm_stream", model="gpt-4o-mini", sources=len(texts)) as s:
+                # streamed responses carry no usage block; count the prompt locally
+                s.attributes["prompt_tokens"] = estimate_tokens(prompt)
+                incr("rag_llm_prompt_tokens_total", s.attributes["prompt_tokens"])
+                for chunk in openai.ChatCompletion.create(
+                    model="gpt-4o-mini",
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=0.0,
+                    max_tokens=900,
+                    stream=True
+                ):
+                    token = chunk["choices"][0].get("delta", {}).get("content")
+                    if token:
+                        started = True
+                        incr("rag_llm_completion_tokens_total", 1)
+                        yield token
+            return
+        except Exception as e:
+            print("[synthesizer] OpenAI streaming call failed:", e)
+            if started:
+                return
+    yield _fallback_summary(texts if fallback_texts is None else fallback_texts, max_chars)
+
+
+def report_sources(local_hits: List[Dict], web_hits: List[Dict]) -> List[Dict]:
+    """Create labelled combined list for summarizer"""
     sources = []
     for l in local_hits:
-        sources.append({"label": f"Local:{l['source']}", "text": l["text"], "meta": l})
+        page = f" p.{l['page']}" if l.get("page") else ""
+        sources.append({"label": f"Local:{l['source']}{page}", "text": l["text"], "meta": l})
     for w in web_hits:
         sources.append({"label": f"Web:{w.get('source') or w.get('title')}", "text": w["text"], "meta": w})
+    return sources
+
+
+@traced("build_report")
+def build_report(question: str, plan: List[str], local_hits: List[Dict], web_hits: List[Dict],
+                 summary_markdown: Optional[str] = None, context: Optional[Dict] = None) -> Dict:
+    """
+    Pass `summary_markdown` when the summary was already produced (e.g.
+    streamed), with the `context` stats of the packing it was produced from.
+    """
+    sources = report_sources(local_hits, web_hits)
 
-    summary_md = short_summarize_texts(sources)
+    if summary_markdown is None:
+        packed, context = pack_prompt_sources(sources)
+        summary_md = short_summarize_texts(packed, fallback_texts=sources)
+    else:
+        summary_md = summary_markdown
 
     # Traceability list
     citations = [
@@ -108,6 +191,7 @@ def build_report(question: str, plan: List[str], local_hits: List[Dict], web_hit
         "summary_markdown": summary_md,
         "citations": citations,
         "local_hits": local_hits,
-        "web_hits": web_hits
+        "web_hits": web_hits,
+        "context": context or {}
     }
 
@@ -0,0 +1,280 @@
+# telemetry.py
+"""
+Lightweight tracing and metrics for the research pipeline.
+
+- span("vectorstore.query") times a block, records it in the current run's
+  Trace (if any) and in the process-wide stage-duration histogram.
+- incr("rag_embedding_cache_hits_total") bumps a counter.
+- REGISTRY.render_prometheus() returns the Prometheus text exposition format;
+  Trace.to_otlp() returns OTLP/JSON spans that any OpenTelemetry collector accepts.
+"""
+import os
+import json
+import time
+import uuid
+import threading
+import contextvars
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import wraps
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "onetuza-rag")
+# OTLP/HTTP collector base URL (e.g. http://localhost:4318); unset disables export
+OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+# ------------------------
+# Metrics
+# ------------------------
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        for i, b in enumerate(self.buckets):
+            if value <= b:
+                self.counts[i] += 1
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[str, Dict[LabelKey, float]] = {}
+        self.histograms: Dict[str, Dict[LabelKey, Histogram]] = {}
+
+    def incr(self, name: str, value: float = 1, **labels):
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            series.setdefault(key, Histogram()).observe(value)
+
+    def counter_value(self, name: str, **labels) -> float:
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        return self.counters.get(name, {}).get(key, 0.0)
+
+    def render_prometheus(self) -> str:
+        def fmt(labels: LabelKey, extra: Tuple = ()) -> str:
+            items = list(labels) + list(extra)
+            if not items:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+        lines = []
+        with self._lock:
+            for name, series in sorted(self.counters.items()):
+                lines.append(f"# TYPE {name} counter")
+                for labels, v in series.items():
+                    lines.append(f"{name}{fmt(labels)} {v}")
+            for name, series in sorted(self.histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+                for labels, h in series.items():
+                    for b, c in zip(h.buckets, h.counts):
+                        lines.append(f"{name}_bucket{fmt(labels, (('le', str(b)),))} {c}")
+                    lines.append(f"{name}_bucket{fmt(labels, (('le', '+Inf'),))} {h.count}")
+                    lines.append(f"{name}_sum{fmt(labels)} {h.sum}")
+                    lines.append(f"{name}_count{fmt(labels)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+# ------------------------
+# Tracing
+# ------------------------
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    start_ns: int
+    end_ns: int = 0
+    attributes: Dict = field(default_factory=dict)
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e6
+
+
+class Trace:
+    """All spans and counters recorded during one research run."""
+
+    def __init__(self, name: str = "research"):
+        self.name = name
+        self.trace_id = uuid.uuid4().hex
+        self.spans: List[Span] = []
+        self.counters: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, s: Span):
+        with self._lock:
+            self.spans.append(s)
+
+    def incr(self, name: str, value: float):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0.0) + value
+
+    def breakdown(self) -> List[Dict]:
+        """Spans in start order with their depth, for display."""
+        depth = {}
+        rows = []
+        for s in sorted(self.spans, key=lambda s: s.start_ns):
+            depth[s.span_id] = depth.get(s.parent_id, -1) + 1
+            rows.append({"span": s.name, "depth": depth[s.span_id], "ms": round(s.duration_ms, 2),
+                         **{k: v for k, v in s.attributes.items() if isinstance(v, (int, float, str))}})
+        return rows
+
+    def to_otlp(self) -> Dict:
+        def attr(k, v):
+            if isinstance(v, bool):
+                return {"key": k, "value": {"boolValue": v}}
+            if isinstance(v, int):
+                return {"key": k, "value": {"intValue": str(v)}}
+            if isinstance(v, float):
+                return {"key": k, "value": {"doubleValue": v}}
+            return {"key": k, "value": {"stringValue": str(v)}}
+
+        spans = [{
+            "traceId": s.trace_id,
+            "spanId": s.span_id,
+            **({"parentSpanId": s.parent_id} if s.parent_id else {}),
+            "name": s.name,
+            "kind": 1,
+            "startTimeUnixNano": str(s.start_ns),
+            "endTimeUnixNano": str(s.end_ns),
+            "attributes": [attr(k, v) for k, v in s.attributes.items()],
+        } for s in self.spans]
+        return {"resourceSpans": [{
+            "resource": {"attributes": [attr("service.name", SERVICE_NAME)]},
+            "scopeSpans": [{"scope": {"name": "onetuza-rag"}, "spans": spans}],
+        }]}
+
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("rag_trace", default=None)
+_current_span: contextvars.ContextVar = contextvars.ContextVar("rag_span", default=None)
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Span]:
+    trace = _current_trace.get()
+    parent = _current_span.get()
+    s = Span(name=name, trace_id=trace.trace_id if trace else uuid.uuid4().hex, span_id=uuid.uuid4().hex[:16],
+             parent_id=parent.span_id if parent else None, start_ns=time.time_ns(), attributes=dict(attributes))
+    token = _current_span.set(s)
+    t0 = time.perf_counter()
+    try:
+        yield s
+    except Exception as e:
+        s.attributes["error"] = type(e).__name__
+        raise
+    finally:
+        elapsed = time.perf_counter() - t0
+        s.end_ns = s.start_ns + int(elapsed * 1e9)
+        _current_span.reset(token)
+        REGISTRY.observe("rag_stage_duration_seconds", elapsed, stage=name)
+        if trace is not None:
+            trace.add(s)
+
+
+def traced(name: str) -> Callable:
+    """Decorator form of span()."""
+    def deco(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+def incr(name: str, value: float = 1, **labels):
+    """Bump a process-wide counter and the current run's copy of it."""
+    if not value:
+        return
+    REGISTRY.incr(name, value, **labels)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.incr(name, value)
+
+
+@contextmanager
+def trace_run(name: str = "research") -> Iterator[Trace]:
+    """Collect every span recorded in this context (and in_context() workers) into one Trace."""
+    trace = Trace(name)
+    token = _current_trace.set(trace)
+    try:
+        with span(name):
+            yield trace
+    finally:
+        _current_trace.reset(token)
+        if OTLP_ENDPOINT:
+            export_otlp(trace)
+
+
+def in_context(fn: Callable) -> Callable:
+    """Bind `fn` to the caller's trace/span so work submitted to a thread pool is attributed to it."""
+    ctx = contextvars.copy_context()
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        return ctx.run(fn, *args, **kwargs)
+    return wrapper
+
+
+# ------------------------
+# Export
+# ------------------------
+def export_otlp(trace: Trace, endpoint: str = None):
+    """POST the trace to an OTLP/HTTP collector (JSON encoding)."""
+    endpoint = (endpoint or OTLP_ENDPOINT).rstrip("/")
+    try:
+        import requests
+        requests.post(endpoint + "/v1/traces", data=json.dumps(trace.to_otlp()),
+                      headers={"Content-Type": "application/json"}, timeout=2)
+    except Exception as e:
+        print(f"[telemetry] OTLP export failed: {e}")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+_metrics_server = None
+
+
+def serve_metrics(port: int, host: str = "127.0.0.1"):
+    """Expose /metrics for Prometheus scraping from a daemon thread (idempotent)."""
+    global _metrics_server
+    if _metrics_server is None:
+        _metrics_server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        threading.Thread(target=_metrics_server.serve_forever, daemon=True).start()
+    return _metrics_server
@@ -0,0 +1,40 @@
+# conftest.py
+import os
+import sys
+import zlib
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class HashEncoder:
+    """Deterministic bag-of-words encoder standing in for the SentenceTransformer."""
+
+    def __init__(self, dim: int = 64):
+        self.dim = dim
+        self.calls = 0
+        self.texts_encoded = 0
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def encode(self, texts, convert_to_numpy=True, show_progress_bar=False):
+        self.calls += 1
+        self.texts_encoded += len(texts)
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, t in enumerate(texts):
+            for w in t.lower().split():
+                out[i, zlib.crc32(w.encode("utf-8")) % self.dim] += 1.0
+        out[:, -1] += 1e-3  # never all-zero
+        return out
+
+
+@pytest.fixture
+def encoder():
+    return HashEncoder()
+
+
+def make_chunks(texts, source="doc.md"):
+    from ingest import DocumentChunk
+    return [DocumentChunk(id=f"{source}::chunk_{i}", source=source, text=t) for i, t in enumerate(texts)]
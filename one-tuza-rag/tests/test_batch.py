@@ -0,0 +1,27 @@
+# test_batch.py
+import json
+from conftest import HashEncoder, make_chunks
+from vectorstore import VectorStore
+from batch import completed_ids, run_batch
+
+
+def test_completed_ids_skips_malformed_lines(tmp_path):
+    out = tmp_path / "reports.jsonl"
+    out.write_text('{"id": "1"}\n{"id": "2", "summ\n{"id": "3"}\n{"id": "4", "tor', encoding="utf-8")
+    assert completed_ids(str(out)) == {"1", "3"}
+    # bad lines are dropped, so the next append starts on its own line
+    assert out.read_text(encoding="utf-8") == '{"id": "1"}\n{"id": "3"}\n'
+
+
+def test_run_batch_resumes(tmp_path):
+    vs = VectorStore(cache_dir="", model=HashEncoder())
+    vs.build(make_chunks(["java jdbc connects to databases", "cloud computing scales on demand",
+                          "quantum computers use qubits"]))
+    questions = [{"id": str(i), "question": q} for i, q in enumerate(["what is jdbc", "what is cloud computing"])]
+    out = str(tmp_path / "reports.jsonl")
+    stats = run_batch(iter(questions), vs, out, use_web=False, mode="hybrid")
+    assert stats["completed"] == 2
+    reports = [json.loads(line) for line in open(out, encoding="utf-8")]
+    assert {r["id"] for r in reports} == {"0", "1"}
+    assert all(r["local_hits"] for r in reports)
+    assert run_batch(iter(questions), vs, out, use_web=False)["skipped"] == 2
@@ -0,0 +1,32 @@
+# test_bm25.py
+import numpy as np
+from bm25 import BM25Index, tokenize
+
+
+def exhaustive(idx, query, k, mask=None):
+    scores = {}
+    for tid in {idx.vocab[t] for t in tokenize(query) if t in idx.vocab}:
+        docs, imp = idx._postings(tid)
+        for d, s in zip(docs.tolist(), imp.tolist()):
+            if mask is None or mask[d]:
+                scores[d] = scores.get(d, 0.0) + s
+    return sorted(scores.values(), reverse=True)[:k]
+
+
+def test_pruned_search_matches_exhaustive():
+    rng = np.random.default_rng(0)
+    vocab = [f"w{i}" for i in range(300)]
+    p = 1 / np.arange(1, 301) ** 1.1
+    p /= p.sum()
+    # long posting lists (many blocks) so MaxScore and block-max pruning kick in
+    idx = BM25Index.build([" ".join(rng.choice(vocab, size=40, p=p)) for _ in range(3000)])
+    for n in range(40):
+        query = " ".join(rng.choice(vocab, size=int(rng.integers(1, 6)), p=p))
+        mask = rng.random(idx.n_docs) < 0.3 if n % 2 else None
+        docs, scores = idx.search(query, 10, mask)
+        np.testing.assert_allclose(scores, exhaustive(idx, query, 10, mask), rtol=1e-5)
+        if mask is not None:
+            assert mask[docs].all()
+    # reused buffers are left clean: repeating a query gives the same answer
+    a, b = idx.search("w1 w2 w3", 5), idx.search("w1 w2 w3", 5)
+    assert (a[0] == b[0]).all() and np.allclose(a[1], b[1])
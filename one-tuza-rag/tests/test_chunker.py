@@ -0,0 +1,24 @@
+# test_chunker.py
+import chunker
+from chunker import Block, chunk_blocks, approx_token_counts
+from ingest import clean_text, chunk_document, read_md_blocks
+
+
+def sentence(word, n):
+    return " ".join([word] * n) + "."
+
+
+def test_no_chunk_of_only_overlap(monkeypatch):
+    monkeypatch.setattr(chunker, "_counter", approx_token_counts)
+    # 10 + 10 + 20 tokens, budget 25: the last sentence cannot join the carried overlap
+    text = " ".join([sentence("aa", 9), sentence("bb", 9), sentence("cc", 19)])
+    chunks = chunk_blocks([Block(text, 0)], clean_text, "sentences", max_tokens=27, overlap=10)
+    assert [c.text for c in chunks] == [sentence("aa", 9) + " " + sentence("bb", 9), sentence("cc", 19)]
+
+
+def test_words_strategy_keeps_headings(tmp_path):
+    md = tmp_path / "doc.md"
+    md.write_text("# Title\n\nIntro text.\n\n## Part two\n\nMore text.\n", encoding="utf-8")
+    blocks = read_md_blocks(str(md), strategy="words")
+    chunks = chunk_document("doc.md", blocks, strategy="words")
+    assert [c.text for c in chunks] == ["Title Intro text. Part two More text."]
@@ -0,0 +1,56 @@
+# test_chunkstore.py
+import numpy as np
+import pytest
+from conftest import HashEncoder, make_chunks
+from chunkstore import ChunkStore, write_chunk_store
+from vectorstore import VectorStore
+
+IDS = ["a.md::chunk_0", "a.md::chunk_1", "b.pdf::chunk_0"]
+SOURCES = ["a.md", "a.md", "b.pdf"]
+TEXTS = ["plain ascii", "", "ünïcödé — ✓"]
+HEADINGS = ["Intro", "Intro", ""]
+
+
+def test_round_trip_and_reopen_after_rewrite(tmp_path):
+    path = str(tmp_path / "faiss.index.chunks")
+    locs = np.array([[-1, 0, 11], [-1, 11, 11], [3, 0, 12]], dtype=np.int64)
+    write_chunk_store(path, IDS, SOURCES, TEXTS, meta={"revision": "r1"}, locs=locs, headings=HEADINGS,
+                      ingested=np.array([1, 2, 3]))
+    store = ChunkStore(path)
+    assert len(store) == 3 and store.meta["revision"] == "r1"
+    # blob columns
+    assert list(store.texts) == TEXTS and list(store.ids) == IDS
+    assert store.texts[-1] == TEXTS[-1] and store.ids[1:] == IDS[1:]
+    with pytest.raises(IndexError):
+        store.texts[3]
+    # coded columns
+    assert list(store.sources) == SOURCES and store.sources.vocab == ["a.md", "b.pdf"]
+    assert store.sources.codes().tolist() == [0, 0, 1] and store.sources[0:2] == SOURCES[:2]
+    assert list(store.headings) == HEADINGS
+    assert store.locs.tolist() == locs.tolist() and store.ingested.tolist() == [1, 2, 3]
+
+    # a rewrite leaves the open store reading its own (previous) version
+    write_chunk_store(path, ["c.md::chunk_0"], ["c.md"], ["rewritten"], meta={"revision": "r2"})
+    assert store.texts[0] == TEXTS[0]
+    reopened = ChunkStore(path)
+    assert list(reopened.texts) == ["rewritten"] and reopened.meta["revision"] == "r2"
+    assert reopened.locs is None and reopened.headings is None and reopened.ingested is None
+
+    store.close()
+    with pytest.raises(ValueError):
+        store.texts[0]  # unmapped
+    reopened.close()
+
+
+def test_reload_closes_the_previous_chunk_store(tmp_path):
+    path = str(tmp_path / "faiss.index")
+    vs = VectorStore(cache_dir="", model=HashEncoder())
+    vs.build(make_chunks(["java jdbc connects to databases", "cloud computing scales on demand"]))
+    vs.save(path)
+    vs.load(path)
+    first = vs._chunk_store
+    vs.build(make_chunks(["quantum computers use qubits"]))
+    vs.save(path)
+    vs.load(path)
+    assert first._maps == [] and vs._chunk_store is not first
+    assert vs.query("qubits", top_k=1)[0]["text"] == "quantum computers use qubits"
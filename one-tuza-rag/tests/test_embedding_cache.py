@@ -0,0 +1,91 @@
+# test_embedding_cache.py
+import threading
+import multiprocessing
+import numpy as np
+from conftest import HashEncoder, make_chunks
+from embedding_cache import EmbeddingCache
+from vectorstore import VectorStore
+
+TEXTS = ["java jdbc connects to databases", "cloud computing scales on demand",
+         "quantum computers use qubits", "bm25 ranks documents by term frequency"]
+
+
+def test_rebuild_hits_cache(tmp_path):
+    enc = HashEncoder()
+    VectorStore(cache_dir=str(tmp_path), model=enc).build(make_chunks(TEXTS))
+    assert enc.texts_encoded == len(TEXTS)
+
+    # a new process (fresh VectorStore) reads the flushed cache: nothing is re-embedded
+    enc2 = HashEncoder()
+    vs = VectorStore(cache_dir=str(tmp_path), model=enc2)
+    vs.build(make_chunks(TEXTS + ["one new chunk"]))
+    assert enc2.texts_encoded == 1
+    assert vs.cache.hits == len(TEXTS) and vs.cache.misses == 1
+
+
+def test_queries_bypass_cache(tmp_path):
+    enc = HashEncoder()
+    vs = VectorStore(cache_dir=str(tmp_path), model=enc)
+    vs.build(make_chunks(TEXTS))
+    n = len(vs.cache)
+    vs.query("what is jdbc", top_k=2)
+    vs.query("what is jdbc", top_k=2)
+    assert len(vs.cache) == n
+    assert enc.texts_encoded == len(TEXTS) + 2
+
+
+def test_concurrent_cached_encodes(tmp_path):
+    vs = VectorStore(cache_dir=str(tmp_path), model=HashEncoder())
+    errors = []
+
+    def work(i):
+        try:
+            for j in range(20):
+                vs.encode([f"text {i} {j}", "shared text"], use_cache=True)
+                vs.flush_cache()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
+    assert len(vs.cache) == 8 * 20 + 1
+
+
+def test_two_caches_on_one_directory(tmp_path):
+    # two processes' caches: each must see the other's slots before allocating
+    a = EmbeddingCache(str(tmp_path), "m", 4, max_entries=8)
+    b = EmbeddingCache(str(tmp_path), "m", 4, max_entries=8)
+    a.put_many(["alpha"], np.full((1, 4), 1.0, dtype=np.float32))
+    b.put_many(["beta"], np.full((1, 4), 2.0, dtype=np.float32))
+    emb, missing = a.get_many(["alpha", "beta"])
+    assert missing == [] and emb[:, 0].tolist() == [1.0, 2.0]
+    a.flush()
+    b.flush()
+    emb, missing = EmbeddingCache(str(tmp_path), "m", 4, max_entries=8).get_many(["alpha", "beta"])
+    assert missing == [] and emb[:, 0].tolist() == [1.0, 2.0]
+
+
+def _put_worker(cache_dir, offset):
+    cache = EmbeddingCache(cache_dir, "m", 4, max_entries=1000)
+    for i in range(offset, offset + 100, 10):
+        texts = [f"text {j}" for j in range(i, i + 10)]
+        cache.put_many(texts, np.arange(i, i + 10, dtype=np.float32)[:, None].repeat(4, axis=1))
+        cache.get_many(texts)
+    cache.flush()
+
+
+def test_concurrent_processes_share_a_directory(tmp_path):
+    ctx = multiprocessing.get_context("spawn")
+    procs = [ctx.Process(target=_put_worker, args=(str(tmp_path), k * 100)) for k in range(3)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    assert all(p.exitcode == 0 for p in procs)
+    emb, missing = EmbeddingCache(str(tmp_path), "m", 4, max_entries=1000).get_many([f"text {j}" for j in range(300)])
+    assert missing == []
+    assert emb[:, 0].tolist() == list(range(300))
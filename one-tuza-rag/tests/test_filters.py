@@ -0,0 +1,51 @@
+# test_filters.py
+import pytest
+from conftest import HashEncoder
+from ingest import DocumentChunk
+from filters import SearchFilter
+from vectorstore import VectorStore
+
+WORDS = "jdbc driver database cloud scaling qubit vector index query cache".split()
+
+
+def corpus():
+    chunks = []
+    for s, source in enumerate(("a.md", "b.pdf", "c.md", "d.pdf")):
+        for i in range(30):
+            text = " ".join(WORDS[(s + i + j) % len(WORDS)] for j in range(4))
+            page = i // 5 + 1 if source.endswith(".pdf") else None
+            chunks.append(DocumentChunk(id=f"{source}__chunk_{i}", source=source, text=text, page=page))
+    return chunks
+
+
+@pytest.mark.parametrize("index_type", ["flat", "hnsw", "binary"])
+@pytest.mark.parametrize("mode", ["dense", "lexical", "hybrid"])
+def test_filtered_search_returns_only_matching_rows(index_type, mode):
+    vs = VectorStore(cache_dir="", index_type=index_type, model=HashEncoder())
+    vs.build(corpus())
+    vs.set_tags({"a.md": ["java"], "d.pdf": ["java", "reports"]})
+    cases = [
+        (SearchFilter(sources=["c.md"]), lambda h: h["source"] == "c.md"),
+        (SearchFilter(extensions=["pdf"]), lambda h: h["source"].endswith(".pdf")),
+        (SearchFilter(tags=["java"]), lambda h: h["source"] in ("a.md", "d.pdf")),
+        (SearchFilter(extensions=["pdf"], page_min=2, page_max=3),
+         lambda h: h["source"].endswith(".pdf") and 2 <= h["page"] <= 3),
+    ]
+    for f, ok in cases:
+        hits = vs.retrieve(["jdbc database query"], top_k=5, mode=mode, filters=f)[0]
+        assert len(hits) == 5, f
+        assert all(ok(h) for h in hits), f
+    assert vs.retrieve(["jdbc"], top_k=5, mode=mode, filters=SearchFilter(sources=["missing.md"]))[0] == []
+
+
+def test_filtered_dense_search_matches_exact_search_over_the_subset():
+    vs = VectorStore(cache_dir="", model=HashEncoder())
+    vs.build(corpus())
+    f = SearchFilter(extensions=["md"])
+    filtered = vs.query("cloud scaling cache", top_k=5, filters=f)
+    subset = VectorStore(cache_dir="", model=HashEncoder())
+    subset.build([c for c in corpus() if c.source.endswith(".md")])
+    exact = subset.query("cloud scaling cache", top_k=5)
+    assert [round(h["score"], 5) for h in filtered] == [round(h["score"], 5) for h in exact]
+    assert vs.filter_options() == {"sources": ["a.md", "b.pdf", "c.md", "d.pdf"], "extensions": ["md", "pdf"],
+                                   "tags": []}
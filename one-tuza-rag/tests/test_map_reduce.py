@@ -0,0 +1,54 @@
+# test_map_reduce.py
+import threading
+from http.server import ThreadingHTTPServer
+import openai
+import pytest
+import map_reduce
+from map_reduce import map_reduce_summarize
+from mock_llm import Handler
+
+
+@pytest.fixture
+def mock_llm(monkeypatch):
+    """mock_llm.py on a free port; `fail_next` requests get a 429 before it answers normally."""
+    state = {"requests": 0, "fail_next": 0}
+    lock = threading.Lock()
+
+    class Flaky(Handler):
+        def do_POST(self):
+            with lock:
+                state["requests"] += 1
+                self.fail_rate = 1.0 if state["fail_next"] > 0 else 0.0
+                state["fail_next"] -= 1
+            super().do_POST()
+
+    server = ThreadingHTTPServer(("localhost", 0), Flaky)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(openai, "api_key", "test")
+    monkeypatch.setattr(openai, "api_base", f"http://localhost:{server.server_address[1]}/v1")
+    monkeypatch.setattr(map_reduce, "SYNTH_BACKOFF_S", 0.01)
+    yield state
+    server.shutdown()
+
+
+def hits(source, text):
+    return [{"id": f"{source}__chunk_1", "source": source, "text": text, "score": 1.0}]
+
+
+def test_map_reduce_retries_rate_limits(mock_llm):
+    mock_llm["fail_next"] = 3
+    summary, stats = map_reduce_summarize(
+        "what is jdbc", ["what is jdbc", "jdbc drivers"],
+        [hits("a.md", "JDBC is a Java database API."), hits("b.md", "Drivers implement JDBC.")])
+    assert stats["steps"] == 2 and stats["steps_failed"] == 0
+    # both map findings survive into the reduced report with their citations
+    assert "[Local:a.md]" in summary and "[Local:b.md]" in summary
+    assert mock_llm["requests"] == 3 + 3  # 3 rejected, 2 maps, 1 reduce
+
+
+def test_map_reduce_gives_up_after_retries(mock_llm, monkeypatch):
+    monkeypatch.setattr(map_reduce, "SYNTH_MAX_RETRIES", 1)
+    mock_llm["fail_next"] = 100
+    with pytest.raises(RuntimeError, match="map calls failed"):
+        map_reduce_summarize("what is jdbc", ["what is jdbc"], [hits("a.md", "JDBC is a Java database API.")])
+    assert mock_llm["requests"] == 2
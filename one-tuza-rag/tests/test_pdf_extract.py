@@ -0,0 +1,28 @@
+# test_pdf_extract.py
+import pytest
+from pypdf import PdfWriter
+import pdf_extract
+from pdf_extract import PageCache, pdf_page_count, iter_pdf_pages
+
+
+@pytest.fixture
+def pdf(tmp_path):
+    path = tmp_path / "blank.pdf"
+    writer = PdfWriter()
+    for _ in range(3):
+        writer.add_blank_page(width=200, height=200)
+    with open(path, "wb") as f:
+        writer.write(f)
+    return str(path)
+
+
+def test_page_count_and_pages_come_from_the_cache(tmp_path, pdf, monkeypatch):
+    cache = PageCache(str(tmp_path / "cache"))
+    assert pdf_page_count(pdf, "pypdf", cache) == 3
+    assert [p for p, _ in iter_pdf_pages(pdf, backend="pypdf", cache=cache)] == [0, 1, 2]
+
+    def no_open(*args, **kwargs):
+        raise AssertionError("PDF opened despite a warm cache")
+    monkeypatch.setattr(pdf_extract, "open_pdf", no_open)
+    assert pdf_page_count(pdf, "pypdf", cache) == 3
+    assert [p for p, _ in iter_pdf_pages(pdf, 1, backend="pypdf", cache=cache)] == [1, 2]
@@ -0,0 +1,79 @@
+# test_query_cache.py
+import numpy as np
+import pipeline
+import query_cache
+from conftest import HashEncoder, make_chunks
+from query_cache import QueryCache
+from vectorstore import VectorStore
+
+PARAMS = (5, 3, "dense", False, "single", None)
+REPORT = {"question": "What is JDBC?", "summary_markdown": "JDBC connects Java to databases."}
+
+
+def unit(v):
+    v = np.asarray(v, dtype=np.float32)
+    return v / np.linalg.norm(v)
+
+
+def test_exact_hit_ignores_case_and_punctuation():
+    cache = QueryCache()
+    cache.put("What is JDBC?", PARAMS, REPORT, revision="r1")
+    hit = cache.get("  what is   jdbc ", PARAMS, revision="r1")
+    assert hit["summary_markdown"] == REPORT["summary_markdown"] and hit["cache"] == {"tier": "exact"}
+    assert cache.get("What is JDBC?", PARAMS[:-1] + ("other",), revision="r1") is None
+    assert cache.hits["exact"] == 1 and cache.misses == 1
+
+
+def test_semantic_hit_respects_threshold():
+    cache = QueryCache(threshold=0.9)
+    cache.put("What is JDBC?", PARAMS, REPORT, embedding=unit([1, 0, 0]))
+    close = unit([1, 0.2, 0])   # cosine ~0.98
+    far = unit([1, 1, 0])       # cosine ~0.71
+    hit = cache.get("Explain JDBC", PARAMS, embedding=close)
+    assert hit["cache"]["tier"] == "semantic" and hit["cache"]["matched_question"] == "What is JDBC?"
+    assert hit["cache"]["similarity"] >= 0.9
+    assert cache.get("Explain JDBC pooling", PARAMS, embedding=far) is None
+    # different retrieval parameters never share a report
+    assert cache.get("Explain JDBC", PARAMS[:-1] + ("other",), embedding=close) is None
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(query_cache.time, "time", lambda: clock[0])
+    cache = QueryCache(ttl=60)
+    cache.put("What is JDBC?", PARAMS, REPORT, embedding=unit([1, 0, 0]))
+    clock[0] += 59
+    assert cache.get("What is JDBC?", PARAMS) is not None
+    clock[0] += 2
+    assert cache.get("What is JDBC?", PARAMS) is None
+    assert cache.get("Explain JDBC", PARAMS, embedding=unit([1, 0, 0])) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_revision_change_invalidates():
+    cache = QueryCache()
+    cache.put("What is JDBC?", PARAMS, REPORT, revision="r1", embedding=unit([1, 0, 0]))
+    assert cache.get("What is JDBC?", PARAMS, revision="r2") is None
+    cache.put("What is JDBC?", PARAMS, REPORT, revision="r1", embedding=unit([1, 0, 0]))
+    assert cache.get("Explain JDBC", PARAMS, revision="r2", embedding=unit([1, 0, 0])) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_run_research_encodes_the_question_once(monkeypatch):
+    monkeypatch.setattr(query_cache, "CACHE", QueryCache())
+    monkeypatch.setattr(pipeline, "web_retrieve", lambda question, top_k: [])
+    enc = HashEncoder()
+    vs = VectorStore(cache_dir="", model=enc)
+    vs.build(make_chunks(["java jdbc connects to databases", "cloud computing scales on demand"]))
+    enc.texts_encoded = 0
+
+    events = list(pipeline.run_research("What is JDBC?", vs, mode="dense", rerank=False))
+    plan = next(e.data for e in events if e.stage == "plan")
+    # the lookup's embedding is reused on the miss: only the plan steps are encoded again
+    assert enc.texts_encoded == 1 + len(plan)
+    assert events[-1].stage == "report" and "cache" not in events[-1].data
+
+    enc.texts_encoded = 0
+    events = list(pipeline.run_research("what is jdbc", vs, mode="dense", rerank=False))
+    assert events[-1].data["cache"]["tier"] == "exact"
+    assert enc.texts_encoded == 1
@@ -0,0 +1,43 @@
+# test_reranker.py
+import sys
+import types
+import reranker
+from reranker import CrossEncoderReranker
+
+HITS = [{"id": f"h{i}", "text": f"chunk {i}"} for i in range(6)]
+
+
+class DigitModel:
+    """Scores a pair by the chunk's trailing digit: higher digit, better match."""
+
+    def predict(self, pairs, batch_size=None, show_progress_bar=False):
+        return [int(text[-1]) for _, text in pairs]
+
+
+def test_rerank_orders_by_score():
+    out = CrossEncoderReranker(model=DigitModel(), batch_size=2).rerank("q", HITS, top_k=3)
+    assert [h["id"] for h in out] == ["h5", "h4", "h3"]
+    assert all("rerank_score" in h for h in out)
+
+
+def test_failed_load_is_cached_until_retry(monkeypatch):
+    attempts = []
+
+    def failing_cross_encoder(*a, **kw):
+        attempts.append(1)
+        raise OSError("hub timeout")
+
+    monkeypatch.setitem(sys.modules, "sentence_transformers",
+                        types.SimpleNamespace(CrossEncoder=failing_cross_encoder))
+    clock = [1000.0]
+    monkeypatch.setattr(reranker.time, "monotonic", lambda: clock[0])
+
+    rr = CrossEncoderReranker(retry_s=60)
+    for _ in range(3):
+        assert rr.rerank("q", HITS, top_k=2) == HITS[:2]  # dense order
+    assert len(attempts) == 1
+
+    clock[0] += 61
+    monkeypatch.setitem(sys.modules, "sentence_transformers",
+                        types.SimpleNamespace(CrossEncoder=lambda *a, **kw: DigitModel()))
+    assert [h["id"] for h in rr.rerank("q", HITS, top_k=2)] == ["h5", "h4"]
@@ -0,0 +1,84 @@
+# test_retrieval_server.py
+import threading
+import numpy as np
+from conftest import HashEncoder, make_chunks
+from vectorstore import VectorStore
+from retrieval_server import RetrievalServer
+
+TEXTS = ["java jdbc connects to databases", "cloud computing scales on demand",
+         "quantum computers use qubits", "bm25 ranks documents by term frequency"]
+
+
+class GatedEncoder(HashEncoder):
+    """Blocks on any text containing SLOW until `release` is set."""
+
+    def __init__(self):
+        super().__init__()
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def encode(self, texts, **kw):
+        if any("SLOW" in t for t in texts):
+            self.entered.set()
+            assert self.release.wait(10)
+        return super().encode(texts, **kw)
+
+
+def make_store(enc):
+    vs = VectorStore(cache_dir="", model=enc)
+    vs.build(make_chunks(TEXTS))
+    return vs
+
+
+def test_concurrent_retrieves_are_coalesced():
+    enc = HashEncoder()
+    vs = make_store(enc)
+    server = RetrievalServer(vs, "unused.index", max_batch=64, max_wait_ms=100)
+    queries = [f"{w} question" for w in ("jdbc", "cloud", "qubits", "bm25", "java", "demand", "term", "scales")]
+    expected = vs.retrieve(queries, 2, "dense")
+    enc.calls = 0
+
+    results = [None] * len(queries)
+
+    def ask(i):
+        results[i] = server.submit("retrieve", [queries[i]], 2, "dense", None)[0]
+
+    threads = [threading.Thread(target=ask, args=(i,)) for i in range(len(queries))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert enc.calls < len(queries)
+    assert [[h["id"] for h in r] for r in results] == [[h["id"] for h in r] for r in expected]
+
+    # encode requests are split back per caller
+    a, b = [None], [None]
+    ta = threading.Thread(target=lambda: a.__setitem__(0, server.submit("encode", ["x y", "z"])))
+    tb = threading.Thread(target=lambda: b.__setitem__(0, server.submit("encode", ["w"])))
+    ta.start(), tb.start(), ta.join(), tb.join()
+    assert a[0].shape[0] == 2 and b[0].shape[0] == 1
+    assert np.allclose(b[0], vs.encode(["w"]))
+
+
+def test_sync_does_not_stall_retrieves(tmp_path):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "a.md").write_text("Java database connectivity with JDBC.", encoding="utf-8")
+    (docs / "slow.md").write_text("SLOW quantum computers use qubits.", encoding="utf-8")
+    enc = GatedEncoder()
+    vs = make_store(enc)
+    server = RetrievalServer(vs, str(tmp_path / "faiss.index"), max_wait_ms=1)
+
+    stats = {}
+    syncer = threading.Thread(target=lambda: stats.update(server.submit("sync", str(docs), "")))
+    syncer.start()
+    assert enc.entered.wait(10)
+    # the sync is blocked mid-encode; searches are still answered from the old store
+    hits = server.submit("retrieve", ["jdbc databases"], 2, "dense", None)[0]
+    assert server.vs is vs and hits[0]["text"] == TEXTS[0]
+    enc.release.set()
+    syncer.join(10)
+
+    assert stats["total_vectors"] == 2
+    assert server.vs is not vs and server.vs.ntotal == 2
+    assert server.submit("info")["ntotal"] == 2
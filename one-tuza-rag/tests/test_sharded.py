@@ -0,0 +1,117 @@
+# test_sharded.py
+import os
+import socket
+from conftest import HashEncoder
+from filters import SearchFilter
+from vectorstore import VectorStore, sync_index
+from sharded import ShardedVectorStore, launch_shard_servers, shard_of
+
+DOCS = {
+    "jdbc.md": "Java database connectivity with JDBC drivers.",
+    "pool.txt": "JDBC connection pools reuse database connections.",
+    "cloud.md": "Cloud computing scales on demand.",
+    "scale.txt": "Autoscaling adds cloud servers under load.",
+    "quantum.md": "Quantum computers use qubits.",
+    "bm25.txt": "BM25 ranks documents by term frequency.",
+}
+QUERIES = ["jdbc database", "cloud scaling", "qubits", "ranking documents"]
+N_SHARDS = 3
+
+
+def write_docs(folder):
+    folder.mkdir()
+    for fn, text in DOCS.items():
+        (folder / fn).write_text(text, encoding="utf-8")
+    return str(folder)
+
+
+def ranked(hit_lists):
+    # ties may come back in either order from the merge
+    return [sorted((-round(h["score"], 5), h["id"]) for h in hits) for hits in hit_lists]
+
+
+def test_sharded_search_matches_single_store(tmp_path):
+    docs = write_docs(tmp_path / "docs")
+    single = VectorStore(cache_dir="", index_type="flat", model=HashEncoder())
+    sync_index(single, docs, str(tmp_path / "faiss.index"))
+    sharded = ShardedVectorStore(str(tmp_path / "shards"), n_shards=N_SHARDS, cache_dir="",
+                                 index_type="flat", model=HashEncoder())
+    stats = sharded.sync(docs)
+    assert stats["total_vectors"] == single.ntotal == len(DOCS)
+    assert len({shard_of(fn, N_SHARDS) for fn in DOCS}) > 1  # the corpus really is split
+    k = len(DOCS)  # no cut-off, so ties cannot select different hits
+    assert ranked(sharded.retrieve(QUERIES, top_k=k, mode="dense")) == \
+        ranked(single.retrieve(QUERIES, top_k=k, mode="dense"))
+
+
+def test_change_rebuilds_only_the_owning_shard(tmp_path):
+    docs = write_docs(tmp_path / "docs")
+    shard_dir = str(tmp_path / "shards")
+    ShardedVectorStore(shard_dir, n_shards=N_SHARDS, cache_dir="", model=HashEncoder()).sync(docs)
+
+    (tmp_path / "docs" / "quantum.md").write_text("Quantum computers entangle qubits.", encoding="utf-8")
+    enc = HashEncoder()
+    store = ShardedVectorStore(shard_dir, cache_dir="", model=enc)
+    stats = store.sync(docs)
+    assert stats["changed"] == 1 and stats["unchanged"] == len(DOCS) - 1
+    assert stats["shards_rebuilt"] == [shard_of("quantum.md", N_SHARDS)]
+    assert enc.texts_encoded == 1
+    assert store.query("entangle", top_k=1)[0]["source"] == "quantum.md"
+
+
+def test_filters_apply_across_shards(tmp_path):
+    docs = write_docs(tmp_path / "docs")
+    store = ShardedVectorStore(str(tmp_path / "shards"), n_shards=N_SHARDS, cache_dir="", model=HashEncoder())
+    store.sync(docs)
+    sources = ["pool.txt", "cloud.md", "quantum.md"]
+    assert len({shard_of(s, N_SHARDS) for s in sources}) > 1
+    for mode in ("dense", "lexical", "hybrid"):
+        hits = store.retrieve(["jdbc database cloud qubits"], top_k=5, mode=mode,
+                              filters=SearchFilter(sources=sources))[0]
+        assert hits and {h["source"] for h in hits} <= set(sources), mode
+        hits = store.retrieve(["jdbc cloud"], top_k=5, mode=mode, filters=SearchFilter(extensions=["txt"]))[0]
+        assert hits and all(h["source"].endswith(".txt") for h in hits), mode
+    assert store.filter_options()["sources"] == sorted(DOCS)
+
+
+def free_base_port(n: int) -> int:
+    """A port p such that p .. p + n - 1 are currently free on localhost."""
+    while True:
+        with socket.socket() as s:
+            s.bind(("localhost", 0))
+            base = s.getsockname()[1]
+        if base + n > 65535:
+            continue
+        try:
+            for p in range(base, base + n):
+                with socket.socket() as s:
+                    s.bind(("localhost", p))
+            return base
+        except OSError:
+            continue
+
+
+def test_shard_servers_round_trip(tmp_path):
+    docs = write_docs(tmp_path / "docs")
+    shard_dir = str(tmp_path / "shards")
+    local = ShardedVectorStore(shard_dir, n_shards=2, cache_dir="", model=HashEncoder())
+    local.sync(docs)
+
+    # serve_shard is a module-level function of sharded.py, so the spawned
+    # children never re-run this test module
+    addresses, procs = launch_shard_servers(shard_dir, port=free_base_port(2))
+    try:
+        remote = ShardedVectorStore(shard_dir, addresses=addresses, cache_dir="", model=HashEncoder())
+        assert remote.ntotal == len(DOCS)
+        k = len(DOCS)
+        assert ranked(remote.retrieve(QUERIES, top_k=k, mode="dense")) == \
+            ranked(local.retrieve(QUERIES, top_k=k, mode="dense"))
+        for c in remote.clients:
+            assert c.call("shutdown") is None
+    finally:
+        for p in procs:
+            p.join(10)
+            if p.is_alive():
+                p.terminate()
+    assert all(p.exitcode == 0 for p in procs)
+    assert os.path.exists(os.path.join(shard_dir, "authkey"))
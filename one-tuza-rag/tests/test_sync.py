@@ -0,0 +1,76 @@
+# test_sync.py
+import os
+from conftest import HashEncoder
+from vectorstore import VectorStore, sync_index
+
+
+def write(path, text, mtime=None):
+    path.write_text(text, encoding="utf-8")
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+def test_sync_counts_added_changed_removed(tmp_path):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    index = str(tmp_path / "faiss.index")
+    write(docs / "a.md", "Java database connectivity with JDBC.", 1_000_000)
+    write(docs / "b.md", "Cloud computing scales on demand.", 1_000_000)
+    write(docs / "c.md", "Quantum computers use qubits.", 1_000_000)
+
+    enc = HashEncoder()
+    stats = sync_index(VectorStore(cache_dir="", model=enc), str(docs), index)
+    assert (stats["added"], stats["changed"], stats["removed"], stats["unchanged"]) == (3, 0, 0, 0)
+    assert stats["total_vectors"] == 3
+
+    write(docs / "b.md", "Cloud computing scales elastically on demand.", 2_000_000)
+    (docs / "c.md").unlink()
+    write(docs / "d.md", "Vector databases index embeddings.", 2_000_000)
+    write(docs / "a.md", "Java database connectivity with JDBC.", 3_000_000)  # touched, same content
+
+    enc = HashEncoder()
+    vs = VectorStore(cache_dir="", model=enc)
+    stats = sync_index(vs, str(docs), index)
+    assert (stats["added"], stats["changed"], stats["removed"], stats["unchanged"]) == (1, 1, 1, 1)
+    # only the new and the edited file are embedded again
+    assert stats["chunks_embedded"] == 2 and enc.texts_encoded == 2
+    assert stats["total_vectors"] == 3
+    assert {h["source"] for h in vs.query("quantum qubits", top_k=3)} == {"a.md", "b.md", "d.md"}
+
+    stats = sync_index(VectorStore(cache_dir="", model=HashEncoder()), str(docs), index)
+    assert (stats["added"], stats["changed"], stats["removed"], stats["unchanged"]) == (0, 0, 0, 3)
+    assert stats["chunks_embedded"] == 0
+
+
+def test_unreadable_file_is_rechunked_after_a_config_change(tmp_path, monkeypatch):
+    import ingest
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    write(docs / "a.md", "Java database connectivity with JDBC.", 1_000_000)
+    write(docs / "b.md", "Cloud computing scales on demand.", 1_000_000)
+    manifest = ingest.ingest_changed_documents(str(docs), {}, workers=1).manifest
+
+    # new chunker settings, and b.md cannot be read during the re-chunk
+    monkeypatch.setattr(ingest, "chunker_config", lambda: {"strategy": "changed"})
+    read = ingest.read_document_blocks
+
+    def flaky_read(path):
+        if path.endswith("b.md"):
+            raise OSError("locked")
+        return read(path)
+
+    monkeypatch.setattr(ingest, "read_document_blocks", flaky_read)
+    delta = ingest.ingest_changed_documents(str(docs), manifest, workers=1)
+    assert delta.changed == ["a.md"] and delta.stale_sources == ["a.md"]
+    manifest = delta.manifest
+    assert manifest["files"]["b.md"]["rechunk"] and "rechunk" not in manifest["files"]["a.md"]
+
+    # still unreadable: stays flagged
+    manifest = ingest.ingest_changed_documents(str(docs), manifest, workers=1).manifest
+    assert manifest["files"]["b.md"]["rechunk"]
+
+    # readable again: re-chunked under the new config even though it is unchanged on disk
+    monkeypatch.setattr(ingest, "read_document_blocks", read)
+    delta = ingest.ingest_changed_documents(str(docs), manifest, workers=1)
+    assert delta.changed == ["b.md"] and delta.unchanged == ["a.md"] and delta.chunks
+    assert "rechunk" not in delta.manifest["files"]["b.md"]
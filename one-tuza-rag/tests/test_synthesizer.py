@@ -0,0 +1,16 @@
+# test_synthesizer.py
+import synthesizer
+from synthesizer import build_report, pack_prompt_sources, report_sources
+
+
+def test_offline_summary_lists_every_source(monkeypatch):
+    monkeypatch.setattr(synthesizer, "OPENAI_KEY", None)
+    text = "JDBC lets Java programs talk to relational databases through drivers."
+    local = [{"id": f"{s}__chunk_1", "source": s, "text": text, "score": 1.0} for s in ("a.md", "b.md")]
+    # the packer drops the duplicate from the prompt ...
+    packed, _ = pack_prompt_sources(report_sources(local, []))
+    assert len(packed) == 1
+    # ... but the offline summary and the citations keep both
+    report = build_report("what is jdbc", [], local, [])
+    assert "(Local:a.md)" in report["summary_markdown"] and "(Local:b.md)" in report["summary_markdown"]
+    assert [c["label"] for c in report["citations"]] == ["Local:a.md", "Local:b.md"]
@@ -0,0 +1,74 @@
+# test_web_search.py
+import json
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import pytest
+import web_search
+
+TITLES = ["Alpha", "Beta", "Gamma", "Delta", "Epsilon", "Zeta"]
+
+
+class WikiStub(BaseHTTPRequestHandler):
+    """MediaWiki API stub: list=search returns TITLES; extracts sleep per title."""
+    delays = {}
+    empty = set()
+
+    def do_GET(self):
+        q = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+        if q.get("list") == "search":
+            body = {"query": {"search": [{"title": t} for t in TITLES]}}
+        else:
+            title = q["titles"]
+            time.sleep(self.delays.get(title, 0))
+            text = "" if title in self.empty else f"{title} is a test article."
+            body = {"query": {"pages": [{"title": title, "extract": text}]}}
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def wiki(monkeypatch, tmp_path):
+    server = ThreadingHTTPServer(("localhost", 0), WikiStub)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(web_search, "WIKIPEDIA_API_URL", f"http://localhost:{server.server_address[1]}/w/api.php")
+    monkeypatch.setattr(web_search, "CACHE", web_search.ResponseCache(str(tmp_path)))
+    WikiStub.delays, WikiStub.empty = {}, set()
+    yield WikiStub
+    server.shutdown()
+    server.server_close()
+
+
+def titles(results):
+    return [r["title"] for r in results]
+
+
+def test_slow_top_rank_is_kept(wiki):
+    wiki.delays = {"Alpha": 0.5}
+    assert titles(web_search.wikipedia_search("q", max_results=3)) == ["Alpha", "Beta", "Gamma"]
+    # complete, deterministic results are cached
+    assert web_search.CACHE.get("wikipedia", "q", 3) is not None
+
+
+def test_failed_rank_falls_back_to_next(wiki):
+    wiki.empty = {"Beta"}
+    assert titles(web_search.wikipedia_search("q", max_results=3)) == ["Alpha", "Gamma", "Delta"]
+
+
+def test_deadline_returns_best_found_and_skips_cache(wiki, monkeypatch):
+    monkeypatch.setattr(web_search, "WEB_DEADLINE", 0.5)
+    wiki.delays = {"Alpha": 3}
+    t0 = time.monotonic()
+    results = web_search.wikipedia_search("q", max_results=3)
+    assert time.monotonic() - t0 < 2
+    assert titles(results) == ["Beta", "Gamma", "Delta"]
+    assert web_search.CACHE.get("wikipedia", "q", 3) is None
@@ -1,63 +1,533 @@
 # vectorstore.py
 import os
+import math
+import uuid
+import threading
 import numpy as np
 import faiss
 from sentence_transformers import SentenceTransformer
 import pickle
-from typing import List
-from ingest import DocumentChunk
+from typing import List, Dict, Optional, Tuple
+from ingest import DocumentChunk, ingest_changed_documents, load_manifest, save_manifest
+from embedding_cache import EmbeddingCache
+from chunkstore import ChunkStore, write_chunk_store
+from bm25 import BM25Index
+from telemetry import span, traced, incr
+from filters import FilterIndex, SearchFilter, Selection, load_tags
+from index_factory import (INDEX_TYPE, INDEX_NPROBE, INDEX_EF_SEARCH, make_index, effective_type,
+                           set_search_params, search_parameters, pushes_down_filters,
+                           supports_positional_remove)
 
 EMB_MODEL_NAME = os.getenv("EMB_MODEL_NAME", "all-MiniLM-L6-v2")
 EMB_DIM = 384  # for all-MiniLM-L6-v2
+# on-disk embedding cache; set EMB_CACHE_DIR="" to disable
+EMB_CACHE_DIR = os.getenv("EMB_CACHE_DIR", ".emb_cache")
+EMB_CACHE_MAX_ENTRIES = int(os.getenv("EMB_CACHE_MAX_ENTRIES", "200000"))
+# dense | lexical | hybrid
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+# weight of the dense score in hybrid retrieval (1 - alpha goes to BM25)
+HYBRID_ALPHA = float(os.getenv("HYBRID_ALPHA", "0.5"))
 
 class VectorStore:
-    def __init__(self, model_name: str = EMB_MODEL_NAME):
-        self.model = SentenceTransformer(model_name)
+    def __init__(self, model_name: str = EMB_MODEL_NAME, cache_dir: str = EMB_CACHE_DIR,
+                 index_type: str = INDEX_TYPE, model=None):
+        """
+        `model` overrides the SentenceTransformer (any object with encode()).
+        The model is loaded on first use, so lexical-only queries never load it.
+        """
+        self.model_name = model_name
+        self.index_type = index_type
+        self._model = model
+        self._cache_dir = cache_dir
+        self._cache = None
+        self._cache_lock = threading.Lock()
         self.index = None
-        self.id_to_meta = {}
-        self.emb_dim = self.model.get_sentence_embedding_dimension()
+        self.bm25 = None
+        self._mmapped = False
+        self._chunk_store: Optional[ChunkStore] = None  # mapped columns of the loaded index, if any
+        # changes whenever the indexed content does; caches keyed on it go stale
+        self.revision = None
+        # tags per source (from <docs>/tags.json) and the filter bitmaps built from the columns
+        self.tags: Dict[str, List[str]] = {}
+        self._filter_index = None
 
-    def build(self, chunks: List[DocumentChunk]):
-        texts = [c.text for c in chunks]
-        ids = [c.id for c in chunks]
-        metas = [{"source": c.source, "id": c.id} for c in chunks]
+    @property
+    def model(self):
+        if self._model is None:
+            self._model = SentenceTransformer(self.model_name)
+        return self._model
+
+    @property
+    def emb_dim(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    @property
+    def cache(self):
+        if self._cache is None and self._cache_dir:
+            with self._cache_lock:
+                # sessions sharing this store may ask for it at the same time
+                if self._cache is None:
+                    self._cache = EmbeddingCache(self._cache_dir, self.model_name, self.emb_dim,
+                                                 EMB_CACHE_MAX_ENTRIES)
+        return self._cache
+
+    @property
+    def ntotal(self) -> int:
+        return self.index.ntotal if self.index is not None else 0
 
-        emb = self.model.encode(texts, convert_to_numpy=True, show_progress_bar=True)
-        self.index = faiss.IndexFlatIP(self.emb_dim)
+    @property
+    def effective_index_type(self) -> Optional[str]:
+        """Type of the index actually built; small corpora fall back to flat."""
+        return effective_type(self.index) if self.index is not None else None
+
+    def encode(self, texts: List[str], show_progress_bar: bool = False, use_cache: bool = False) -> np.ndarray:
+        """
+        Encode texts into L2-normalized float32 vectors. With `use_cache`
+        (chunk texts), cached embeddings are reused and only texts not seen
+        before go through the model; queries bypass the cache so they neither
+        pay for it nor evict chunk vectors. Call flush_cache() when done.
+        """
+        if not use_cache or self.cache is None:
+            with span("embed.encode", texts=len(texts)):
+                emb = self.model.encode(texts, convert_to_numpy=True, show_progress_bar=show_progress_bar)
+            incr("rag_texts_embedded_total", len(texts))
+        else:
+            emb, missing = self.cache.get_many(texts)
+            incr("rag_embedding_cache_hits_total", len(texts) - len(missing))
+            incr("rag_embedding_cache_misses_total", len(missing))
+            if missing:
+                todo = [texts[i] for i in missing]
+                with span("embed.encode", texts=len(todo)):
+                    new = self.model.encode(todo, convert_to_numpy=True, show_progress_bar=show_progress_bar)
+                incr("rag_texts_embedded_total", len(todo))
+                emb[missing] = new
+                self.cache.put_many(todo, new)
+        emb = np.ascontiguousarray(emb, dtype=np.float32)
         # normalize vectors to use inner product as cosine
         faiss.normalize_L2(emb)
-        self.index.add(emb)
-        for i, mid in enumerate(ids):
-            self.id_to_meta[mid] = metas[i]
-        # store embeddings mapping for retrieval of the text if needed
+        return emb
+
+    def encode_queries(self, queries: List[str], emb_q: Optional[np.ndarray] = None) -> np.ndarray:
+        """encode(queries), reusing `emb_q` as the vectors of the first len(emb_q) queries."""
+        if emb_q is None or not len(emb_q):
+            return self.encode(queries)
+        emb_q = np.atleast_2d(np.asarray(emb_q, dtype=np.float32))[:len(queries)]
+        if len(emb_q) == len(queries):
+            return emb_q
+        return np.vstack([emb_q, self.encode(queries[len(emb_q):])])
+
+    def flush_cache(self):
+        """Persist the embedding cache (once per build/update, not per encode)."""
+        if self._cache is not None:
+            self._cache.flush()
+
+    @traced("vectorstore.build")
+    def build(self, chunks: List[DocumentChunk]):
+        texts = [c.text for c in chunks]
+        emb = self.encode(texts, show_progress_bar=True, use_cache=True)
+        self.flush_cache()
+        self.index = make_index(self.index_type, emb)
+        self._mmapped = False
+        # chunk columns, aligned with index positions
         self._texts = texts
-        self._ids = ids
-        print(f"[vectorstore] Built index with {len(ids)} vectors.")
+        self._ids = [c.id for c in chunks]
+        self._sources = [c.source for c in chunks]
+        self._locs = chunk_locs(chunks)
+        self._headings = [c.heading for c in chunks]
+        self._ingested = np.array([c.ingested for c in chunks], dtype=np.int64)
+        self._filter_index = None
+        with span("bm25.build", docs=len(texts)):
+            self.bm25 = BM25Index.build(texts)
+        self.revision = uuid.uuid4().hex
+        print(f"[vectorstore] Built {self.effective_index_type} index with {len(self._ids)} vectors.")
+
+    @traced("vectorstore.update")
+    def update(self, chunks: List[DocumentChunk], stale_sources: List[str]):
+        """
+        Incrementally apply an ingest delta: drop the vectors of `stale_sources`
+        (changed or deleted files) and append vectors for `chunks` only.
+        """
+        if self.index is None:
+            self.build(chunks)
+            return
+        if self._mmapped:
+            # a memory-mapped index is read-only; reload it into RAM to modify it
+            self.index = faiss.read_index(self._path)
+            self._mmapped = False
+        # materialize the (possibly memory-mapped) columns
+        texts, ids, sources = list(self._texts), list(self._ids), list(self._sources)
+        locs, headings, ingested = np.array(self._locs), list(self._headings), np.array(self._ingested)
+        stale = set(stale_sources)
+        drop = [i for i, src in enumerate(sources) if src in stale]
+        positional = supports_positional_remove(self.index)
+        if drop:
+            if positional:
+                # IndexFlat compacts on removal, so positions stay aligned with the columns
+                self.index.remove_ids(np.array(drop, dtype="int64"))
+            dropped = set(drop)
+            keep = [i for i in range(len(ids)) if i not in dropped]
+            texts = [texts[i] for i in keep]
+            ids = [ids[i] for i in keep]
+            sources = [sources[i] for i in keep]
+            locs = locs[keep]
+            headings = [headings[i] for i in keep]
+            ingested = ingested[keep]
+        if chunks:
+            new_texts = [c.text for c in chunks]
+            if positional:
+                self.index.add(self.encode(new_texts, show_progress_bar=True, use_cache=True))
+            texts += new_texts
+            ids += [c.id for c in chunks]
+            sources += [c.source for c in chunks]
+            locs = np.concatenate([locs, chunk_locs(chunks)])
+            headings += [c.heading for c in chunks]
+            ingested = np.concatenate([ingested, np.array([c.ingested for c in chunks], dtype=np.int64)])
+        self._texts, self._ids, self._sources = texts, ids, sources
+        self._locs, self._headings, self._ingested = locs, headings, ingested
+        self._filter_index = None
+        if not positional and (drop or chunks):
+            # IVF/HNSW keep sparse ids after removal (HNSW cannot remove at all):
+            # re-add everything, keeping the trained quantizers. Unchanged
+            # chunks come straight from the embedding cache.
+            self.index.reset()
+            self.index.add(self.encode(self._texts, show_progress_bar=True, use_cache=True))
+        self.flush_cache()
+        if drop or chunks:
+            # postings are immutable and compact; re-indexing text is cheap next to embedding
+            with span("bm25.build", docs=len(self._texts)):
+                self.bm25 = BM25Index.build(self._texts)
+            self.revision = uuid.uuid4().hex
+        print(f"[vectorstore] Updated index: -{len(drop)} +{len(chunks)} vectors ({self.index.ntotal} total).")
+
+    def fresh(self) -> "VectorStore":
+        """An empty store sharing this one's model and embedding cache."""
+        vs = VectorStore(self.model_name, self._cache_dir, self.index_type, model=self._model)
+        vs._cache = self._cache
+        return vs
 
     def save(self, path: str = "faiss.index"):
-        faiss.write_index(self.index, path)
-        with open(path + ".meta.pkl", "wb") as f:
-            pickle.dump({"id_to_meta": self.id_to_meta, "texts": self._texts, "ids": self._ids}, f)
-        print(f"[vectorstore] saved to {path} (+meta)")
-
-    def load(self, path: str = "faiss.index"):
-        self.index = faiss.read_index(path)
-        with open(path + ".meta.pkl", "rb") as f:
-            d = pickle.load(f)
-        self.id_to_meta = d["id_to_meta"]
-        self._texts = d["texts"]
-        self._ids = d["ids"]
+        # write aside and swap: other stores may be searching a memory map of `path`
+        faiss.write_index(self.index, path + ".tmp")
+        os.replace(path + ".tmp", path)
+        write_chunk_store(path + ".chunks", self._ids, self._sources, self._texts,
+                          meta={"index_type": self.index_type, "effective_index_type": self.effective_index_type,
+                                "model": self.model_name,
+                                "revision": self.revision, "tags": self.tags},
+                          locs=self._locs, headings=self._headings, ingested=self._ingested)
+        if self.bm25 is not None:
+            self.bm25.save(path + ".bm25")
+        print(f"[vectorstore] saved to {path} (+chunks)")
+
+    def load(self, path: str = "faiss.index", mmap: bool = True):
+        """
+        Open a saved index. With mmap=True the chunk store (and the FAISS index,
+        where the index type supports it) is memory-mapped, so startup cost does
+        not grow with corpus size and only queried rows are read.
+        """
+        self._path = path
+        self._mmapped = False
+        self.index = None
+        if mmap:
+            try:
+                self.index = faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+                self._mmapped = True
+            except RuntimeError:
+                pass  # index type cannot be mapped
+        if self.index is None:
+            self.index = faiss.read_index(path)
+
+        # a reload drops the previous chunk store's maps (a rewrite replaced its files)
+        if self._chunk_store is not None:
+            self._chunk_store.close()
+            self._chunk_store = None
+        if os.path.isdir(path + ".chunks"):
+            store = ChunkStore(path + ".chunks")
+            if not mmap:
+                self._texts, self._ids, self._sources = list(store.texts), list(store.ids), list(store.sources)
+            else:
+                self._texts, self._ids, self._sources = store.texts, store.ids, store.sources
+            n = len(store)
+            self._locs = store.locs if store.locs is not None else np.full((n, 3), -1, dtype=np.int64)
+            self._headings = store.headings if store.headings is not None else [""] * n
+            self._ingested = store.ingested if store.ingested is not None else np.full(n, -1, dtype=np.int64)
+            if not mmap:
+                self._locs, self._headings = np.array(self._locs), list(self._headings)
+                self._ingested = np.array(self._ingested)
+                store.close()
+            else:
+                self._chunk_store = store
+            self.index_type = store.meta.get("index_type", "flat")
+            self.revision = store.meta.get("revision")
+            self.tags = store.meta.get("tags", {})
+        else:
+            # legacy pickle sidecar; rewritten as a chunk store on the next save()
+            with open(path + ".meta.pkl", "rb") as f:
+                d = pickle.load(f)
+            self._texts = d["texts"]
+            self._ids = d["ids"]
+            self._sources = [d["id_to_meta"][i]["source"] for i in d["ids"]]
+            self._locs = np.full((len(self._ids), 3), -1, dtype=np.int64)
+            self._headings = [""] * len(self._ids)
+            self._ingested = np.full(len(self._ids), -1, dtype=np.int64)
+            self.index_type = d.get("index_type", "flat")
+            self.revision = None
+            self.tags = {}
+        self._filter_index = None
+        if self.revision is None:
+            st = os.stat(path)
+            self.revision = f"{st.st_mtime_ns:x}-{st.st_size:x}"
+        self.bm25 = BM25Index.load(path + ".bm25", mmap=mmap) if os.path.isdir(path + ".bm25") else None
         print("[vectorstore] loaded index and metadata")
 
-    def query(self, q: str, top_k: int = 5):
-        emb_q = self.model.encode([q], convert_to_numpy=True)
-        faiss.normalize_L2(emb_q)
-        D, I = self.index.search(emb_q, top_k)
-        results = []
-        for score, idx in zip(D[0], I[0]):
-            if idx < 0 or idx >= len(self._ids):
-                continue
-            doc_id = self._ids[idx]
-            meta = self.id_to_meta.get(doc_id, {})
-            results.append({"id": doc_id, "source": meta.get("source"), "text": self._texts[idx], "score": float(score)})
-        return results
\ No newline at end of file
+    # ------------------------
+    # Filters
+    # ------------------------
+    @property
+    def filter_index(self) -> FilterIndex:
+        if self._filter_index is None:
+            with span("filters.build", rows=len(self._ids)):
+                self._filter_index = FilterIndex(self._sources, np.asarray(self._locs)[:, 0], self._ingested,
+                                                 self.tags)
+        return self._filter_index
+
+    def set_tags(self, tags: Dict[str, List[str]]):
+        self.tags = tags
+        self._filter_index = None
+        self.revision = uuid.uuid4().hex
+
+    def filter_options(self) -> Dict[str, List[str]]:
+        """Values the sidebar can filter on: sources, extensions, tags."""
+        if self.index is None:
+            return {"sources": [], "extensions": [], "tags": []}
+        return self.filter_index.options()
+
+    def _select(self, filters: Optional[SearchFilter]) -> Optional[Selection]:
+        if filters is None or filters.is_empty() or self.index is None:
+            return None
+        sel = self.filter_index.select(filters)
+        incr("rag_filtered_queries_total")
+        return sel
+
+    def _search(self, emb_q: np.ndarray, k: int, sel: Optional[Selection], nprobe: int = INDEX_NPROBE,
+                ef_search: int = INDEX_EF_SEARCH) -> Tuple[np.ndarray, np.ndarray]:
+        """index.search, restricted to `sel` inside FAISS where the index supports it."""
+        if sel is None or pushes_down_filters(self.index):
+            # the selector only reads `sel.bitmap`, which outlives the search
+            selector = faiss.IDSelectorBitmap(sel.n, faiss.swig_ptr(sel.bitmap)) if sel is not None else None
+            return self.index.search(emb_q, k, params=search_parameters(self.index, selector, nprobe, ef_search, k))
+        # no pushdown (binary): over-fetch in proportion to the selectivity, then drop unselected rows
+        k_all = max(k, min(self.index.ntotal, 2 * math.ceil(k * sel.n / max(sel.count, 1))))
+        D, I = self.index.search(emb_q, k_all, params=search_parameters(self.index, k=k_all))
+        mask = sel.mask
+        D_out, I_out = np.full((len(emb_q), k), -np.inf, dtype=np.float32), np.full((len(emb_q), k), -1, dtype=np.int64)
+        for qi in range(len(emb_q)):
+            keep = [j for j, i in enumerate(I[qi]) if i >= 0 and mask[i]][:k]
+            D_out[qi, :len(keep)], I_out[qi, :len(keep)] = D[qi, keep], I[qi, keep]
+        return D_out, I_out
+
+    # ------------------------
+    # Query
+    # ------------------------
+    def search_vectors(self, emb_q: np.ndarray, top_k: int = 5, nprobe: int = INDEX_NPROBE,
+                       ef_search: int = INDEX_EF_SEARCH, filters: Optional[SearchFilter] = None) -> List[List[Dict]]:
+        """One batched FAISS search over normalized query vectors; one hit list per row."""
+        sel = self._select(filters)
+        if sel is not None and sel.count == 0:
+            return [[] for _ in emb_q]
+        set_search_params(self.index, nprobe=nprobe, ef_search=ef_search)
+        with span("faiss.search", queries=len(emb_q), top_k=top_k, filtered=sel is not None):
+            D, I = self._search(emb_q, top_k, sel, nprobe, ef_search)
+        out = []
+        n = len(self._ids)
+        for scores, idxs in zip(D, I):
+            results = []
+            for score, idx in zip(scores, idxs):
+                if idx < 0 or idx >= n:
+                    continue
+                results.append(self._hit(int(idx), float(score)))
+            out.append(results)
+        return out
+
+    def _hit(self, idx: int, score: float, **extra) -> Dict:
+        # only the returned rows are decoded from the chunk store
+        hit = {"id": self._ids[idx], "source": self._sources[idx], "text": self._texts[idx], "score": score}
+        page, start, end = (int(x) for x in self._locs[idx])
+        if page >= 0:
+            hit["page"] = page
+        if start >= 0:
+            hit["char_start"], hit["char_end"] = start, end
+        if self._headings[idx]:
+            hit["heading"] = self._headings[idx]
+        hit.update(extra)
+        return hit
+
+    def query_batch(self, queries: List[str], top_k: int = 5, nprobe: int = INDEX_NPROBE,
+                    ef_search: int = INDEX_EF_SEARCH, filters: Optional[SearchFilter] = None,
+                    emb_q: Optional[np.ndarray] = None) -> List[List[Dict]]:
+        """
+        Encode all queries in one forward pass and search them in one FAISS
+        call. `emb_q` holds already-encoded vectors of the leading queries.
+        """
+        if not queries:
+            return []
+        with span("vectorstore.query", queries=len(queries)):
+            return self.search_vectors(self.encode_queries(queries, emb_q), top_k, nprobe, ef_search, filters)
+
+    def query(self, q: str, top_k: int = 5, nprobe: int = INDEX_NPROBE, ef_search: int = INDEX_EF_SEARCH,
+              filters: Optional[SearchFilter] = None):
+        """nprobe (IVF) and ef_search (HNSW) trade recall for latency; ignored by flat indexes."""
+        return self.query_batch([q], top_k, nprobe, ef_search, filters)[0]
+
+    def lexical_query_batch(self, queries: List[str], top_k: int = 5,
+                            filters: Optional[SearchFilter] = None) -> List[List[Dict]]:
+        """BM25-only retrieval; never loads the embedding model."""
+        sel = self._select(filters)
+        mask = sel.mask if sel is not None else None
+        out = []
+        with span("bm25.search", queries=len(queries)):
+            for q in queries:
+                docs, scores = self.bm25.search(q, top_k, mask=mask)
+                out.append([self._hit(int(d), float(s)) for d, s in zip(docs, scores)])
+        return out
+
+    def hybrid_query_batch(self, queries: List[str], top_k: int = 5, alpha: float = HYBRID_ALPHA,
+                           filters: Optional[SearchFilter] = None,
+                           emb_q: Optional[np.ndarray] = None) -> List[List[Dict]]:
+        """
+        Dense + BM25 in one call: both retrievers over-fetch candidates, scores
+        are min-max normalized per query over the union and blended as
+        alpha * dense + (1 - alpha) * lexical. Lexical-only candidates get their
+        exact cosine score from the stored vector where the index can reconstruct it.
+        """
+        if self.bm25 is None:
+            return self.query_batch(queries, top_k, filters=filters, emb_q=emb_q)
+        sel = self._select(filters)
+        if sel is not None and sel.count == 0:
+            return [[] for _ in queries]
+        mask = sel.mask if sel is not None else None
+        n_cand = max(top_k * 4, 20)
+        emb_q = self.encode_queries(queries, emb_q)
+        set_search_params(self.index, nprobe=INDEX_NPROBE, ef_search=INDEX_EF_SEARCH)
+        with span("faiss.search", queries=len(queries), top_k=n_cand, filtered=sel is not None):
+            D, I = self._search(emb_q, n_cand, sel)
+        out = []
+        with span("bm25.search", queries=len(queries)):
+            for qi, q in enumerate(queries):
+                dense = {int(i): float(s) for s, i in zip(D[qi], I[qi]) if i >= 0}
+                docs, scores = self.bm25.search(q, n_cand, mask=mask)
+                lexical = {int(d): float(s) for d, s in zip(docs, scores)}
+                for d in lexical.keys() - dense.keys():
+                    try:
+                        dense[d] = float(np.dot(self.index.reconstruct(d), emb_q[qi]))
+                    except RuntimeError:
+                        pass  # index cannot reconstruct (e.g. IVF without direct map)
+                out.append([self._hit(d, s, dense_score=dense.get(d), lexical_score=lexical.get(d))
+                            for s, d in blend_scores(dense, lexical, alpha)[:top_k]])
+        return out
+
+    def retrieve(self, queries: List[str], top_k: int = 5, mode: str = RETRIEVAL_MODE,
+                 filters: Optional[SearchFilter] = None, emb_q: Optional[np.ndarray] = None) -> List[List[Dict]]:
+        """
+        Dispatch on retrieval mode: "dense", "lexical" or "hybrid". `filters`
+        restricts every mode to the matching rows before ranking. `emb_q`
+        (vectors of the leading queries, e.g. from a cache lookup) saves
+        encoding them again.
+        """
+        if not queries:
+            return []
+        if mode == "lexical" and self.bm25 is not None:
+            return self.lexical_query_batch(queries, top_k, filters)
+        if mode == "hybrid":
+            return self.hybrid_query_batch(queries, top_k, filters=filters, emb_q=emb_q)
+        return self.query_batch(queries, top_k, filters=filters, emb_q=emb_q)
+
+
+def chunk_locs(chunks: List[DocumentChunk]) -> np.ndarray:
+    """(n, 3) int64 rows of (page, char_start, char_end); -1 where unknown."""
+    return np.array([(c.page if c.page is not None else -1, c.char_start, c.char_end) for c in chunks],
+                    dtype=np.int64).reshape(-1, 3)
+
+
+def blend_scores(dense: Dict, lexical: Dict, alpha: float = HYBRID_ALPHA) -> List[Tuple[float, object]]:
+    """
+    (blended score, key) over the union of dense and lexical candidates, best
+    first: dense scores are min-max normalized, BM25 scores divided by their
+    max, then mixed as alpha * dense + (1 - alpha) * lexical. A key missing
+    on one side scores 0 there.
+    """
+    d_lo = min(dense.values(), default=0.0)
+    d_span = (max(dense.values(), default=0.0) - d_lo) or 1.0
+    l_max = max(lexical.values(), default=0.0) or 1.0
+    fused = []
+    for d in dense.keys() | lexical.keys():
+        ds = (dense[d] - d_lo) / d_span if d in dense else 0.0
+        ls = lexical.get(d, 0.0) / l_max
+        fused.append((alpha * ds + (1 - alpha) * ls, d))
+    fused.sort(reverse=True)
+    return fused
+
+
+def fuse_hits(hit_lists: List[List[Dict]], top_k: int = 5, k: int = 60) -> List[Dict]:
+    """
+    Reciprocal rank fusion across several hit lists (e.g. one per plan step).
+    Chunks are deduplicated by id; each keeps its best dense score in "score"
+    and gets the fused score in "rrf_score".
+    """
+    fused: Dict[str, Dict] = {}
+    for hits in hit_lists:
+        for rank, h in enumerate(hits):
+            cur = fused.get(h["id"])
+            if cur is None:
+                cur = fused[h["id"]] = dict(h, rrf_score=0.0)
+            cur["rrf_score"] += 1.0 / (k + rank + 1)
+            cur["score"] = max(cur["score"], h["score"])
+    return sorted(fused.values(), key=lambda h: h["rrf_score"], reverse=True)[:top_k]
+
+def sync_index(vs: "VectorStore", folder: str = "docs/", path: str = "faiss.index") -> Dict:
+    """
+    Bring the index at `path` in line with `folder`, re-embedding only new or
+    changed documents. The manifest lives next to the index as `<path>.manifest.json`.
+    """
+    manifest_path = path + ".manifest.json"
+    incremental = os.path.exists(path) and os.path.exists(manifest_path)
+    if incremental and vs.index is None:
+        vs.load(path)
+    manifest = load_manifest(manifest_path) if incremental else {}
+    delta = ingest_changed_documents(folder, manifest)
+
+    dirty = bool(delta.chunks or delta.stale_sources)
+    if incremental:
+        if dirty:
+            vs.update(delta.chunks, delta.stale_sources)
+    elif delta.chunks:
+        vs.build(delta.chunks)
+
+    if vs.index is not None:
+        # tags.json is re-read on every sync; editing it alone re-saves the metadata
+        tags = load_tags(folder, list(delta.manifest["files"]))
+        retagged = tags != vs.tags
+        if retagged:
+            vs.set_tags(tags)
+        if dirty or not incremental or retagged:
+            vs.save(path)
+        save_manifest(delta.manifest, manifest_path)
+    return {
+        "added": len(delta.added),
+        "changed": len(delta.changed),
+        "removed": len(delta.removed),
+        "unchanged": len(delta.unchanged),
+        "chunks_embedded": len(delta.chunks),
+        "total_vectors": vs.ntotal,
+    }
+
+
+def sync_index_aside(vs: "VectorStore", folder: str = "docs/",
+                     path: str = "faiss.index") -> Tuple["VectorStore", Dict]:
+    """
+    sync_index into a fresh store (sharing `vs`'s model and embedding cache)
+    instead of updating `vs` in place, so searches running on `vs` are never
+    mutated under. Returns (new store, stats); the caller swaps its reference
+    and must not run two syncs of the same `path` at once.
+    """
+    new = vs.fresh()
+    return new, sync_index(new, folder, path)
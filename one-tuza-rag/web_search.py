@@ -1,9 +1,79 @@
 # web_search.py
-import wikipedia
-import requests
 import os
-from typing import List, Dict
+import json
+import time
+import hashlib
+import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
+from requests.adapters import HTTPAdapter
+from typing import List, Dict, Optional
+from telemetry import traced, incr
+
+# Endpoints are configurable so retrieval can be pointed at a local stub server.
+SERPAPI_URL = os.getenv("SERPAPI_URL", "https://serpapi.com/search")
+WIKIPEDIA_API_URL = os.getenv("WIKIPEDIA_API_URL", "https://en.wikipedia.org/w/api.php")
+WEB_MAX_WORKERS = int(os.getenv("WEB_MAX_WORKERS", "8"))
+WEB_REQUEST_TIMEOUT = float(os.getenv("WEB_REQUEST_TIMEOUT", "10"))   # per HTTP request
+WEB_DEADLINE = float(os.getenv("WEB_DEADLINE", "8"))                  # per provider call
+# on-disk response cache; set WEB_CACHE_DIR="" to disable
+WEB_CACHE_DIR = os.getenv("WEB_CACHE_DIR", ".web_cache")
+WEB_CACHE_TTL = float(os.getenv("WEB_CACHE_TTL", str(24 * 3600)))
+
+# one pooled session (keep-alive connections) and one bounded pool shared by all calls
+SESSION = requests.Session()
+SESSION.headers["User-Agent"] = "OneTuZa-RAG/1.0 (research agent)"
+SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=WEB_MAX_WORKERS))
+SESSION.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=WEB_MAX_WORKERS))
+_POOL = ThreadPoolExecutor(max_workers=WEB_MAX_WORKERS, thread_name_prefix="web")
+
+
+class ResponseCache:
+    """One JSON file per (provider, query, max_results), valid for `ttl` seconds."""
+
+    def __init__(self, cache_dir: str = WEB_CACHE_DIR, ttl: float = WEB_CACHE_TTL):
+        self.dir = cache_dir
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def _file(self, provider: str, query: str, max_results: int) -> str:
+        key = hashlib.sha256(f"{provider}\0{query.strip().lower()}\0{max_results}".encode("utf-8")).hexdigest()
+        return os.path.join(self.dir, provider, key + ".json")
 
+    def get(self, provider: str, query: str, max_results: int) -> Optional[List[Dict]]:
+        if not self.dir:
+            return None
+        path = self._file(provider, query, max_results)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            incr("rag_web_cache_misses_total", provider=provider)
+            return None
+        if time.time() - entry.get("ts", 0) > self.ttl:
+            self.misses += 1
+            incr("rag_web_cache_misses_total", provider=provider)
+            return None
+        self.hits += 1
+        incr("rag_web_cache_hits_total", provider=provider)
+        return entry["results"]
+
+    def put(self, provider: str, query: str, max_results: int, results: List[Dict]):
+        if not self.dir:
+            return
+        path = self._file(provider, query, max_results)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"ts": time.time(), "provider": provider, "query": query, "results": results}, f)
+        os.replace(tmp, path)
+
+
+CACHE = ResponseCache()
+
+
+@traced("web.serpapi_search")
 def serpapi_search(query: str, max_results: int = 3) -> List[Dict]:
     """
     Query SerpAPI (if key present). Try to return up to max_results items.
@@ -13,6 +83,9 @@ def serpapi_search(query: str, max_results: int = 3) -> List[Dict]:
     key = os.getenv("SERPAPI_API_KEY")
     if not key:
         return []
+    cached = CACHE.get("serpapi", query, max_results)
+    if cached is not None:
+        return cached
     params = {
         "q": query,
         "api_key": key,
@@ -21,7 +94,7 @@ def serpapi_search(query: str, max_results: int = 3) -> List[Dict]:
         "num": max_results * 3
     }
     try:
-        r = requests.get("https://serpapi.com/search", params=params, timeout=10)
+        r = SESSION.get(SERPAPI_URL, params=params, timeout=min(WEB_REQUEST_TIMEOUT, WEB_DEADLINE))
         r.raise_for_status()
     except Exception as e:
         print(f"[serpapi_search] request failed: {e}")
@@ -40,6 +113,8 @@ def serpapi_search(query: str, max_results: int = 3) -> List[Dict]:
         text = snippet.strip() or (f"See: {link}" if link else "")
         results.append({"source": link or f"serpapi:{title}", "title": title, "text": text})
 
+    if len(results) == max_results:
+        CACHE.put("serpapi", query, max_results, results)
     # pad with placeholders if we didn't get enough
     while len(results) < max_results:
         results.append({"source": "serpapi:placeholder", "title": "No result", "text": "No web result available."})
@@ -47,44 +122,90 @@ def serpapi_search(query: str, max_results: int = 3) -> List[Dict]:
     return results
 
 
+def _wiki_get(params: Dict) -> Dict:
+    r = SESSION.get(WIKIPEDIA_API_URL, params=dict(params, format="json", formatversion=2),
+                    timeout=WEB_REQUEST_TIMEOUT)
+    r.raise_for_status()
+    return r.json()
+
+
+def _wiki_extract(title: str) -> str:
+    """First 3 sentences of the article intro; falls back to the first 800 chars of the page."""
+    base = {"action": "query", "prop": "extracts", "explaintext": 1, "redirects": 1, "titles": title}
+    for extra in ({"exintro": 1, "exsentences": 3}, {"exchars": 800}):
+        pages = _wiki_get(dict(base, **extra)).get("query", {}).get("pages", [])
+        text = (pages[0].get("extract") or "").strip() if pages else ""
+        if text:
+            return text
+    return ""
+
+
+@traced("web.wikipedia_search")
 def wikipedia_search(query: str, max_results: int = 3) -> List[Dict]:
     """
-    Use the wikipedia package to search and return exactly max_results items (with placeholders if needed).
-    We fetch more candidates than requested and pick up to max_results successfully retrieved summaries.
+    Use the MediaWiki API to search and return exactly max_results items (with placeholders if needed).
+    Summaries of more candidates than requested are fetched concurrently. The call returns once the
+    top max_results successful ranks are settled: every higher rank has finished, so a lower rank only
+    stands in for a higher one that failed or had no summary. At the deadline it returns the best
+    ranks found so far (not cached, since that depends on timing).
     """
-    results: List[Dict] = []
+    cached = CACHE.get("wikipedia", query, max_results)
+    if cached is not None:
+        return cached
+    deadline = time.monotonic() + WEB_DEADLINE
+    # request more candidates to improve chance of getting max_results valid summaries
+    max_candidates = max(5, max_results * 4)
     try:
-        all_titles = wikipedia.search(query)
+        js = _wiki_get({"action": "query", "list": "search", "srsearch": query,
+                        "srlimit": max_candidates, "srprop": ""})
+        candidates = [h["title"] for h in js.get("query", {}).get("search", [])]
     except Exception as e:
         print(f"[wikipedia_search] search error: {e}")
         # return placeholders if search fails
         return [{"source": "wikipedia:placeholder", "title": "No result", "text": "Wikipedia search failed."}
                 for _ in range(max_results)]
 
-    # request more candidates to improve chance of getting max_results valid summaries
-    max_candidates = max(5, max_results * 4)
-    candidates = all_titles[:max_candidates]
+    found: Dict[int, Dict] = {}
+    finished = set()
 
-    for title in candidates:
-        if len(results) >= max_results:
-            break
-        text = ""
-        try:
-            text = wikipedia.summary(title, sentences=3)
-        except Exception as e1:
-            # try fetching page and use summary/content if possible
+    def settled() -> bool:
+        # ranks are settled up to the max_results-th success with no unfinished rank before it
+        n = 0
+        for rank in range(len(candidates)):
+            if rank not in finished:
+                return False
+            if rank in found:
+                n += 1
+                if n == max_results:
+                    return True
+        return True
+
+    futures = {_POOL.submit(_wiki_extract, title): rank for rank, title in enumerate(candidates)}
+    timed_out = False
+    try:
+        for fut in as_completed(futures, timeout=max(0.0, deadline - time.monotonic())):
+            rank = futures[fut]
+            finished.add(rank)
             try:
-                page = wikipedia.page(title, auto_suggest=False)
-                text = getattr(page, "summary", "") or (getattr(page, "content", "")[:800])
-            except Exception as e2:
-                # skip this candidate (we will use more candidates or placeholder later)
-                print(f"[wikipedia_search] could not fetch summary/page for '{title}': {e1} | {e2}")
+                text = fut.result()
+            except Exception as e:
+                # skip this candidate (a lower rank or a placeholder takes its place)
+                print(f"[wikipedia_search] could not fetch summary for '{candidates[rank]}': {e}")
                 text = ""
+            if text:
+                found[rank] = {"source": f"wikipedia:{candidates[rank]}", "title": candidates[rank], "text": text}
+            if settled():
+                break
+    except FuturesTimeout:
+        timed_out = True
+        print(f"[wikipedia_search] deadline of {WEB_DEADLINE}s reached with {len(found)} results")
+    finally:
+        for fut in futures:
+            fut.cancel()  # drop candidates that have not started yet
 
-        if text and text.strip():
-            results.append({"source": f"wikipedia:{title}", "title": title, "text": text.strip()})
-        # else continue to next candidate to try to fill results
-
+    results = [found[r] for r in sorted(found)][:max_results]
+    if len(results) == max_results and not timed_out:
+        CACHE.put("wikipedia", query, max_results, results)
     # if still not enough, pad with placeholders so UI receives predictable length
     while len(results) < max_results:
         results.append({"source": "wikipedia:placeholder", "title": "No result", "text": "No Wikipedia result available."})